@@ -1,11 +1,31 @@
-from flask import Flask, render_template_string, request, redirect, url_for, send_file, flash
+from flask import Flask, render_template, request, redirect, url_for, send_file, flash, get_flashed_messages, jsonify, g, Response, stream_with_context
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, tuple_, insert, update, delete
+from sqlalchemy.exc import IntegrityError, DataError, DBAPIError, StatementError
 # import pandas as pd  # Temporarily disabled
 import os
 import io
-from datetime import datetime
-import smtplib
+import re
+import csv
+import time
+import json
+import uuid
+import zlib
+import gzip
+import base64
+import hashlib
+import functools
+from datetime import datetime, timedelta, timezone
 from email.mime.text import MIMEText
+from smtp_pool import SMTPPool
+from cache import make_cache
+import db_config
+import metrics
+try:
+    import brotli  # optional: responses fall back to gzip without it
+except ImportError:
+    brotli = None
 
 # --- SMTP Config (set these to your email provider's values) ---
 SMTP_SERVER = 'smtp.example.com'
@@ -13,62 +33,97 @@ SMTP_PORT = 587
 SMTP_USERNAME = 'your_username@example.com'
 SMTP_PASSWORD = 'your_password'
 SENDER_EMAIL = 'your_username@example.com'
+SMTP_USE_TLS = True
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 4))
+
+# Authenticated sessions are kept open and shared by every send in this process
+mail_pool = SMTPPool(SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, max_connections=SMTP_POOL_SIZE, use_tls=SMTP_USE_TLS)
+
+def send_mail(recipient, subject, body):
+    msg_obj = MIMEText(body)
+    msg_obj['Subject'] = subject
+    msg_obj['From'] = SENDER_EMAIL
+    msg_obj['To'] = recipient
+    with metrics.timed('smtp'):
+        mail_pool.sendmail(SENDER_EMAIL, [recipient], msg_obj.as_string())
 
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'  # Needed for flash messages
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///crm.db'
+db_config.configure(app)  # DATABASE_URL, engine pool options
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
+with app.app_context():
+    db_config.install(db.engine)  # SQLite pragmas (WAL, busy_timeout, ...) on connect
+    metrics.install(app, db.engine)  # SQL/render/request timing, /metrics and Server-Timing
+
+RUN_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Rendered tabs and hot query results; CACHE_URL=redis://... shares them between processes
+cache = make_cache(os.environ.get('CACHE_URL'), ttl=int(os.environ.get('CACHE_TTL', 300)),
+                   max_entries=int(os.environ.get('CACHE_MAX_ENTRIES', 1024)))
 
 class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     phone = db.Column(db.String(20))
-    status = db.Column(db.String(20), default='Lead')  # Lead, Opportunity, Customer
+    status = db.Column(db.String(20), default='Lead', index=True)  # Lead, Opportunity, Customer
     notes = db.Column(db.Text, default='')
-    contacts = db.relationship('Contact', backref='customer', cascade="all, delete-orphan")
-    tasks = db.relationship('Task', backref='customer', cascade="all, delete-orphan")
-    deals = db.relationship('Deal', backref='customer', cascade="all, delete-orphan")
-    reminders = db.relationship('Reminder', backref='customer', cascade="all, delete-orphan")
+    # Per-row lazy loads of .customer raise instead of silently issuing N+1 SELECTs;
+    # queries that render the customer must eager-load it (see customer_eager).
+    # Children are removed by the database (ON DELETE CASCADE), not loaded and deleted one by one
+    contacts = db.relationship('Contact', backref=db.backref('customer', lazy='raise_on_sql'), cascade="all, delete-orphan", passive_deletes=True)
+    tasks = db.relationship('Task', backref=db.backref('customer', lazy='raise_on_sql'), cascade="all, delete-orphan", passive_deletes=True)
+    deals = db.relationship('Deal', backref=db.backref('customer', lazy='raise_on_sql'), cascade="all, delete-orphan", passive_deletes=True)
+    reminders = db.relationship('Reminder', backref=db.backref('customer', lazy='raise_on_sql'), cascade="all, delete-orphan", passive_deletes=True)
 
 class Contact(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id', ondelete='CASCADE'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120))
     phone = db.Column(db.String(20))
     role = db.Column(db.String(50))
 
 class Task(db.Model):
+    __table_args__ = (db.Index('ix_task_status_due_date', 'status', 'due_date'),
+                      db.Index('ix_task_status_due_date_id', 'status', 'due_date', 'id'),
+                      db.Index('ix_task_status_id', 'status', 'id'))
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id', ondelete='CASCADE'), nullable=False, index=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    due_date = db.Column(db.String(20))
+    due_date = db.Column(db.String(20), index=True)
     status = db.Column(db.String(20), default='Todo')  # Todo, In Progress, Done
 
 class Deal(db.Model):
+    __table_args__ = (db.Index('ix_deal_stage_status', 'stage', 'status'),
+                      db.Index('ix_deal_stage_amount', 'stage', 'amount'),
+                      db.Index('ix_deal_stage_id', 'stage', 'id'))
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id', ondelete='CASCADE'), nullable=False, index=True)
     title = db.Column(db.String(100), nullable=False)
     amount = db.Column(db.Float, default=0)
     stage = db.Column(db.String(50), default='New')  # New, Qualified, Won, Lost
-    status = db.Column(db.String(20), default='Open')  # Open, Closed
+    status = db.Column(db.String(20), default='Open', index=True)  # Open, Closed
 
 class Reminder(db.Model):
+    __table_args__ = (db.Index('ix_reminder_due_date_completed', 'due_date', 'completed'),
+                      db.Index('ix_reminder_due_date_id', 'due_date', 'id'))
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id', ondelete='CASCADE'), nullable=False, index=True)
     message = db.Column(db.String(200), nullable=False)
     due_date = db.Column(db.String(20))
-    completed = db.Column(db.Boolean, default=False)
+    completed = db.Column(db.Boolean, default=False, index=True)
 
 class Activity(db.Model):
+    __table_args__ = (db.Index('ix_activity_related', 'related_type', 'related_id'),
+                      db.Index('ix_activity_date_id', 'date', 'id'))
     id = db.Column(db.Integer, primary_key=True)
     subject = db.Column(db.String(200), nullable=False)
     type = db.Column(db.String(20), default='Call') # Call, Meeting, Task, Email
-    date = db.Column(db.String(20))
+    date = db.Column(db.String(20), index=True)
     related_type = db.Column(db.String(20)) # Customer, Deal, Lead
     related_id = db.Column(db.Integer)
     notes = db.Column(db.Text, default='')
@@ -80,119 +135,1134 @@ class Campaign(db.Model):
     start_date = db.Column(db.String(20))
     end_date = db.Column(db.String(20))
     status = db.Column(db.String(20), default='Draft')  # Draft, Active, Completed
-    steps = db.relationship('CampaignStep', backref='campaign', cascade="all, delete-orphan")
+    steps = db.relationship('CampaignStep', backref='campaign', cascade="all, delete-orphan", passive_deletes=True)
 
 class Segment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     filter_type = db.Column(db.String(20))  # e.g., 'Lead', 'Customer'
     filter_value = db.Column(db.String(100))
+    rules = db.Column(db.Text)  # JSON compound rules (see compile_segment_rules); replaces filter_type/filter_value
+    snapshot_at = db.Column(db.String(20))  # members frozen in segment_member at this time; None = evaluated live
+    member_count = db.Column(db.Integer)
+    members = db.relationship('SegmentMember', cascade="all, delete-orphan", passive_deletes=True)
+
+class SegmentMember(db.Model):
+    # Snapshot of a segment's resolved recipients (see snapshot_segment)
+    __table_args__ = (db.Index('ix_segment_member_segment_entity', 'segment_id', 'entity_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    segment_id = db.Column(db.Integer, db.ForeignKey('segment.id', ondelete='CASCADE'), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)  # Customer.id or Lead.id, per the segment's entity
+    email = db.Column(db.String(120))
 
 class CampaignStep(db.Model):
+    __table_args__ = (db.Index('ix_campaign_step_campaign_order', 'campaign_id', 'order'),)
     id = db.Column(db.Integer, primary_key=True)
-    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=False)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id', ondelete='CASCADE'), nullable=False)
     step_type = db.Column(db.String(20))  # Email, Wait
     details = db.Column(db.Text)  # JSON or text for email body, wait time, etc.
     order = db.Column(db.Integer, default=0)
 
 class CampaignLog(db.Model):
+    # One row per (campaign, segment, recipient, step): the send's outcome, and the
+    # lock that keeps it from being sent twice (see worker.reserve_sends)
+    __table_args__ = (db.Index('ix_campaign_log_campaign_status', 'campaign_id', 'status'),
+                      db.Index('ux_campaign_log_send', 'campaign_id', 'segment_id', 'recipient_email', 'step_id', unique=True))
     id = db.Column(db.Integer, primary_key=True)
     campaign_id = db.Column(db.Integer)
     segment_id = db.Column(db.Integer)
     recipient_email = db.Column(db.String(120))
     step_id = db.Column(db.Integer)
-    status = db.Column(db.String(20))  # Sent, Failed, Completed
+    status = db.Column(db.String(20))  # Sending, Sent, Failed, Completed
     timestamp = db.Column(db.String(20))
 
+class CampaignRun(db.Model):
+    # Durable job queue for campaign sends, consumed by worker.py
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer)
+    segment_id = db.Column(db.Integer)
+    status = db.Column(db.String(20), default='Queued', index=True)  # Queued, Running, Scheduled, Completed, Failed
+    total = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text, default='')
+    created_at = db.Column(db.String(20))
+    started_at = db.Column(db.String(20))
+    finished_at = db.Column(db.String(20))
+    heartbeat_at = db.Column(db.String(20))
+
+class ScheduledSend(db.Model):
+    # One pending email per (run, recipient, step), due at run start plus the Wait
+    # steps before it. worker.py deletes each row once its send is logged, so the
+    # table only holds outstanding work; (status, due_at) finds the due ones.
+    __table_args__ = (db.Index('ix_scheduled_send_status_due_at', 'status', 'due_at'),
+                      db.Index('ix_scheduled_send_run_id', 'run_id'))
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, nullable=False)
+    step_id = db.Column(db.Integer, nullable=False)
+    recipient_email = db.Column(db.String(120))
+    due_at = db.Column(db.String(20), nullable=False)  # RUN_TIME_FORMAT
+    status = db.Column(db.String(20), default='Pending')  # Pending, Sending (claimed by a worker)
+    claimed_at = db.Column(db.String(20))
+
+class ImportJob(db.Model):
+    # CSV uploads queued for worker.py; the file is kept under IMPORT_DIR until the job finishes
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20))  # customers, leads, contacts
+    path = db.Column(db.String(255))
+    filename = db.Column(db.String(255))
+    status = db.Column(db.String(20), default='Queued', index=True)  # Queued, Running, Completed, Failed
+    total_bytes = db.Column(db.Integer, default=0)
+    processed_bytes = db.Column(db.Integer, default=0)
+    rows_processed = db.Column(db.Integer, default=0)
+    inserted = db.Column(db.Integer, default=0)
+    updated = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text, default='')
+    created_at = db.Column(db.String(20))
+    started_at = db.Column(db.String(20))
+    finished_at = db.Column(db.String(20))
+    heartbeat_at = db.Column(db.String(20))
+
+class ImportRowError(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, index=True)
+    line = db.Column(db.Integer)
+    message = db.Column(db.String(255))
+
 class Lead(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     phone = db.Column(db.String(20))
     company = db.Column(db.String(100))
-    status = db.Column(db.String(20), default='New')  # New, Assigned, Converted, Lost
+    status = db.Column(db.String(20), default='New', index=True)  # New, Assigned, Converted, Lost
     notes = db.Column(db.Text, default='')
 
+class TableVersion(db.Model):
+    # Write counter per table, bumped in the same transaction as the write (see bump_table_versions)
+    __tablename__ = 'table_version'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.String(20))  # UTC, RUN_TIME_FORMAT
+
+# --- Schema migrations ---
+# db.create_all() only creates missing tables. Changes to existing tables are
+# registered here with an increasing version, applied in order on startup (or
+# with `flask upgrade-db`) and recorded in schema_version. Each migration runs in
+# its own transaction and must be safe to re-run.
+MIGRATIONS = []
+
+def migration(version):
+    def register(fn):
+        MIGRATIONS.append((version, fn))
+        return fn
+    return register
+
+def create_indexes(conn, *names):
+    # Create indexes declared on the models, by name, if the database lacks them
+    declared = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    for name in names:
+        declared[name].create(conn, checkfirst=True)
+
+@migration(1)
+def add_hot_column_indexes(conn):
+    create_indexes(conn,
+                   'ix_customer_status', 'ix_lead_status',
+                   'ix_contact_customer_id', 'ix_task_customer_id', 'ix_deal_customer_id', 'ix_reminder_customer_id',
+                   'ix_task_status_due_date', 'ix_task_due_date',
+                   'ix_deal_stage_status', 'ix_deal_status',
+                   'ix_reminder_due_date_completed', 'ix_reminder_completed',
+                   'ix_activity_date', 'ix_activity_related',
+                   'ix_campaign_step_campaign_order', 'ix_campaign_log_campaign_status', 'ix_campaign_run_status')
+
+SCHEMA_LOCK_KEY = zlib.crc32(b'mukera.upgrade_schema')  # PostgreSQL advisory lock id
+
+def lock_schema(conn):
+    # Every process runs upgrade_schema at import: take the database's write lock before
+    # reading schema_version, so a second process waits for the first one's migration to
+    # commit and then finds it applied, instead of both running it
+    if conn.dialect.name == 'sqlite':
+        conn.exec_driver_sql('BEGIN IMMEDIATE')  # pysqlite has not begun yet: this is the first statement
+    elif conn.dialect.name == 'postgresql':
+        conn.execute(db.text('SELECT pg_advisory_xact_lock(:key)'), {'key': SCHEMA_LOCK_KEY})
+
+def upgrade_schema():
+    with db.engine.begin() as conn:
+        lock_schema(conn)
+        db.metadata.create_all(conn)
+        conn.execute(db.text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, applied_at VARCHAR(20))'))
+    for version, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        with db.engine.begin() as conn:
+            lock_schema(conn)
+            if conn.execute(db.text('SELECT 1 FROM schema_version WHERE version = :v'), {'v': version}).first():
+                continue
+            fn(conn)
+            conn.execute(db.text('INSERT INTO schema_version (version, applied_at) VALUES (:v, :t)'),
+                         {'v': version, 't': datetime.now().strftime('%Y-%m-%d %H:%M')})
+
+# --- Full-text search (SQLite FTS5) ---
+# One FTS5 table covers every searchable entity. Its rowid is id * 4 + kind, so the
+# triggers that keep it in sync update a single row by primary key.
+SEARCH_SOURCES = {
+    # entity: (kind, table, columns feeding name/email/company/notes; None for blank)
+    'customer': (0, 'customer', ('name', 'email', None, 'notes')),
+    'lead': (1, 'lead', ('name', 'email', 'company', 'notes')),
+    'contact': (2, 'contact', ('name', 'email', None, 'role')),
+    'activity': (3, 'activity', ('subject', None, None, 'notes')),
+}
+SEARCH_KINDS = len(SEARCH_SOURCES)
+# bm25 is computed per matching row, so a short prefix matching tens of thousands of
+# rows ranks only its newest this many matches; typing more narrows it to an exact ranking
+SEARCH_RANK_CANDIDATES = 500
+
+def search_row_sql(entity, row=''):
+    # "rowid, name, email, company, notes, entity" values read from a source row
+    kind, table, columns = SEARCH_SOURCES[entity]
+    values = ['%sid * %d + %d' % (row, SEARCH_KINDS, kind)]
+    values += [row + column if column else "''" for column in columns]
+    values.append("'%s'" % entity)
+    return ', '.join(values)
+
+def create_search_triggers(conn, entity):
+    kind, table, columns = SEARCH_SOURCES[entity]
+    insert = 'INSERT INTO search_index (rowid, name, email, company, notes, entity) VALUES (%s);' % search_row_sql(entity, 'new.')
+    delete = 'DELETE FROM search_index WHERE rowid = old.id * %d + %d;' % (SEARCH_KINDS, kind)
+    conn.execute(db.text('CREATE TRIGGER IF NOT EXISTS %s_search_ai AFTER INSERT ON "%s" BEGIN %s END' % (table, table, insert)))
+    conn.execute(db.text('CREATE TRIGGER IF NOT EXISTS %s_search_au AFTER UPDATE ON "%s" BEGIN %s %s END' % (table, table, delete, insert)))
+    conn.execute(db.text('CREATE TRIGGER IF NOT EXISTS %s_search_ad AFTER DELETE ON "%s" BEGIN %s END' % (table, table, delete)))
+
+@migration(2)
+def add_search_index(conn):
+    if conn.dialect.name != 'sqlite':
+        return  # other databases fall back to ILIKE search
+    if conn.execute(db.text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).first():
+        return
+    conn.execute(db.text("""CREATE VIRTUAL TABLE search_index USING fts5(
+        name, email, company, notes, entity UNINDEXED, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"""))
+    for entity, (kind, table, columns) in SEARCH_SOURCES.items():
+        conn.execute(db.text('INSERT INTO search_index (rowid, name, email, company, notes, entity) SELECT %s FROM "%s"'
+                             % (search_row_sql(entity), table)))
+        create_search_triggers(conn, entity)
+
+@migration(3)
+def add_pipeline_summary_index(conn):
+    # Covers the per-stage count/sum so the pipeline summary is an index-only scan
+    create_indexes(conn, 'ix_deal_stage_amount')
+
+def add_missing_columns(conn, table, columns):
+    # columns: [(name, SQL type)] added with ALTER TABLE unless already present
+    existing = {c['name'] for c in db.inspect(conn).get_columns(table)}
+    for name, sql_type in columns:
+        if name not in existing:
+            conn.execute(db.text('ALTER TABLE "%s" ADD COLUMN %s %s' % (table, name, sql_type)))
+
+@migration(4)
+def add_table_version_updated_at(conn):
+    # Last-Modified for conditional GETs comes from the time of the last bump
+    add_missing_columns(conn, 'table_version', [('updated_at', 'VARCHAR(20)')])
+
+@migration(5)
+def add_segment_rules(conn):
+    add_missing_columns(conn, 'segment', [('rules', 'TEXT'), ('snapshot_at', 'VARCHAR(20)'), ('member_count', 'INTEGER')])
+
+@migration(6)
+def dedupe_campaign_log(conn):
+    # Keep one row per send before the unique index goes on: the first Sent one
+    # if there is one (that recipient got the email), else the first row
+    conn.execute(db.text(
+        "DELETE FROM campaign_log WHERE id NOT IN ("
+        "SELECT COALESCE(MIN(CASE WHEN status = 'Sent' THEN id END), MIN(id)) FROM campaign_log "
+        "GROUP BY campaign_id, segment_id, recipient_email, step_id)"))
+    create_indexes(conn, 'ux_campaign_log_send')
+
+# child table -> parent table, for the foreign keys that migration 7 turns into ON DELETE CASCADE
+CASCADE_FOREIGN_KEYS = {'contact': 'customer', 'task': 'customer', 'deal': 'customer', 'reminder': 'customer',
+                        'campaign_step': 'campaign'}
+
+def cascades(conn, table, parent):
+    return any(fk['referred_table'] == parent and (fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE'
+               for fk in db.inspect(conn).get_foreign_keys(table))
+
+def rebuild_sqlite_table(conn, name, keep):
+    # SQLite cannot alter a constraint: build the table as the model now declares it and
+    # copy the rows (those matching keep) across. Its indexes and triggers go first, so
+    # the names are free for the new table; the caller recreates any triggers.
+    for kind, item in conn.execute(db.text("SELECT type, name FROM sqlite_master WHERE tbl_name = :t "
+                                           "AND type IN ('index', 'trigger') AND sql IS NOT NULL"), {'t': name}).all():
+        conn.execute(db.text('DROP %s "%s"' % (kind.upper(), item)))
+    old = name + '_old'
+    conn.execute(db.text('ALTER TABLE "%s" RENAME TO "%s"' % (name, old)))
+    table = db.metadata.tables[name]
+    table.create(conn)  # with its indexes
+    old_columns = {c['name'] for c in db.inspect(conn).get_columns(old)}
+    columns = ', '.join('"%s"' % c.name for c in table.columns if c.name in old_columns)
+    conn.execute(db.text('INSERT INTO "%s" (%s) SELECT %s FROM "%s" WHERE %s' % (name, columns, columns, old, keep)))
+    conn.execute(db.text('DROP TABLE "%s"' % old))
+
+@migration(7)
+def cascade_child_deletes(conn):
+    # Deleting a customer (or campaign) removes its children in the database instead of
+    # the ORM loading and deleting them row by row
+    for table, parent in CASCADE_FOREIGN_KEYS.items():
+        if cascades(conn, table, parent):
+            continue
+        (fk,) = [fk for fk in db.metadata.tables[table].foreign_keys if fk.column.table.name == parent]
+        if conn.dialect.name != 'sqlite':
+            for existing in db.inspect(conn).get_foreign_keys(table):
+                if existing['referred_table'] == parent and existing['name']:
+                    conn.execute(db.text('ALTER TABLE "%s" DROP CONSTRAINT "%s"' % (table, existing['name'])))
+            conn.execute(db.text('ALTER TABLE "%s" ADD FOREIGN KEY (%s) REFERENCES "%s" (id) ON DELETE CASCADE'
+                                 % (table, fk.parent.name, parent)))
+            continue
+        # Rows whose parent is already gone (SQLite never enforced the key) would violate it: drop them
+        rebuild_sqlite_table(conn, table, '%s IN (SELECT id FROM "%s")' % (fk.parent.name, parent))
+        for entity, (kind, source, columns) in SEARCH_SOURCES.items():
+            if source == table and conn.execute(db.text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).first():
+                conn.execute(db.text('DELETE FROM search_index WHERE rowid %% %d = %d AND rowid / %d NOT IN (SELECT id FROM "%s")'
+                                     % (SEARCH_KINDS, kind, SEARCH_KINDS, table)))
+                create_search_triggers(conn, entity)
+
+@migration(8)
+def add_keyset_indexes(conn):
+    # Filtered list pages seek and sort on (filter columns..., id): with id last in the
+    # index a page is a range scan instead of sorting every matching row
+    create_indexes(conn, 'ix_task_status_due_date_id', 'ix_task_status_id', 'ix_deal_stage_id',
+                   'ix_reminder_due_date_id', 'ix_activity_date_id')
+
+def search_available():
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    with db.engine.connect() as conn:
+        return conn.execute(db.text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).first() is not None
+
+def fts_match(q):
+    # Every word must match, each as a prefix: 'jo exa' -> "jo"* "exa"*
+    terms = re.findall(r'\w+', q or '')
+    return ' '.join('"%s"*' % t for t in terms)
+
+def search_ids(entity, q, columns=None):
+    # Subquery of matching ids for one entity, usable in Model.id.in_(...); columns limits
+    # the match to those index columns, e.g. ('name', 'email')
+    kind = SEARCH_SOURCES[entity][0]
+    match = fts_match(q)
+    if columns:
+        match = '{%s} : (%s)' % (' '.join(columns), match)
+    return (db.select(db.literal_column('rowid / %d' % SEARCH_KINDS))
+            .select_from(db.text('search_index'))
+            .where(db.text('search_index MATCH :match AND rowid %% %d = %d' % (SEARCH_KINDS, kind)).bindparams(match=match)))
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables and apply pending schema migrations."""
+    upgrade_schema()
+
 with app.app_context():
-    db.create_all()
+    upgrade_schema()
+    FULL_TEXT_SEARCH = search_available()
 
-@app.route('/', methods=['GET', 'POST'])
-def home():
-    tab = request.args.get('tab', 'customers')
-    # Always define deals_by_stage for template context
-    deal_stages = ['New', 'Qualified', 'Proposal', 'Negotiation', 'Won', 'Lost']
-    deals_by_stage = {stage: [] for stage in deal_stages}
-    for d in Deal.query.all():
-        deals_by_stage.get(d.stage, []).append(d)
-    # Leads logic
-    leads = Lead.query.all()
-    # Activities logic
-    activities = Activity.query.order_by(Activity.date).all()
-    activities_by_date = {}
-    for a in activities:
-        activities_by_date.setdefault(a.date, []).append(a)
-    # Marketing logic
-    campaigns = Campaign.query.all()
-    segments = Segment.query.all()
+DEAL_STAGES = ['New', 'Qualified', 'Proposal', 'Negotiation', 'Won', 'Lost']
+# Share of a stage's amount expected to close, for the weighted pipeline value
+STAGE_WEIGHTS = {'New': 0.1, 'Qualified': 0.25, 'Proposal': 0.5, 'Negotiation': 0.75, 'Won': 1.0, 'Lost': 0.0}
+PIPELINE_PAGE_SIZE = 20
+
+# --- Filtered queries shared by the tab loaders ---
+def customer_eager(model):
+    # Joined eager load of the parent customer for rows that render {{x.customer.name}}
+    return db.joinedload(model.customer, innerjoin=True)
+
+def customers_query(args):
+    query = Customer.query
+    search = args.get('search', '')
+    if search and FULL_TEXT_SEARCH:
+        # Name and email only, as the box says and as the ILIKE fallback below matches
+        query = query.filter(Customer.id.in_(search_ids('customer', search, ('name', 'email')))) if fts_match(search) else query.filter(False)
+    elif search:
+        query = query.filter((Customer.name.ilike(f'%{search}%')) | (Customer.email.ilike(f'%{search}%')))
+    return query
+
+def contacts_query(args):
+    query = Contact.query
+    contact_customer_filter = args.get('contact_customer', '')
+    if contact_customer_filter:
+        query = query.filter(Contact.customer_id == contact_customer_filter)
+    return query
+
+def tasks_query(args):
+    query = Task.query
+    task_status_filter = args.get('task_status', '')
+    task_due_filter = args.get('task_due', '')
+    if task_status_filter:
+        query = query.filter(Task.status == task_status_filter)
+    if task_due_filter:
+        query = query.filter(Task.due_date == task_due_filter)
+    return query
+
+def deals_query(args):
+    query = Deal.query
+    deal_stage_filter = args.get('deal_stage', '')
+    deal_status_filter = args.get('deal_status', '')
+    if deal_stage_filter:
+        query = query.filter(Deal.stage == deal_stage_filter)
+    if deal_status_filter:
+        query = query.filter(Deal.status == deal_status_filter)
+    return query
+
+def reminders_query(args):
+    query = Reminder.query
+    reminder_due_filter = args.get('reminder_due', '')
+    reminder_completed_filter = args.get('reminder_completed', '')
+    if reminder_due_filter:
+        query = query.filter(Reminder.due_date == reminder_due_filter)
+    if reminder_completed_filter:
+        query = query.filter(Reminder.completed == (reminder_completed_filter == 'yes'))
+    return query
+
+def leads_query(args):
+    return Lead.query
+
+def activities_query(args):
+    return Activity.query
+
+def campaign_logs_query(args):
+    query = CampaignLog.query
+    if args.get('campaign_id'):
+        query = query.filter(CampaignLog.campaign_id == args.get('campaign_id'))
+    if args.get('log_status'):
+        query = query.filter(CampaignLog.status == args.get('log_status'))
+    return query
+
+# --- Keyset pagination shared by every list view ---
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+class KeysetPage:
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, prefix=''):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.prefix = prefix
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    return values if isinstance(values, list) else None
+
+def page_size(args, prefix=''):
+    try:
+        per_page = int(args.get(prefix + 'per_page', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        per_page = DEFAULT_PAGE_SIZE
+    return max(1, min(per_page, MAX_PAGE_SIZE))
+
+def seek_ranges(keys, values, forward):
+    """Conditions for the rows after (forward) or before values, in the order keys ASC, NULLs first.
+
+    Only the first key may be NULL. Each condition is one index range on the bare
+    columns, listed in page order; a NULL first key needs a second range because
+    `(a, id) < (:a, :id) OR a IS NULL` is no longer a range and makes the database scan.
+    """
+    first, rest = keys[0], keys[1:]
+    if values[0] is None:
+        # At a NULL first key: continue among the NULLs, then (forward) on to the non-NULL rows
+        within = [db.and_(first.is_(None), *seek_ranges(rest, values[1:], forward))] if rest else []
+        return within + [first.is_not(None)] if forward else within
+    if forward:
+        return [tuple_(*keys) > tuple_(*values)]  # a NULL first key compares as unknown: left out
+    return [tuple_(*keys) < tuple_(*values)] + ([first.is_(None)] if first.expression.nullable else [])
+
+def keyset_paginate(query, keys, args, prefix=''):
+    """Seek to the page after/before the cursor in args instead of using OFFSET.
+
+    keys are the sort columns; the last one must be unique (usually the primary key).
+    NULLs of a nullable first key sort first (see seek_ranges).
+    """
+    per_page = page_size(args, prefix)
+    nullable = [k.expression.nullable for k in keys]
+    after = decode_cursor(args.get(prefix + 'after'))
+    before = decode_cursor(args.get(prefix + 'before'))
+    ranges = [None]
+    if before is not None and len(before) == len(keys):
+        ranges = seek_ranges(keys, before, forward=False)
+        query = query.order_by(*[k.desc().nulls_last() if n else k.desc() for k, n in zip(keys, nullable)])
+    else:
+        before = None
+        if after is not None and len(after) == len(keys):
+            ranges = seek_ranges(keys, after, forward=True)
+        else:
+            after = None
+        query = query.order_by(*[k.asc().nulls_first() if n else k for k, n in zip(keys, nullable)])
+    items = []
+    for condition in ranges:
+        if len(items) > per_page:
+            break
+        ranged = query if condition is None else query.filter(condition)
+        items += ranged.limit(per_page + 1 - len(items)).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if before is not None:
+        items.reverse()
+
+    def cursor(item):
+        return encode_cursor([getattr(item, k.key) for k in keys])
+
+    next_cursor = prev_cursor = None
+    if items:
+        if before is not None or has_more:
+            next_cursor = cursor(items[-1])
+        if after is not None or (before is not None and has_more):
+            prev_cursor = cursor(items[0])
+    return KeysetPage(items, per_page, next_cursor, prev_cursor, prefix)
+
+@app.template_global()
+def page_url(**overrides):
+    # Current URL with some query args replaced (None drops the arg)
+    args = request.args.to_dict()
+    for key, value in overrides.items():
+        if value is None:
+            args.pop(key, None)
+        else:
+            args[key] = value
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+# --- Cache invalidation ---
+# Every write bumps table_version for the tables it touched, inside the writing
+# transaction, so all processes (web and worker) see the new version together with
+# the new rows. Cache keys embed the versions of the tables a value was read from;
+# a write makes the old entries unreachable instead of deleting them.
+def bump_table_versions(connection, tables):
+    now = datetime.now(timezone.utc).strftime(RUN_TIME_FORMAT)
+    connection.execute(db.text(
+        'INSERT INTO table_version (name, version, updated_at) VALUES (:name, 1, :now) '
+        'ON CONFLICT (name) DO UPDATE SET version = table_version.version + 1, updated_at = excluded.updated_at'),
+        [{'name': name, 'now': now} for name in sorted(tables)])
+
+def cascaded_tables(table):
+    # The table and every table whose rows a delete from it removes through ON DELETE CASCADE
+    tables = {table}
+    for child in db.metadata.sorted_tables:
+        if any(fk.ondelete == 'CASCADE' and fk.column.table.name == table for fk in child.foreign_keys):
+            tables |= cascaded_tables(child.name)
+    return tables
+
+def mark_written(mapper, connection, target):
+    session = db.object_session(target)
+    if session is not None and (mapper.local_table.name != 'table_version'):
+        session.info.setdefault('written_tables', set()).add(mapper.local_table.name)
+
+def mark_deleted(mapper, connection, target):
+    # Children removed by the database fire no mapper events of their own
+    session = db.object_session(target)
+    if session is not None:
+        session.info.setdefault('written_tables', set()).update(cascaded_tables(mapper.local_table.name))
+
+def mark_updated(mapper, connection, target):
+    # after_update also fires for dirty objects whose columns did not actually change
+    session = db.object_session(target)
+    if session is not None and session.is_modified(target, include_collections=False):
+        mark_written(mapper, connection, target)
+
+db.event.listen(db.Model, 'after_insert', mark_written, propagate=True)
+db.event.listen(db.Model, 'after_update', mark_updated, propagate=True)
+db.event.listen(db.Model, 'after_delete', mark_deleted, propagate=True)
+
+@db.event.listens_for(db.session, 'after_flush')
+def bump_flushed_tables(session, flush_context):
+    tables = session.info.pop('written_tables', None)
+    if tables:
+        bump_table_versions(session.connection(), tables)
+
+@db.event.listens_for(db.session, 'do_orm_execute')
+def bump_bulk_statement_table(state):
+    # Bulk insert()/update()/delete() statements bypass the mapper events above
+    if state.is_insert or state.is_update:
+        bump_table_versions(state.session.connection(), [state.statement.table.name])
+    elif state.is_delete:
+        bump_table_versions(state.session.connection(), cascaded_tables(state.statement.table.name))
+
+def table_state(tables):
+    """(version of each table, UTC datetime of the latest write or None)."""
+    rows = db.session.execute(db.select(TableVersion.name, TableVersion.version, TableVersion.updated_at)
+                              .where(TableVersion.name.in_(tables))).all()
+    versions = {name: version for name, version, _ in rows}
+    updated = max((u for _, _, u in rows if u), default=None)
+    last_modified = datetime.strptime(updated, RUN_TIME_FORMAT).replace(tzinfo=timezone.utc) if updated else None
+    return tuple(versions.get(name, 0) for name in tables), last_modified
+
+def table_versions(tables):
+    return table_state(tables)[0]
+
+def cached_query(*tables):
+    """Cache a query function's result per arguments until one of tables is written."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            key = 'query:%s:%r:%r' % (fn.__name__, args, table_versions(tables))
+            result = cache.get(key)
+            if result is None:
+                result = fn(*args)
+                cache.set(key, result)
+            return result
+        return wrapper
+    return decorate
+
+@cached_query('campaign_log')
+def campaign_report_stats(campaign_id):
+    # Counts per (step, hour, status) come back from one GROUP BY; the totals and
+    # breakdowns are folded from those few rows instead of from every log row.
+    # Distinct recipients cannot be summed from the groups (a recipient spans steps
+    # and hours), so that count rides along as an uncorrelated subquery, which the
+    # database evaluates once, answered from the ux_campaign_log_send index.
+    hour = func.substr(CampaignLog.timestamp, 1, 13)
+    targeted = (db.select(func.count(func.distinct(CampaignLog.recipient_email)))
+                .where(CampaignLog.campaign_id == campaign_id)
+                .scalar_subquery())
+    rows = (db.session.query(CampaignLog.step_id, hour, CampaignLog.status, func.count(), targeted)
+            .filter(CampaignLog.campaign_id == campaign_id)
+            .group_by(CampaignLog.step_id, hour, CampaignLog.status)
+            .all())
+    stats = {'targeted': rows[0][4] if rows else 0, 'total': 0, 'sent': 0, 'failed': 0, 'completed': 0}
+    by_step, by_hour = {}, {}
+    for step_id, hour_, status, count, _ in rows:
+        key = (status or '').lower()
+        stats['total'] += count
+        if key in ('sent', 'failed', 'completed'):
+            stats[key] += count
+        for bucket in (by_step.setdefault(step_id, {'step_id': step_id}), by_hour.setdefault(hour_, {'hour': hour_})):
+            bucket[key] = bucket.get(key, 0) + count
+            bucket['total'] = bucket.get('total', 0) + count
+    stats['by_step'] = [by_step[k] for k in sorted(by_step, key=lambda k: (k is None, k))]
+    stats['by_hour'] = [by_hour[k] for k in sorted(by_hour, key=lambda k: (k is None, k))]
+    return stats
+
+# --- Segment rules ---
+# A segment's rules are JSON, compiled into a single WHERE clause (EXISTS subqueries
+# for related rows), so resolving recipients is one query returning id and email:
+#   {"entity": "Customer", "all": [
+#       {"field": "status", "op": "in", "value": ["Opportunity", "Customer"]},
+#       {"field": "has_open_deal", "value": true},
+#       {"any": [{"field": "activity_date", "op": "within_days", "value": 30},
+#                {"not": {"field": "email", "op": "endswith", "value": "@example.com"}}]}]}
+# Groups nest with "all", "any" and "not"; SEGMENT_FIELDS lists the fields of each entity.
+SEGMENT_ENTITIES = {'Customer': Customer, 'Lead': Lead}
+SEGMENT_BATCH_SIZE = 1000
+
+class SegmentRuleError(ValueError):
+    pass
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+# kind: {op: (value type, condition on the column)}
+SEGMENT_OPS = {
+    'text': {
+        'eq': ('str', lambda c, v: c == v),
+        'ne': ('str', lambda c, v: db.or_(c.is_(None), c != v)),
+        'in': ('strs', lambda c, v: c.in_(v)),
+        'not_in': ('strs', lambda c, v: db.or_(c.is_(None), c.not_in(v))),
+        'contains': ('str', lambda c, v: c.icontains(v, autoescape=True)),
+        'startswith': ('str', lambda c, v: c.istartswith(v, autoescape=True)),
+        'endswith': ('str', lambda c, v: c.iendswith(v, autoescape=True)),
+        'empty': ('bool', lambda c, v: (func.coalesce(c, '') == '') if v else (func.coalesce(c, '') != '')),
+    },
+    'date': {  # dates are stored as YYYY-MM-DD strings, which compare in date order
+        'on': ('date', lambda c, v: c == v),
+        'before': ('date', lambda c, v: c < v),
+        'after': ('date', lambda c, v: c > v),
+        'between': ('dates', lambda c, v: c.between(v[0], v[1])),
+        'within_days': ('days', lambda c, v: c >= days_ago(v)),
+    },
+    'number': {
+        'eq': ('number', lambda c, v: c == v),
+        'gt': ('number', lambda c, v: c > v),
+        'gte': ('number', lambda c, v: c >= v),
+        'lt': ('number', lambda c, v: c < v),
+        'lte': ('number', lambda c, v: c <= v),
+    },
+    'flag': {
+        'is': ('bool', None),
+    },
+}
+SEGMENT_VALUES = {
+    'str': lambda v: isinstance(v, str),
+    'strs': lambda v: isinstance(v, list) and bool(v) and all(isinstance(x, str) for x in v),
+    'bool': lambda v: isinstance(v, bool),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'days': lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 0,
+    'date': lambda v: isinstance(v, str) and re.fullmatch(r'\d{4}-\d{2}-\d{2}', v) is not None,
+    'dates': lambda v: isinstance(v, list) and len(v) == 2 and all(SEGMENT_VALUES['date'](x) for x in v),
+}
+# entity: {field: (kind, column, condition linking related rows to the entity row or None)}
+SEGMENT_FIELDS = {
+    'Customer': {
+        'name': ('text', Customer.name, None),
+        'email': ('text', Customer.email, None),
+        'phone': ('text', Customer.phone, None),
+        'status': ('text', Customer.status, None),
+        'notes': ('text', Customer.notes, None),
+        'has_open_deal': ('flag', Deal.id, db.and_(Deal.customer_id == Customer.id, Deal.status == 'Open')),
+        'deal_stage': ('text', Deal.stage, Deal.customer_id == Customer.id),
+        'deal_amount': ('number', Deal.amount, Deal.customer_id == Customer.id),
+        'open_task_due': ('date', Task.due_date, db.and_(Task.customer_id == Customer.id, Task.status != 'Done')),
+        'activity_date': ('date', Activity.date, db.and_(Activity.related_type == 'Customer', Activity.related_id == Customer.id)),
+    },
+    'Lead': {
+        'name': ('text', Lead.name, None),
+        'email': ('text', Lead.email, None),
+        'phone': ('text', Lead.phone, None),
+        'company': ('text', Lead.company, None),
+        'status': ('text', Lead.status, None),
+        'notes': ('text', Lead.notes, None),
+        'activity_date': ('date', Activity.date, db.and_(Activity.related_type == 'Lead', Activity.related_id == Lead.id)),
+    },
+}
+
+def compile_segment_condition(entity, rule):
+    if not isinstance(rule, dict):
+        raise SegmentRuleError('a rule must be an object, got %r' % (rule,))
+    groups = [key for key in ('all', 'any', 'not') if key in rule]
+    if groups:
+        if len(rule) != 1:
+            raise SegmentRuleError('a group takes exactly one of all/any/not, got %s' % ', '.join(sorted(rule)))
+        if groups[0] == 'not':
+            return db.not_(compile_segment_condition(entity, rule['not']))
+        parts = rule[groups[0]]
+        if not isinstance(parts, list):
+            raise SegmentRuleError('"%s" must be a list of rules' % groups[0])
+        parts = [compile_segment_condition(entity, part) for part in parts]
+        return db.and_(db.true(), *parts) if groups[0] == 'all' else db.or_(db.false(), *parts)
+    field = rule.get('field')
+    if field not in SEGMENT_FIELDS[entity]:
+        raise SegmentRuleError('unknown field %r for %s segments' % (field, entity))
+    kind, column, link = SEGMENT_FIELDS[entity][field]
+    op = rule.get('op', 'is' if kind == 'flag' else 'eq')
+    if op not in SEGMENT_OPS[kind]:
+        raise SegmentRuleError('%s does not support op %r (use %s)' % (field, op, ', '.join(SEGMENT_OPS[kind])))
+    value_type, build = SEGMENT_OPS[kind][op]
+    value = rule.get('value', True if kind == 'flag' else None)
+    if not SEGMENT_VALUES[value_type](value):
+        raise SegmentRuleError('%s %s: invalid value %r' % (field, op, value))
+    if kind == 'flag':
+        exists = db.exists().where(link)
+        return exists if value else ~exists
+    condition = build(column, value)
+    return condition if link is None else db.exists().where(link, condition)
+
+def compile_segment_rules(rules):
+    """(model, WHERE clause) for a rules object; raises SegmentRuleError if it is malformed."""
+    if not isinstance(rules, dict) or rules.get('entity') not in SEGMENT_ENTITIES:
+        raise SegmentRuleError('rules need "entity": one of %s' % ', '.join(SEGMENT_ENTITIES))
+    entity = rules['entity']
+    condition = {k: v for k, v in rules.items() if k != 'entity'}
+    return SEGMENT_ENTITIES[entity], compile_segment_condition(entity, condition) if condition else db.true()
+
+def parse_segment_rules(text):
+    try:
+        rules = json.loads(text)
+    except ValueError:
+        raise SegmentRuleError('rules are not valid JSON')
+    compile_segment_rules(rules)
+    return rules
+
+def segment_rules(segment):
+    # Segments without rules keep their single filter_type/filter_value meaning
+    if segment.rules:
+        return parse_segment_rules(segment.rules)
+    entity = 'Lead' if segment.filter_type == 'Lead' else 'Customer'
+    conditions = [{'field': 'status', 'op': 'eq', 'value': segment.filter_value}] if segment.filter_value else []
+    return {'entity': entity, 'all': conditions}
+
+def segment_members_query(segment):
+    """(SELECT id, email of the members, id column): the snapshot if one was taken, else the compiled rules."""
+    if segment.snapshot_at:
+        query = (db.select(SegmentMember.entity_id.label('id'), SegmentMember.email)
+                 .where(SegmentMember.segment_id == segment.id))
+        return query, SegmentMember.entity_id
+    model, condition = compile_segment_rules(segment_rules(segment))
+    return db.select(model.id, model.email).where(condition), model.id
+
+def segment_member_count(segment):
+    query = segment_members_query(segment)[0]
+    return db.session.scalar(db.select(func.count()).select_from(query.subquery()))
+
+def iter_segment_members(segment, batch_size=SEGMENT_BATCH_SIZE):
+    """Yield (id, email) of the members in id order.
+
+    Each batch is its own keyset query, so no cursor is held open while the
+    caller commits between batches (worker.py commits every log chunk).
+    """
+    query, id_column = segment_members_query(segment)
+    last_id = 0
+    while True:
+        rows = db.session.execute(query.where(id_column > last_id).order_by(id_column).limit(batch_size)).all()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+def snapshot_segment(segment):
+    """Freeze the current members into segment_member with one INSERT ... SELECT."""
+    model, condition = compile_segment_rules(segment_rules(segment))
+    clear_segment_snapshot(segment)
+    db.session.execute(insert(SegmentMember).from_select(
+        ['segment_id', 'entity_id', 'email'],
+        db.select(db.literal(segment.id), model.id, model.email).where(condition)))
+    segment.member_count = db.session.scalar(db.select(func.count()).where(SegmentMember.segment_id == segment.id))
+    segment.snapshot_at = datetime.now().strftime(RUN_TIME_FORMAT)
+
+def clear_segment_snapshot(segment):
+    db.session.execute(delete(SegmentMember).where(SegmentMember.segment_id == segment.id))
+    segment.snapshot_at = None
+    segment.member_count = None
+
+# --- Tab loaders: each tab only loads the data its pane renders ---
+TAB_LOADERS = {}
+# tab: tables its pane is read from; the rendered pane is cached until one is written
+TAB_TABLES = {}
+
+def tab_loader(tab, tables=()):
+    def register(fn):
+        TAB_LOADERS[tab] = fn
+        TAB_TABLES[tab] = tables
+        return fn
+    return register
+
+@tab_loader('marketing', tables=('campaign', 'segment', 'campaign_step', 'campaign_log', 'campaign_run', 'scheduled_send'))
+def load_marketing(args):
     selected_campaign = None
     campaign_steps = []
     selected_segment = None
     campaign_logs = []
+    log_page = None
     campaign_stats = None
-    campaign_id = request.args.get('campaign_id')
+    campaign_id = args.get('campaign_id')
     if campaign_id:
         selected_campaign = Campaign.query.get(int(campaign_id))
         campaign_steps = CampaignStep.query.filter_by(campaign_id=campaign_id).order_by(CampaignStep.order).all()
-        campaign_logs = CampaignLog.query.filter_by(campaign_id=campaign_id).all()
-        # Simple stats
-        campaign_stats = {
-            'total': len(campaign_logs),
-            'sent': len([l for l in campaign_logs if l.status=='Sent']),
-            'failed': len([l for l in campaign_logs if l.status=='Failed']),
-            'completed': len([l for l in campaign_logs if l.status=='Completed'])
-        }
-    segment_id = request.args.get('segment_id')
+        log_page = keyset_paginate(campaign_logs_query(args), [CampaignLog.id], args, prefix='log_')
+        campaign_logs = log_page.items
+        campaign_stats = campaign_report_stats(campaign_id)
+    campaign_runs = []
+    if campaign_id:
+        runs = CampaignRun.query.filter_by(campaign_id=campaign_id).order_by(CampaignRun.id.desc()).limit(10).all()
+        campaign_runs = [campaign_run_progress(run) for run in runs]
+    segment_id = args.get('segment_id')
     if segment_id:
         selected_segment = Segment.query.get(int(segment_id))
-    search = request.args.get('search', '')
-    customers = Customer.query
-    if search:
-        customers = customers.filter((Customer.name.ilike(f'%{search}%')) | (Customer.email.ilike(f'%{search}%')))
-    customers = customers.all()
-    # Advanced filters for each module
-    contact_customer_filter = request.args.get('contact_customer', '')
-    task_status_filter = request.args.get('task_status', '')
-    task_due_filter = request.args.get('task_due', '')
-    deal_stage_filter = request.args.get('deal_stage', '')
-    deal_status_filter = request.args.get('deal_status', '')
-    reminder_due_filter = request.args.get('reminder_due', '')
-    reminder_completed_filter = request.args.get('reminder_completed', '')
-
-    contacts = Contact.query
-    if contact_customer_filter:
-        contacts = contacts.filter(Contact.customer_id == contact_customer_filter)
-    contacts = contacts.all()
+    return dict(campaigns=Campaign.query.all(), segments=Segment.query.all(), selected_campaign=selected_campaign,
+                campaign_steps=campaign_steps, selected_segment=selected_segment, campaign_logs=campaign_logs,
+                log_page=log_page, campaign_stats=campaign_stats, campaign_runs=campaign_runs)
 
-    tasks = Task.query
-    if task_status_filter:
-        tasks = tasks.filter(Task.status == task_status_filter)
-    if task_due_filter:
-        tasks = tasks.filter(Task.due_date == task_due_filter)
-    tasks = tasks.all()
+@cached_query('deal')
+def pipeline_summary():
+    # Per-stage count, total and weighted amount from one grouped query
+    summary = {stage: {'count': 0, 'amount': 0.0, 'weighted': 0.0} for stage in DEAL_STAGES}
+    rows = db.session.query(Deal.stage, func.count(Deal.id), func.coalesce(func.sum(Deal.amount), 0)).group_by(Deal.stage)
+    for stage, count, amount in rows:
+        if stage in summary:
+            summary[stage] = {'count': count, 'amount': float(amount), 'weighted': float(amount) * STAGE_WEIGHTS.get(stage, 0)}
+    return summary
 
-    deals = Deal.query
-    if deal_stage_filter:
-        deals = deals.filter(Deal.stage == deal_stage_filter)
-    if deal_status_filter:
-        deals = deals.filter(Deal.status == deal_status_filter)
-    deals = deals.all()
+def stage_cards(stage, args):
+    query = Deal.query.filter(Deal.stage == stage).options(customer_eager(Deal))
+    return keyset_paginate(query, [Deal.id], dict(args, per_page=PIPELINE_PAGE_SIZE))
 
-    reminders = Reminder.query
-    if reminder_due_filter:
-        reminders = reminders.filter(Reminder.due_date == reminder_due_filter)
-    if reminder_completed_filter:
-        reminders = reminders.filter(Reminder.completed == (reminder_completed_filter == 'yes'))
-    reminders = reminders.all()
+@tab_loader('pipeline', tables=('deal', 'customer'))
+def load_pipeline(args):
+    stage_pages = {stage: stage_cards(stage, {}) for stage in DEAL_STAGES}
+    return dict(deal_stages=DEAL_STAGES, pipeline_summary=pipeline_summary(), stage_pages=stage_pages)
+
+@tab_loader('leads', tables=('lead', 'import_job'))
+def load_leads(args):
+    page = keyset_paginate(leads_query(args), [Lead.id], args)
+    return dict(leads=page.items, page=page, import_jobs=recent_imports('leads'))
+
+@tab_loader('customers', tables=('customer', 'import_job'))
+def load_customers(args):
+    page = keyset_paginate(customers_query(args), [Customer.id], args)
+    return dict(customers=page.items, page=page, import_jobs=recent_imports('customers'))
+
+@tab_loader('contacts', tables=('contact', 'customer', 'import_job'))
+def load_contacts(args):
+    page = keyset_paginate(contacts_query(args).options(customer_eager(Contact)), [Contact.id], args)
+    # Customers are picked by typeahead (/search), so only the one filtered on is loaded, for its name
+    customer_id = args.get('contact_customer', '')
+    filter_customer = db.session.get(Customer, int(customer_id)) if customer_id.isdigit() else None
+    return dict(contacts=page.items, page=page, filter_customer=filter_customer, import_jobs=recent_imports('contacts'))
+
+@tab_loader('tasks', tables=('task', 'customer'))
+def load_tasks(args):
+    page = keyset_paginate(tasks_query(args).options(customer_eager(Task)), [Task.id], args)
+    return dict(tasks=page.items, page=page)
+
+@tab_loader('deals', tables=('deal', 'customer'))
+def load_deals(args):
+    page = keyset_paginate(deals_query(args).options(customer_eager(Deal)), [Deal.id], args)
+    return dict(deals=page.items, page=page)
+
+@tab_loader('reminders', tables=('reminder', 'customer'))
+def load_reminders(args):
+    page = keyset_paginate(reminders_query(args).options(customer_eager(Reminder)), [Reminder.id], args)
+    return dict(reminders=page.items, page=page)
+
+@tab_loader('activities', tables=('activity',))
+def load_activities(args):
+    page = keyset_paginate(activities_query(args), [Activity.date, Activity.id], args)
+    activities_by_date = {}
+    for a in page.items:
+        activities_by_date.setdefault(a.date, []).append(a)
+    return dict(activities_by_date=activities_by_date, page=page)
+
+def campaign_run_progress(run):
+    eta_seconds = next_due_at = None
+    now = datetime.now()
+    elapsed = (now - datetime.strptime(run.started_at, RUN_TIME_FORMAT)).total_seconds() if run.started_at else 0
+    if run.status == 'Running' and run.processed and elapsed > 0:
+        eta_seconds = int(elapsed / run.processed * max((run.total or 0) - run.processed, 0))
+    if run.status == 'Scheduled':
+        # Sends already due go out at the rate so far; the run cannot finish before its last send falls due
+        due, next_due_at, last_due_at = db.session.execute(
+            db.select(func.count(ScheduledSend.id).filter(ScheduledSend.due_at <= now.strftime(RUN_TIME_FORMAT)),
+                      func.min(ScheduledSend.due_at), func.max(ScheduledSend.due_at))
+            .where(ScheduledSend.run_id == run.id)).one()
+        if run.processed and elapsed > 0:
+            until_last = (datetime.strptime(last_due_at, RUN_TIME_FORMAT) - now).total_seconds() if last_due_at else 0
+            eta_seconds = int(max(elapsed / run.processed * due, until_last, 0))
+    return {
+        'id': run.id,
+        'campaign_id': run.campaign_id,
+        'segment_id': run.segment_id,
+        'status': run.status,
+        'total': run.total or 0,
+        'processed': run.processed or 0,
+        'sent': run.sent or 0,
+        'failed': run.failed or 0,
+        'percent': round(100.0 * (run.processed or 0) / run.total, 1) if run.total else (100.0 if run.status == 'Completed' else 0.0),
+        'eta_seconds': eta_seconds,
+        'next_due_at': next_due_at,
+        'error': run.error,
+        'created_at': run.created_at,
+        'started_at': run.started_at,
+        'finished_at': run.finished_at,
+    }
+
+IMPORT_DIR = os.path.join(app.instance_path, 'imports')
+IMPORT_ENTITIES = ('customers', 'leads', 'contacts')
+
+def import_job_progress(job):
+    return {
+        'id': job.id,
+        'entity': job.entity,
+        'filename': job.filename,
+        'status': job.status,
+        'percent': round(100.0 * (job.processed_bytes or 0) / job.total_bytes, 1) if job.total_bytes else 0.0,
+        'rows_processed': job.rows_processed or 0,
+        'inserted': job.inserted or 0,
+        'updated': job.updated or 0,
+        'errors': job.errors or 0,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+
+@app.route('/imports/<int:job_id>')
+def import_job_status(job_id):
+    job = ImportJob.query.get_or_404(job_id)
+    progress = import_job_progress(job)
+    row_errors = ImportRowError.query.filter_by(job_id=job.id).order_by(ImportRowError.id).limit(100).all()
+    progress['row_errors'] = [{'line': e.line, 'message': e.message} for e in row_errors]
+    return jsonify(progress)
+
+def recent_imports(entity):
+    jobs = ImportJob.query.filter_by(entity=entity).order_by(ImportJob.id.desc()).limit(5).all()
+    return [import_job_progress(job) for job in jobs]
+
+@app.route('/pipeline/<stage>')
+def pipeline_cards(stage):
+    # Next page of kanban cards for one stage column (HTML fragment)
+    if stage not in DEAL_STAGES:
+        return '', 404
+    page = stage_cards(stage, request.args.to_dict())
+    return timed_render('tabs/_pipeline_cards.html', stage=stage, page=page, deal_stages=DEAL_STAGES)
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(cache.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/campaign_runs/<int:run_id>')
+def campaign_run_status(run_id):
+    run = CampaignRun.query.get_or_404(run_id)
+    return jsonify(campaign_run_progress(run))
+
+SEARCH_LINKS = {
+    'customer': lambda id_: url_for('edit_customer', customer_id=id_),
+    'lead': lambda id_: url_for('edit_lead', lead_id=id_),
+    'contact': lambda id_: url_for('edit_contact', contact_id=id_),
+    'activity': lambda id_: url_for('home', tab='activities'),
+}
+
+@app.route('/search')
+def search():
+    """Ranked, prefix-matching search across customers, leads, contacts and activities (JSON)."""
+    q = request.args.get('q', '')
+    types = [t for t in request.args.getlist('type') if t in SEARCH_SOURCES] or list(SEARCH_SOURCES)
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    except ValueError:
+        limit = 20
+    match = fts_match(q)
+    results = []
+    if match and FULL_TEXT_SEARCH:
+        kinds = ', '.join(str(SEARCH_SOURCES[t][0]) for t in types)
+        rows = db.session.execute(db.text(
+            "SELECT * FROM (SELECT rowid, entity, name, email, company, bm25(search_index, 10.0, 5.0, 3.0, 1.0) AS rank "
+            "FROM search_index WHERE search_index MATCH :match AND rowid %% %d IN (%s) "
+            "ORDER BY rowid DESC LIMIT :candidates) ORDER BY rank LIMIT :limit" % (SEARCH_KINDS, kinds)),
+            {'match': match, 'candidates': SEARCH_RANK_CANDIDATES, 'limit': limit})
+        for row in rows:
+            results.append({'type': row.entity, 'id': row.rowid // SEARCH_KINDS, 'name': row.name,
+                            'detail': row.email or row.company or '', 'score': round(-row.rank, 4)})
+    elif match:
+        # No FTS5 (e.g. PostgreSQL): unranked substring match per entity
+        models = {'customer': Customer, 'lead': Lead, 'contact': Contact, 'activity': Activity}
+        for entity in types:
+            model = models[entity]
+            columns = [getattr(model, c) for c in SEARCH_SOURCES[entity][2] if c]
+            name_column, email_column = columns[0], getattr(model, 'email', None)
+            for row in model.query.filter(db.or_(*[c.ilike(f'%{q}%') for c in columns])).limit(limit - len(results)):
+                results.append({'type': entity, 'id': row.id, 'name': getattr(row, name_column.key),
+                                'detail': getattr(row, email_column.key) if email_column is not None else '', 'score': None})
+            if len(results) >= limit:
+                break
+    for result in results:
+        result['url'] = SEARCH_LINKS[result['type']](result['id'])
+    return jsonify({'query': q, 'results': results})
+
+# --- Rendering ---
+# Templates live in templates/ and are compiled once per process by Flask's Jinja
+# loader. Each tab pane is its own partial (templates/tabs/<tab>.html), so a tab
+# renders without evaluating the others and can be fetched alone with ?partial=1.
+def timed_render(template, **context):
+    start = time.perf_counter()
+    html = render_template(template, **context)
+    g.render_seconds = g.get('render_seconds', 0.0) + time.perf_counter() - start
+    return html
+
+def render_tab(tab, context):
+    if tab not in TAB_LOADERS:
+        return ''
+    return timed_render('tabs/%s.html' % tab, tab=tab, **context)
+
+def cached_tab(tab, args):
+    """Load and render one tab pane, reusing the cached HTML while its tables are unchanged."""
+    if tab not in TAB_LOADERS:
+        return ''
+    tables = TAB_TABLES[tab]
+    if not tables:
+        return render_tab(tab, TAB_LOADERS[tab](args))
+    # Versions are read before the data, so a concurrent write can only make the entry fresher than its key
+    filters = sorted((k, v) for k, v in args.items(multi=True) if k != 'partial')
+    key = 'tab:%s:%s:%r' % (tab, json.dumps(filters), table_versions(tables))
+    html = cache.get(key)
+    if html is None:
+        html = render_tab(tab, TAB_LOADERS[tab](args))
+        cache.set(key, html)
+    return html
+
+def render_dashboard(tab, **page):
+    tab_html = cached_tab(tab, request.args)
+    if request.args.get('partial'):
+        return tab_html
+    return timed_render('dashboard.html', tab=tab, tab_html=Markup(tab_html), **page)
+
+# --- Conditional GETs ---
+# A dashboard page only changes when a table its tab reads is written or the code
+# and templates change, so its ETag is derived from those versions and the client
+# revalidates with If-None-Match instead of downloading the page again.
+def release_stamp():
+    paths = [os.path.join(app.root_path, 'app.py')]
+    for folder, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        paths += [os.path.join(folder, f) for f in files]
+    return os.environ.get('APP_RELEASE') or str(int(max(os.path.getmtime(p) for p in paths)))
+
+APP_RELEASE = release_stamp()
+
+def dashboard_validators(tab, args):
+    """Response carrying the ETag/Last-Modified of a tab view, or None if the tab is not cacheable."""
+    tables = TAB_TABLES.get(tab)
+    if not tables:
+        return None
+    versions, last_modified = table_state(tables)
+    key = repr((APP_RELEASE, tab, sorted(args.items(multi=True)), versions))
+    response = Response(mimetype='text/html')
+    # Weak, so the same validator covers the gzip, brotli and identity encodings
+    response.set_etag(hashlib.sha1(key.encode()).hexdigest(), weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
+# --- Response compression ---
+COMPRESS_MIN_BYTES = 1024  # below this the headers cost more than the savings
+COMPRESS_MIMETYPES = {'text/html', 'text/plain', 'text/csv', 'text/css', 'application/json',
+                      'application/x-ndjson', 'application/javascript'}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # dynamic pages: quality 5 is close to 11 in size at a fraction of the CPU
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli per Accept-Encoding; streamed exports are gzipped chunk by chunk."""
+    if (response.status_code < 200 or response.status_code in (204, 206, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES or response.direct_passthrough):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        if request.accept_encodings.best_match(['gzip']) is None:
+            return response
+        response.response = gzip_stream(response.response)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return response
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(data, GZIP_LEVEL)
+    if len(compressed) >= len(data):
+        return response
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route('/', methods=['GET', 'POST'])
+def home():
+    tab = request.args.get('tab', 'customers')
     msg = None
     if request.method == 'POST':
         # Add campaign
@@ -218,17 +1288,37 @@ def home():
             name = request.form.get('segment_name')
             filter_type = request.form.get('segment_filter_type')
             filter_value = request.form.get('segment_filter_value')
-            seg = Segment(name=name, filter_type=filter_type, filter_value=filter_value)
-            db.session.add(seg)
-            db.session.commit()
-            msg = 'Segment added.'
+            rules = request.form.get('segment_rules', '').strip() or None
+            try:
+                if rules:
+                    parse_segment_rules(rules)
+                seg = Segment(name=name, filter_type=filter_type, filter_value=filter_value, rules=rules)
+                db.session.add(seg)
+                db.session.commit()
+                msg = 'Segment added.'
+            except SegmentRuleError as e:
+                flash('Invalid segment rules: %s' % e, 'danger')
         # Delete segment
         if 'delete_segment' in request.form:
             segment_id = request.form.get('delete_segment')
             seg = Segment.query.get(segment_id)
+            clear_segment_snapshot(seg)
             db.session.delete(seg)
             db.session.commit()
             msg = 'Segment deleted.'
+        # Freeze a segment's members, or go back to evaluating its rules live
+        if 'snapshot_segment' in request.form or 'clear_segment_snapshot' in request.form:
+            seg = Segment.query.get(request.form.get('snapshot_segment') or request.form.get('clear_segment_snapshot'))
+            try:
+                if 'snapshot_segment' in request.form:
+                    snapshot_segment(seg)
+                else:
+                    clear_segment_snapshot(seg)
+                db.session.commit()
+                msg = 'Segment updated.'
+            except SegmentRuleError as e:
+                db.session.rollback()
+                flash('Invalid segment rules: %s' % e, 'danger')
         # Add campaign step
         if 'add_campaign_step' in request.form:
             campaign_id = request.form.get('campaign_id')
@@ -246,45 +1336,18 @@ def home():
             db.session.delete(step)
             db.session.commit()
             msg = 'Step deleted.'
-        # Run campaign (send email blast)
+        # Run campaign: queue it for the background worker (worker.py) and return the run ID
         if 'run_campaign' in request.form:
             campaign_id = request.form.get('campaign_id')
             segment_id = request.form.get('segment_id')
-            segment = Segment.query.get(segment_id)
-            steps = CampaignStep.query.filter_by(campaign_id=campaign_id).order_by(CampaignStep.order).all()
-            # Get recipients
-            if segment.filter_type == 'Lead':
-                recipients = Lead.query
-                if segment.filter_value:
-                    recipients = recipients.filter_by(status=segment.filter_value)
-                recipients = recipients.all()
-            else:
-                recipients = Customer.query
-                if segment.filter_value:
-                    recipients = recipients.filter_by(status=segment.filter_value)
-                recipients = recipients.all()
-            # For each recipient, process steps (only Email steps for now)
-            for r in recipients:
-                for step in steps:
-                    if step.step_type == 'Email':
-                        # details = subject|||body
-                        try:
-                            subj, body = step.details.split('|||', 1)
-                            msg_obj = MIMEText(body)
-                            msg_obj['Subject'] = subj
-                            msg_obj['From'] = SENDER_EMAIL
-                            msg_obj['To'] = r.email
-                            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                                server.starttls()
-                                server.login(SMTP_USERNAME, SMTP_PASSWORD)
-                                server.sendmail(SENDER_EMAIL, [r.email], msg_obj.as_string())
-                            status = 'Sent'
-                        except Exception as e:
-                            status = 'Failed'
-                        log = CampaignLog(campaign_id=campaign_id, segment_id=segment_id, recipient_email=r.email, step_id=step.id, status=status, timestamp=datetime.now().strftime('%Y-%m-%d %H:%M'))
-                        db.session.add(log)
-                        db.session.commit()
-            msg = 'Campaign run complete.'
+            if campaign_id and segment_id and Segment.query.get(segment_id):
+                run = CampaignRun(campaign_id=campaign_id, segment_id=segment_id, status='Queued', created_at=datetime.now().strftime(RUN_TIME_FORMAT))
+                db.session.add(run)
+                db.session.commit()
+                if request.accept_mimetypes.best == 'application/json':
+                    return jsonify(campaign_run_progress(run)), 202
+                return redirect(url_for('home', tab='marketing', campaign_id=campaign_id, run_id=run.id) + '#report')
+            msg = 'Select a campaign and segment to run.'
         # Send email
         if 'send_email' in request.form:
             recipient = request.form.get('recipient')
@@ -292,14 +1355,7 @@ def home():
             body = request.form.get('body')
             date = datetime.now().strftime('%Y-%m-%d')
             try:
-                msg_obj = MIMEText(body)
-                msg_obj['Subject'] = subject
-                msg_obj['From'] = SENDER_EMAIL
-                msg_obj['To'] = recipient
-                with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                    server.starttls()
-                    server.login(SMTP_USERNAME, SMTP_PASSWORD)
-                    server.sendmail(SENDER_EMAIL, [recipient], msg_obj.as_string())
+                send_mail(recipient, subject, body)
                 # Log as activity
                 activity = Activity(subject=subject, type='Email', date=date, related_type='Customer', related_id=None, notes='Sent to: '+recipient+'\n'+body)
                 db.session.add(activity)
@@ -346,6 +1402,18 @@ def home():
                 msg = 'Lead added.'
             else:
                 msg = 'Name and Email required for lead.'
+        # Convert leads in bulk: the checked ones, or every lead with a status
+        if 'convert_leads' in request.form:
+            lead_ids = [int(i) for i in request.form.getlist('ids') if i.isdigit()]
+            status = request.form.get('convert_status')
+            on_conflict = request.form.get('on_conflict', 'merge')
+            if (lead_ids or status) and on_conflict in LEAD_CONFLICT_MODES:
+                report = convert_leads(Lead.id.in_(lead_ids) if lead_ids else Lead.status == status, on_conflict)
+                if request.accept_mimetypes.best == 'application/json':
+                    return jsonify(report)
+                msg = conversion_message(report)
+            else:
+                msg = 'Select leads (or a status) to convert.'
         # Add customer from main form
         if 'add_customer' in request.form:
             name = request.form.get('name')
@@ -406,593 +1474,36 @@ def home():
                 db.session.add(reminder)
                 db.session.commit()
                 msg = 'Reminder added.'
-        # CSV import temporarily disabled (pandas not installed)
-        # elif 'import_csv' in request.form and 'csv_file' in request.files:
-        #     ...
+        # Queue a CSV import; worker.py parses and upserts it in batches
+        elif 'import_csv' in request.form and 'csv_file' in request.files:
+            entity = request.form.get('import_entity')
+            upload = request.files['csv_file']
+            if entity in IMPORT_ENTITIES and upload.filename:
+                os.makedirs(IMPORT_DIR, exist_ok=True)
+                path = os.path.join(IMPORT_DIR, uuid.uuid4().hex + '.csv')
+                upload.save(path)
+                job = ImportJob(entity=entity, path=path, filename=upload.filename, status='Queued',
+                                total_bytes=os.path.getsize(path), created_at=datetime.now().strftime(RUN_TIME_FORMAT))
+                db.session.add(job)
+                db.session.commit()
+                if request.accept_mimetypes.best == 'application/json':
+                    return jsonify(import_job_progress(job)), 202
+                return redirect(url_for('home', tab=entity, import_id=job.id))
+            msg = 'Choose a CSV file to import.'
+        if msg:
+            flash(msg)  # shown by the GET this redirects to
         return redirect(url_for('home', tab=tab))
-    # Export customers as CSV
-    # export_url = url_for('export_customers')
-    export_url = None  # CSV export temporarily disabled
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Mukera CRM App</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
-        <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js"></script>
-    </head>
-    <body class="bg-light">
-        <div class="container my-5">
-            <h1 class="mb-4"><a href="/" class="text-decoration-none">Mukera CRM App</a></h1>
-            {% if msg %}<div class="alert alert-info">{{msg}}</div>{% endif %}
-            <ul class="nav nav-tabs mb-4" id="crmTabs" role="tablist">
-                <li class="nav-item"><a class="nav-link {% if tab=='marketing' %}active{% endif %}" href="?tab=marketing">Marketing</a></li>
-                <li class="nav-item"><a class="nav-link {% if tab=='pipeline' %}active{% endif %}" href="?tab=pipeline">Pipeline</a></li>
-                <li class="nav-item"><a class="nav-link {% if tab=='leads' %}active{% endif %}" href="?tab=leads">Leads</a></li>
-                <li class="nav-item"><a class="nav-link {% if tab=='customers' %}active{% endif %}" href="?tab=customers">Customers</a></li>
-                <li class="nav-item"><a class="nav-link {% if tab=='contacts' %}active{% endif %}" href="?tab=contacts">Contacts</a></li>
-                <li class="nav-item"><a class="nav-link {% if tab=='tasks' %}active{% endif %}" href="?tab=tasks">Tasks</a></li>
-                <li class="nav-item"><a class="nav-link {% if tab=='deals' %}active{% endif %}" href="?tab=deals">Deals</a></li>
-                <li class="nav-item"><a class="nav-link {% if tab=='reminders' %}active{% endif %}" href="?tab=reminders">Reminders</a></li>
-                <li class="nav-item"><a class="nav-link {% if tab=='activities' %}active{% endif %}" href="?tab=activities">Activities</a></li>
-            </ul>
-            <div class="tab-content">
-                <div class="tab-pane fade {% if tab=='marketing' %}show active{% endif %}" id="marketing">
-                    <h2 class="h5 mb-3">Campaigns</h2>
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="add_campaign" value="1">
-                        <div class="row g-2">
-                            <div class="col-md-3"><input type="text" class="form-control" name="campaign_name" placeholder="Campaign Name" required></div>
-                            <div class="col-md-3"><input type="text" class="form-control" name="campaign_start" placeholder="Start Date (YYYY-MM-DD)"></div>
-                            <div class="col-md-3"><input type="text" class="form-control" name="campaign_end" placeholder="End Date (YYYY-MM-DD)"></div>
-                            <div class="col-md-3">
-                                <select class="form-select" name="campaign_status">
-                                    <option value="Draft">Draft</option>
-                                    <option value="Active">Active</option>
-                                    <option value="Completed">Completed</option>
-                                </select>
-                            </div>
-                            <div class="col-md-12 mt-2"><textarea class="form-control" name="campaign_desc" placeholder="Description"></textarea></div>
-                        </div>
-                        <button type="submit" class="btn btn-success mt-3">Add Campaign</button>
-                    </form>
-                    <table class="table table-bordered table-hover bg-white mb-5">
-                        <thead class="table-light"><tr><th>Name</th><th>Status</th><th>Start</th><th>End</th><th>Description</th><th>Steps</th><th>Report</th><th>Delete</th></tr></thead>
-                        <tbody>
-                        {% for camp in campaigns %}
-                        <tr>
-                            <td>{{camp.name}}</td>
-                            <td>{{camp.status}}</td>
-                            <td>{{camp.start_date}}</td>
-                            <td>{{camp.end_date}}</td>
-                            <td>{{camp.description}}</td>
-                            <td><a href="?tab=marketing&campaign_id={{camp.id}}">Steps</a></td>
-                            <td><a href="?tab=marketing&campaign_id={{camp.id}}#report">Report</a></td>
-                            <td><form method="POST" style="display:inline"><button name="delete_campaign" value="{{camp.id}}" class="btn btn-sm btn-danger">Delete</button></form></td>
-                        </tr>
-                        {% endfor %}
-                        </tbody>
-                    </table>
-                    <div class="card card-body mb-3">
-                        {% if selected_campaign %}
-                            <h3>Steps for: {{selected_campaign.name}}</h3>
-                        {% else %}
-                            <h3>Select a campaign to manage steps and reporting.</h3>
-                        {% endif %}
-                        <form method="POST" class="mb-3">
-                            {% if selected_campaign %}
-                                <input type="hidden" name="add_campaign_step" value="1">
-                                <input type="hidden" name="campaign_id" value="{{selected_campaign.id}}">
-                            {% endif %}
-                            <div class="row g-2">
-                                <div class="col-md-2">
-                                    <select class="form-select" name="step_type">
-                                        <option value="Email">Email</option>
-                                        <option value="Wait">Wait</option>
-                                    </select>
-                                </div>
-                                <div class="col-md-6"><input type="text" class="form-control" name="step_details" placeholder="For Email: subject|||body. For Wait: days."></div>
-                                <div class="col-md-2"><input type="number" class="form-control" name="step_order" placeholder="Order" value="0"></div>
-                                <div class="col-md-2"><button type="submit" class="btn btn-success">Add Step</button></div>
-                            </div>
-                        </form>
-                        <table class="table table-bordered">
-                            <thead><tr><th>Order</th><th>Type</th><th>Details</th><th>Delete</th></tr></thead>
-                            <tbody>
-                            {% for step in campaign_steps %}
-                            <tr>
-                                <td>{{step.order}}</td>
-                                <td>{{step.step_type}}</td>
-                                <td>{{step.details}}</td>
-                                <td><form method="POST" style="display:inline"><button name="delete_campaign_step" value="{{step.id}}" class="btn btn-sm btn-danger">Delete</button></form></td>
-                            </tr>
-                            {% endfor %}
-                            </tbody>
-                        </table>
-                        <form method="POST" class="row g-2 align-items-end mt-3">
-                            {% if selected_campaign %}
-                                <input type="hidden" name="run_campaign" value="1">
-                                <input type="hidden" name="campaign_id" value="{{selected_campaign.id}}">
-                            {% endif %}
-                            <div class="col-md-4">
-                                <select class="form-select" name="segment_id" required>
-                                    <option value="">Select Segment</option>
-                                    {% for seg in segments %}
-                                    <option value="{{seg.id}}">{{seg.name}}</option>
-                                    {% endfor %}
-                                </select>
-                            </div>
-                            <div class="col-md-4"><button type="submit" class="btn btn-primary">Run Campaign (Email Blast)</button></div>
-                        </form>
-                    </div>
-                    <div id="report" class="card card-body mb-3">
-                        {% if selected_campaign %}
-                            <h3>Campaign Report: {{selected_campaign.name}}</h3>
-                        {% else %}
-                            <h3>Select a campaign to see its report.</h3>
-                        {% endif %}
-                        <table class="table table-bordered">
-                            <thead><tr><th>Recipient</th><th>Step</th><th>Status</th><th>Time</th></tr></thead>
-                            <tbody>
-                            {% for log in campaign_logs %}
-                            <tr>
-                                <td>{{log.recipient_email}}</td>
-                                <td>{{log.step_id}}</td>
-                                <td>{{log.status}}</td>
-                                <td>{{log.timestamp}}</td>
-                            </tr>
-                            {% endfor %}
-                            </tbody>
-                        </table>
-                        {% if campaign_stats %}
-                        <div class="mt-2">
-                            <b>Total Targeted:</b> {{campaign_stats.targeted}} &nbsp; 
-                            <b>Sent:</b> {{campaign_stats.sent}} &nbsp; 
-                            <b>Failed:</b> {{campaign_stats.failed}} &nbsp; 
-                            <b>Completed:</b> {{campaign_stats.completed}}
-                        </div>
-                        {% endif %}
-                    </div>
-                    <h2 class="h5 mb-3">Segments</h2>
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="add_segment" value="1">
-                        <div class="row g-2">
-                            <div class="col-md-4"><input type="text" class="form-control" name="segment_name" placeholder="Segment Name" required></div>
-                            <div class="col-md-4">
-                                <select class="form-select" name="segment_filter_type">
-                                    <option value="Lead">Leads</option>
-                                    <option value="Customer">Customers</option>
-                                </select>
-                            </div>
-                            <div class="col-md-4"><input type="text" class="form-control" name="segment_filter_value" placeholder="Filter Value (status)"></div>
-                        </div>
-                        <button type="submit" class="btn btn-success mt-3">Add Segment</button>
-                    </form>
-                    <table class="table table-bordered table-hover bg-white">
-                        <thead class="table-light"><tr><th>Name</th><th>Type</th><th>Value</th><th>Delete</th></tr></thead>
-                        <tbody>
-                        {% for seg in segments %}
-                        <tr>
-                            <td>{{seg.name}}</td>
-                            <td>{{seg.filter_type}}</td>
-                            <td>{{seg.filter_value}}</td>
-                            <td><form method="POST" style="display:inline"><button name="delete_segment" value="{{seg.id}}" class="btn btn-sm btn-danger">Delete</button></form></td>
-                        </tr>
-                        {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-                <div class="tab-pane fade {% if tab=='pipeline' %}show active{% endif %}" id="pipeline">
-                    <h2 class="h5 mb-3">Deals Pipeline</h2>
-                    <div class="row">
-                        {% for stage in ['New', 'Qualified', 'Proposal', 'Negotiation', 'Won', 'Lost'] %}
-                        <div class="col">
-                            <div class="card">
-                                <div class="card-header bg-light"><b>{{stage}}</b></div>
-                                <div class="card-body" style="min-height:150px;">
-                                    {% for d in deals_by_stage[stage] %}
-                                    <div class="card mb-2 border-primary">
-                                        <div class="card-body p-2">
-                                            <div><b>{{d.title}}</b> ({{d.amount}})</div>
-                                            <div class="small">{{d.customer.name}}</div>
-                                            <form method="POST" class="mt-1 d-flex align-items-center">
-                                                <input type="hidden" name="move_deal" value="1">
-                                                <input type="hidden" name="deal_id" value="{{d.id}}">
-                                                <select name="new_stage" class="form-select form-select-sm me-1" onchange="this.form.submit()">
-                                                    {% for s in ['New', 'Qualified', 'Proposal', 'Negotiation', 'Won', 'Lost'] %}
-                                                        <option value="{{s}}" {% if d.stage==s %}selected{% endif %}>{{s}}</option>
-                                                    {% endfor %}
-                                                </select>
-                                                <a href="{{ url_for('edit_deal', deal_id=d.id) }}" class="btn btn-sm btn-warning ms-1">Edit</a>
-                                            </form>
-                                        </div>
-                                    </div>
-                                    {% endfor %}
-                                </div>
-                            </div>
-                        </div>
-                        {% endfor %}
-                    </div>
-                </div>
-                <div class="tab-pane fade {% if tab=='leads' %}show active{% endif %}" id="leads">
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="add_lead" value="1">
-                        <h2 class="h5">Add Lead</h2>
-                        <div class="row g-2">
-                            <div class="col-md-3"><input type="text" class="form-control" name="lead_name" placeholder="Name" required></div>
-                            <div class="col-md-3"><input type="email" class="form-control" name="lead_email" placeholder="Email" required></div>
-                            <div class="col-md-2"><input type="text" class="form-control" name="lead_phone" placeholder="Phone"></div>
-                            <div class="col-md-2"><input type="text" class="form-control" name="lead_company" placeholder="Company"></div>
-                            <div class="col-md-2">
-                                <select class="form-select" name="lead_status">
-                                    <option value="New">New</option>
-                                    <option value="Assigned">Assigned</option>
-                                    <option value="Converted">Converted</option>
-                                    <option value="Lost">Lost</option>
-                                </select>
-                            </div>
-                            <div class="col-md-12 mt-2">
-                                <textarea class="form-control" name="lead_notes" placeholder="Notes"></textarea>
-                            </div>
-                        </div>
-                        <button type="submit" class="btn btn-success mt-3">Add Lead</button>
-                    </form>
-                    <h2 class="h5 mb-3">Leads</h2>
-                    <table class="table table-bordered table-hover bg-white">
-                        <thead class="table-light">
-                            <tr><th>Name</th><th>Email</th><th>Phone</th><th>Company</th><th>Status</th><th>Notes</th><th>Convert</th><th>Edit</th><th>Delete</th></tr>
-                        </thead>
-                        <tbody>
-                        {% for l in leads %}
-                        <tr>
-                            <td>{{l.name}}</td>
-                            <td>{{l.email}}</td>
-                            <td>{{l.phone}}</td>
-                            <td>{{l.company}}</td>
-                            <td>{{l.status}}</td>
-                            <td style="max-width:200px; white-space:pre-wrap;">{{l.notes}}</td>
-                            <td><a href="{{ url_for('convert_lead', lead_id=l.id) }}" class="btn btn-sm btn-success">Convert</a></td>
-                            <td><a href="{{ url_for('edit_lead', lead_id=l.id) }}" class="btn btn-sm btn-warning">Edit</a></td>
-                            <td><a href="{{ url_for('delete_lead', lead_id=l.id) }}" class="btn btn-sm btn-danger">Delete</a></td>
-                        </tr>
-                        {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-                <div class="tab-pane fade {% if tab=='customers' %}show active{% endif %}" id="customers">
-                    <form method="GET" class="row mb-3">
-                        <div class="col-auto">
-                            <input type="text" class="form-control" name="search" placeholder="Search by name or email" value="{{request.args.get('search', '')}}">
-                        </div>
-                        <div class="col-auto">
-                            <button type="submit" class="btn btn-primary">Search</button>
-                            <a href="/" class="btn btn-secondary">Clear</a>
-                        </div>
-                        <!-- CSV import/export temporarily disabled -->
-                    </form>
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="add_customer" value="1">
-                        <h2 class="h5">Add Customer</h2>
-                        <div class="row g-2">
-                            <div class="col-md-3"><input type="text" class="form-control" name="name" placeholder="Name" required></div>
-                            <div class="col-md-3"><input type="email" class="form-control" name="email" placeholder="Email" required></div>
-                            <div class="col-md-2"><input type="text" class="form-control" name="phone" placeholder="Phone"></div>
-                            <div class="col-md-2">
-                                <select class="form-select" name="status">
-                                    <option value="Lead">Lead</option>
-                                    <option value="Opportunity">Opportunity</option>
-                                    <option value="Customer">Customer</option>
-                                </select>
-                            </div>
-                            <div class="col-md-12 mt-2">
-                                <textarea class="form-control" name="notes" placeholder="Notes"></textarea>
-                            </div>
-                        </div>
-                        <button type="submit" class="btn btn-success mt-3">Add Customer</button>
-                    </form>
-                    <h2 class="h5 mb-3">Customers</h2>
-                    <table class="table table-bordered table-hover bg-white">
-                        <thead class="table-light">
-                            <tr><th>Name</th><th>Email</th><th>Phone</th><th>Status</th><th>Notes</th></tr>
-                        </thead>
-                        <tbody>
-                        {% for c in customers %}
-                        <tr>
-                            <td>{{c.name}}</td>
-                            <td>{{c.email}}</td>
-                            <td>{{c.phone}}</td>
-                            <td>{{c.status}}</td>
-                            <td style="max-width:200px; white-space:pre-wrap;">{{c.notes}}</td>
-                        </tr>
-                        {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-                <div class="tab-pane fade {% if tab=='contacts' %}show active{% endif %}" id="contacts">
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="add_contact" value="1">
-                        <div class="row g-2">
-                            <div class="col-md-3">
-                                <select class="form-select" name="customer_id" required>
-                                    <option value="">Select Customer</option>
-                                    {% for c in customers %}<option value="{{c.id}}">{{c.name}}</option>{% endfor %}
-                                </select>
-                            </div>
-                            <div class="col-md-3"><input type="text" class="form-control" name="contact_name" placeholder="Contact Name" required></div>
-                            <div class="col-md-3"><input type="email" class="form-control" name="contact_email" placeholder="Contact Email"></div>
-                            <div class="col-md-2"><input type="text" class="form-control" name="contact_phone" placeholder="Contact Phone"></div>
-                            <div class="col-md-2"><input type="text" class="form-control" name="contact_role" placeholder="Role"></div>
-                        </div>
-                        <button type="submit" class="btn btn-success mt-3">Add Contact</button>
-                    </form>
-                    <form method="GET" class="row mb-2">
-                        <div class="col-auto">
-                            <select class="form-select" name="contact_customer">
-                                <option value="">All Customers</option>
-                                {% for c in customers %}<option value="{{c.id}}" {% if request.args.get('contact_customer')==c.id|string %}selected{% endif %}>{{c.name}}</option>{% endfor %}
-                            </select>
-                        </div>
-                        <div class="col-auto"><button type="submit" class="btn btn-secondary">Filter</button></div>
-                    </form>
-                    <h2 class="h5 mb-3">Contacts</h2>
-                    <table class="table table-bordered table-hover bg-white">
-                        <thead class="table-light">
-                            <tr><th>Customer</th><th>Name</th><th>Email</th><th>Phone</th><th>Role</th><th>Edit</th><th>Delete</th></tr>
-                        </thead>
-                        <tbody>
-                        {% for ct in contacts %}
-                        <tr>
-                            <td>{{ct.customer.name}}</td>
-                            <td>{{ct.name}}</td>
-                            <td>{{ct.email}}</td>
-                            <td>{{ct.phone}}</td>
-                            <td>{{ct.role}}</td>
-                            <td><a href="{{ url_for('edit_contact', contact_id=ct.id) }}" class="btn btn-sm btn-warning">Edit</a></td>
-                            <td><a href="{{ url_for('delete_contact', contact_id=ct.id) }}" class="btn btn-sm btn-danger">Delete</a></td>
-                        </tr>
-                        {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-                <div class="tab-pane fade {% if tab=='tasks' %}show active{% endif %}" id="tasks">
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="add_task" value="1">
-                        <div class="row g-2">
-                            <div class="col-md-3">
-                                <select class="form-select" name="customer_id" required>
-                                    <option value="">Select Customer</option>
-                                    {% for c in customers %}<option value="{{c.id}}">{{c.name}}</option>{% endfor %}
-                                </select>
-                            </div>
-                            <div class="col-md-3"><input type="text" class="form-control" name="task_title" placeholder="Task Title" required></div>
-                            <div class="col-md-3"><input type="text" class="form-control" name="task_due_date" placeholder="Due Date (YYYY-MM-DD)"></div>
-                            <div class="col-md-2">
-                                <select class="form-select" name="task_status">
-                                    <option value="Todo">Todo</option>
-                                    <option value="In Progress">In Progress</option>
-                                    <option value="Done">Done</option>
-                                </select>
-                            </div>
-                            <div class="col-md-12 mt-2">
-                                <textarea class="form-control" name="task_description" placeholder="Description"></textarea>
-                            </div>
-                        </div>
-                        <button type="submit" class="btn btn-success mt-3">Add Task</button>
-                    </form>
-                    <form method="GET" class="row mb-2">
-                        <div class="col-auto">
-                            <select class="form-select" name="task_status">
-                                <option value="">All Statuses</option>
-                                <option value="Todo" {% if request.args.get('task_status')=='Todo' %}selected{% endif %}>Todo</option>
-                                <option value="In Progress" {% if request.args.get('task_status')=='In Progress' %}selected{% endif %}>In Progress</option>
-                                <option value="Done" {% if request.args.get('task_status')=='Done' %}selected{% endif %}>Done</option>
-                            </select>
-                        </div>
-                        <div class="col-auto"><input type="text" class="form-control" name="task_due" placeholder="Due Date (YYYY-MM-DD)" value="{{request.args.get('task_due','')}}"></div>
-                        <div class="col-auto"><button type="submit" class="btn btn-secondary">Filter</button></div>
-                    </form>
-                    <h2 class="h5 mb-3">Tasks</h2>
-                    <table class="table table-bordered table-hover bg-white">
-                        <thead class="table-light">
-                            <tr><th>Customer</th><th>Title</th><th>Due Date</th><th>Status</th><th>Description</th><th>Edit</th><th>Delete</th></tr>
-                        </thead>
-                        <tbody>
-                        {% for t in tasks %}
-                        <tr>
-                            <td>{{t.customer.name}}</td>
-                            <td>{{t.title}}</td>
-                            <td>{{t.due_date}}</td>
-                            <td>{{t.status}}</td>
-                            <td>{{t.description}}</td>
-                            <td><a href="{{ url_for('edit_task', task_id=t.id) }}" class="btn btn-sm btn-warning">Edit</a></td>
-                            <td><a href="{{ url_for('delete_task', task_id=t.id) }}" class="btn btn-sm btn-danger">Delete</a></td>
-                        </tr>
-                        {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-                <div class="tab-pane fade {% if tab=='deals' %}show active{% endif %}" id="deals">
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="add_deal" value="1">
-                        <div class="row g-2">
-                            <div class="col-md-3">
-                                <select class="form-select" name="customer_id" required>
-                                    <option value="">Select Customer</option>
-                                    {% for c in customers %}<option value="{{c.id}}">{{c.name}}</option>{% endfor %}
-                                </select>
-                            </div>
-                            <div class="col-md-3"><input type="text" class="form-control" name="deal_title" placeholder="Deal Title" required></div>
-                            <div class="col-md-2"><input type="number" step="0.01" class="form-control" name="deal_amount" placeholder="Amount"></div>
-                            <div class="col-md-2">
-                                <select class="form-select" name="deal_stage">
-                                    <option value="New">New</option>
-                                    <option value="Qualified">Qualified</option>
-                                    <option value="Won">Won</option>
-                                    <option value="Lost">Lost</option>
-                                </select>
-                            </div>
-                            <div class="col-md-2">
-                                <select class="form-select" name="deal_status">
-                                    <option value="Open">Open</option>
-                                    <option value="Closed">Closed</option>
-                                </select>
-                            </div>
-                        </div>
-                        <button type="submit" class="btn btn-success mt-3">Add Deal</button>
-                    </form>
-                    <form method="GET" class="row mb-2">
-                        <div class="col-auto">
-                            <select class="form-select" name="deal_stage">
-                                <option value="">All Stages</option>
-                                <option value="New" {% if request.args.get('deal_stage')=='New' %}selected{% endif %}>New</option>
-                                <option value="Qualified" {% if request.args.get('deal_stage')=='Qualified' %}selected{% endif %}>Qualified</option>
-                                <option value="Won" {% if request.args.get('deal_stage')=='Won' %}selected{% endif %}>Won</option>
-                                <option value="Lost" {% if request.args.get('deal_stage')=='Lost' %}selected{% endif %}>Lost</option>
-                            </select>
-                        </div>
-                        <div class="col-auto">
-                            <select class="form-select" name="deal_status">
-                                <option value="">All Statuses</option>
-                                <option value="Open" {% if request.args.get('deal_status')=='Open' %}selected{% endif %}>Open</option>
-                                <option value="Closed" {% if request.args.get('deal_status')=='Closed' %}selected{% endif %}>Closed</option>
-                            </select>
-                        </div>
-                        <div class="col-auto"><button type="submit" class="btn btn-secondary">Filter</button></div>
-                    </form>
-                    <h2 class="h5 mb-3">Deals</h2>
-                    <table class="table table-bordered table-hover bg-white">
-                        <thead class="table-light">
-                            <tr><th>Customer</th><th>Title</th><th>Amount</th><th>Stage</th><th>Status</th><th>Edit</th><th>Delete</th></tr>
-                        </thead>
-                        <tbody>
-                        {% for d in deals %}
-                        <tr>
-                            <td>{{d.customer.name}}</td>
-                            <td>{{d.title}}</td>
-                            <td>{{d.amount}}</td>
-                            <td>{{d.stage}}</td>
-                            <td>{{d.status}}</td>
-                            <td><a href="{{ url_for('edit_deal', deal_id=d.id) }}" class="btn btn-sm btn-warning">Edit</a></td>
-                            <td><a href="{{ url_for('delete_deal', deal_id=d.id) }}" class="btn btn-sm btn-danger">Delete</a></td>
-                        </tr>
-                        {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-                <div class="tab-pane fade {% if tab=='reminders' %}show active{% endif %}" id="reminders">
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="add_reminder" value="1">
-                        <div class="row g-2">
-                            <div class="col-md-3">
-                                <select class="form-select" name="customer_id" required>
-                                    <option value="">Select Customer</option>
-                                    {% for c in customers %}<option value="{{c.id}}">{{c.name}}</option>{% endfor %}
-                                </select>
-                            </div>
-                            <div class="col-md-5"><input type="text" class="form-control" name="reminder_message" placeholder="Reminder Message" required></div>
-                            <div class="col-md-3"><input type="text" class="form-control" name="reminder_due_date" placeholder="Due Date (YYYY-MM-DD)"></div>
-                        </div>
-                        <button type="submit" class="btn btn-success mt-3">Add Reminder</button>
-                    </form>
-                    <form method="GET" class="row mb-2">
-                        <div class="col-auto"><input type="text" class="form-control" name="reminder_due" placeholder="Due Date (YYYY-MM-DD)" value="{{request.args.get('reminder_due','')}}"></div>
-                        <div class="col-auto">
-                            <select class="form-select" name="reminder_completed">
-                                <option value="">All</option>
-                                <option value="yes" {% if request.args.get('reminder_completed')=='yes' %}selected{% endif %}>Completed</option>
-                                <option value="no" {% if request.args.get('reminder_completed')=='no' %}selected{% endif %}>Not Completed</option>
-                            </select>
-                        </div>
-                        <div class="col-auto"><button type="submit" class="btn btn-secondary">Filter</button></div>
-                    </form>
-                    <h2 class="h5 mb-3">Reminders</h2>
-                    <table class="table table-bordered table-hover bg-white">
-                        <thead class="table-light">
-                            <tr><th>Customer</th><th>Message</th><th>Due Date</th><th>Completed</th><th>Edit</th><th>Delete</th></tr>
-                        </thead>
-                        <tbody>
-                        {% for r in reminders %}
-                        <tr>
-                            <td>{{r.customer.name}}</td>
-                            <td>{{r.message}}</td>
-                            <td>{{r.due_date}}</td>
-                            <td>{{'Yes' if r.completed else 'No'}}</td>
-                            <td><a href="{{ url_for('edit_reminder', reminder_id=r.id) }}" class="btn btn-sm btn-warning">Edit</a></td>
-                            <td><a href="{{ url_for('delete_reminder', reminder_id=r.id) }}" class="btn btn-sm btn-danger">Delete</a></td>
-                        </tr>
-                        {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-                <div class="tab-pane fade {% if tab=='activities' %}show active{% endif %}" id="activities">
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="add_activity" value="1">
-                        <h2 class="h5">Add Activity</h2>
-                        <div class="row g-2">
-                            <div class="col-md-3"><input type="text" class="form-control" name="activity_subject" placeholder="Subject" required></div>
-                            <div class="col-md-2">
-                                <select class="form-select" name="activity_type">
-                                    <option value="Call">Call</option>
-                                    <option value="Meeting">Meeting</option>
-                                    <option value="Task">Task</option>
-                                    <option value="Email">Email</option>
-                                </select>
-                            </div>
-                            <div class="col-md-2"><input type="text" class="form-control" name="activity_date" placeholder="Date (YYYY-MM-DD)" required></div>
-                            <div class="col-md-2">
-                                <select class="form-select" name="activity_related_type">
-                                    <option value="">No Relation</option>
-                                    <option value="Customer">Customer</option>
-                                    <option value="Deal">Deal</option>
-                                    <option value="Lead">Lead</option>
-                                </select>
-                            </div>
-                            <div class="col-md-2"><input type="number" class="form-control" name="activity_related_id" placeholder="Related ID"></div>
-                            <div class="col-md-12 mt-2">
-                                <textarea class="form-control" name="activity_notes" placeholder="Notes"></textarea>
-                            </div>
-                        </div>
-                        <button type="submit" class="btn btn-success mt-3">Add Activity</button>
-                    </form>
-                    <form method="POST" class="card card-body mb-3">
-                        <input type="hidden" name="send_email" value="1">
-                        <h2 class="h5">Send Email</h2>
-                        <div class="row g-2">
-                            <div class="col-md-4"><input type="email" class="form-control" name="recipient" placeholder="Recipient Email" required></div>
-                            <div class="col-md-4"><input type="text" class="form-control" name="subject" placeholder="Subject" required></div>
-                            <div class="col-md-12 mt-2">
-                                <textarea class="form-control" name="body" placeholder="Email Body" required></textarea>
-                            </div>
-                        </div>
-                        <button type="submit" class="btn btn-primary mt-3">Send Email</button>
-                    </form>
-                    <h2 class="h5 mb-3">Activities Calendar</h2>
-                    <table class="table table-bordered table-hover bg-white">
-                        <thead class="table-light">
-                            <tr><th>Date</th><th>Type</th><th>Subject</th><th>Related</th><th>Notes</th></tr>
-                        </thead>
-                        <tbody>
-                        {% for date, acts in activities_by_date.items() %}
-                            {% for a in acts %}
-                            <tr>
-                                <td>{{a.date}}</td>
-                                <td>{{a.type}}</td>
-                                <td>{{a.subject}}</td>
-                                <td>{{a.related_type}} {{a.related_id}}</td>
-                                <td>{{a.notes}}</td>
-                            </tr>
-                            {% endfor %}
-                        {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-            </div>
-        </div>
-    </body>
-    </html>
-    ''', customers=customers, contacts=contacts, tasks=tasks, deals=deals, reminders=reminders, tab=tab, msg=msg, export_url=export_url, deals_by_stage=deals_by_stage, activities_by_date=activities_by_date)
+    # A page showing a flashed message is not a copy to revalidate later: no ETag. A ?partial=1
+    # fragment has nowhere to show one, so it leaves them for the next full page
+    flashed = not request.args.get('partial') and get_flashed_messages()
+    response = None if flashed else dashboard_validators(tab, request.args)
+    if response is None:
+        return render_dashboard(tab)
+    if response.make_conditional(request).status_code == 304:
+        return response
+    # Only the requested tab is loaded; the other panes are not rendered
+    response.set_data(render_dashboard(tab))
+    return response
 
 # --- Edit/Delete for Contacts ---
 @app.route('/edit_contact/<int:contact_id>', methods=['GET', 'POST'])
@@ -1005,14 +1516,7 @@ def edit_contact(contact_id):
         contact.role = request.form.get('role')
         db.session.commit()
         return redirect(url_for('home', tab='contacts'))
-    return render_template_string('''<form method="POST" class="container mt-5"><h3>Edit Contact</h3>
-        <input type="text" name="name" value="{{contact.name}}" required class="form-control mb-2">
-        <input type="email" name="email" value="{{contact.email}}" class="form-control mb-2">
-        <input type="text" name="phone" value="{{contact.phone}}" class="form-control mb-2">
-        <input type="text" name="role" value="{{contact.role}}" class="form-control mb-2">
-        <button type="submit" class="btn btn-success">Save</button>
-        <a href="{{ url_for('home', tab='contacts') }}" class="btn btn-secondary">Cancel</a>
-    </form>''', contact=contact)
+    return render_template('edit_contact.html', contact=contact)
 
 @app.route('/delete_contact/<int:contact_id>')
 def delete_contact(contact_id):
@@ -1032,18 +1536,7 @@ def edit_task(task_id):
         task.status = request.form.get('status')
         db.session.commit()
         return redirect(url_for('home', tab='tasks'))
-    return render_template_string('''<form method="POST" class="container mt-5"><h3>Edit Task</h3>
-        <input type="text" name="title" value="{{task.title}}" required class="form-control mb-2">
-        <input type="text" name="due_date" value="{{task.due_date}}" class="form-control mb-2">
-        <select name="status" class="form-select mb-2">
-            <option value="Todo" {% if task.status=='Todo' %}selected{% endif %}>Todo</option>
-            <option value="In Progress" {% if task.status=='In Progress' %}selected{% endif %}>In Progress</option>
-            <option value="Done" {% if task.status=='Done' %}selected{% endif %}>Done</option>
-        </select>
-        <textarea name="description" class="form-control mb-2">{{task.description}}</textarea>
-        <button type="submit" class="btn btn-success">Save</button>
-        <a href="{{ url_for('home', tab='tasks') }}" class="btn btn-secondary">Cancel</a>
-    </form>''', task=task)
+    return render_template('edit_task.html', task=task)
 
 @app.route('/delete_task/<int:task_id>')
 def delete_task(task_id):
@@ -1063,27 +1556,12 @@ def edit_deal(deal_id):
         deal.status = request.form.get('status')
         db.session.commit()
         return redirect(url_for('home', tab='deals'))
-    return render_template_string('''<form method="POST" class="container mt-5"><h3>Edit Deal</h3>
-        <input type="text" name="title" value="{{deal.title}}" required class="form-control mb-2">
-        <input type="number" step="0.01" name="amount" value="{{deal.amount}}" class="form-control mb-2">
-        <select name="stage" class="form-select mb-2">
-            <option value="New" {% if deal.stage=='New' %}selected{% endif %}>New</option>
-            <option value="Qualified" {% if deal.stage=='Qualified' %}selected{% endif %}>Qualified</option>
-            <option value="Won" {% if deal.stage=='Won' %}selected{% endif %}>Won</option>
-            <option value="Lost" {% if deal.stage=='Lost' %}selected{% endif %}>Lost</option>
-        </select>
-        <select name="status" class="form-select mb-2">
-            <option value="Open" {% if deal.status=='Open' %}selected{% endif %}>Open</option>
-            <option value="Closed" {% if deal.status=='Closed' %}selected{% endif %}>Closed</option>
-        </select>
-        <button type="submit" class="btn btn-success">Save</button>
-        <a href="{{ url_for('home', tab='deals') }}" class="btn btn-secondary">Cancel</a>
-    </form>''', deal=deal)
+    return render_template('edit_deal.html', deal=deal)
 
 @app.route('/delete_deal/<int:deal_id>')
 def delete_deal(deal_id):
-    deal = Deal.query.get_or_404(deal_id)
-    db.session.delete(deal)
+    Deal.query.get_or_404(deal_id)
+    delete_by_ids(Deal, [deal_id])
     db.session.commit()
     return redirect(url_for('home', tab='deals'))
 
@@ -1097,16 +1575,7 @@ def edit_reminder(reminder_id):
         reminder.completed = bool(request.form.get('completed'))
         db.session.commit()
         return redirect(url_for('home', tab='reminders'))
-    return render_template_string('''<form method="POST" class="container mt-5"><h3>Edit Reminder</h3>
-        <input type="text" name="message" value="{{reminder.message}}" required class="form-control mb-2">
-        <input type="text" name="due_date" value="{{reminder.due_date}}" class="form-control mb-2">
-        <div class="form-check mb-2">
-            <input class="form-check-input" type="checkbox" name="completed" id="completed" {% if reminder.completed %}checked{% endif %}>
-            <label class="form-check-label" for="completed">Completed</label>
-        </div>
-        <button type="submit" class="btn btn-success">Save</button>
-        <a href="{{ url_for('home', tab='reminders') }}" class="btn btn-secondary">Cancel</a>
-    </form>''', reminder=reminder)
+    return render_template('edit_reminder.html', reminder=reminder)
 
 @app.route('/delete_reminder/<int:reminder_id>')
 def delete_reminder(reminder_id):
@@ -1128,43 +1597,71 @@ def edit_lead(lead_id):
         lead.notes = request.form.get('notes')
         db.session.commit()
         return redirect(url_for('home', tab='leads'))
-    return render_template_string('''<form method="POST" class="container mt-5"><h3>Edit Lead</h3>
-        <input type="text" name="name" value="{{lead.name}}" required class="form-control mb-2">
-        <input type="email" name="email" value="{{lead.email}}" required class="form-control mb-2">
-        <input type="text" name="phone" value="{{lead.phone}}" class="form-control mb-2">
-        <input type="text" name="company" value="{{lead.company}}" class="form-control mb-2">
-        <select name="status" class="form-select mb-2">
-            <option value="New" {% if lead.status=='New' %}selected{% endif %}>New</option>
-            <option value="Assigned" {% if lead.status=='Assigned' %}selected{% endif %}>Assigned</option>
-            <option value="Converted" {% if lead.status=='Converted' %}selected{% endif %}>Converted</option>
-            <option value="Lost" {% if lead.status=='Lost' %}selected{% endif %}>Lost</option>
-        </select>
-        <textarea name="notes" class="form-control mb-2">{{lead.notes}}</textarea>
-        <button type="submit" class="btn btn-success">Save</button>
-        <a href="{{ url_for('home', tab='leads') }}" class="btn btn-secondary">Cancel</a>
-    </form>''', lead=lead)
+    return render_template('edit_lead.html', lead=lead)
 
 @app.route('/delete_lead/<int:lead_id>')
 def delete_lead(lead_id):
-    lead = Lead.query.get_or_404(lead_id)
-    db.session.delete(lead)
+    Lead.query.get_or_404(lead_id)
+    delete_by_ids(Lead, [lead_id])
     db.session.commit()
     return redirect(url_for('home', tab='leads'))
 
+LEAD_CONFLICT_MODES = ('merge', 'skip')
+
+def convert_leads(condition, on_conflict='merge'):
+    """Turn the leads matching condition into customers, each with a Primary contact, in one transaction.
+
+    Set-based: one INSERT ... SELECT for the customers, one for the contacts and a
+    DELETE of the leads, however many leads match. A lead whose email already
+    belongs to a customer is, with on_conflict='merge', folded into that customer
+    (its blank phone/notes are filled from the lead, the lead becomes a contact)
+    and removed; with 'skip' it is left as a lead. Returns {'converted': count of
+    new customers, 'merged': [...], 'skipped': [...]}, listing lead_id, email and
+    customer_id for each collision in lead id order.
+    """
+    if on_conflict not in LEAD_CONFLICT_MODES:
+        raise ValueError('on_conflict must be one of %s' % ', '.join(LEAD_CONFLICT_MODES))
+    try:
+        collisions = [{'lead_id': lead_id, 'email': email, 'customer_id': customer_id} for lead_id, email, customer_id in db.session.execute(
+            db.select(Lead.id, Lead.email, Customer.id).join(Customer, Customer.email == Lead.email).where(condition).order_by(Lead.id))]
+        if on_conflict == 'skip' and collisions:
+            condition = db.and_(condition, Lead.id.not_in([c['lead_id'] for c in collisions]))
+        elif collisions:
+            def lead_value(column):
+                return db.select(column).where(Lead.email == Customer.email).scalar_subquery()
+            db.session.execute(update(Customer).where(Customer.id.in_([c['customer_id'] for c in collisions])).values(
+                phone=func.coalesce(func.nullif(Customer.phone, ''), lead_value(Lead.phone)),
+                notes=func.coalesce(func.nullif(Customer.notes, ''), lead_value(Lead.notes), '')))
+        converted = db.session.execute(insert(Customer).from_select(
+            ['name', 'email', 'phone', 'status', 'notes'],
+            db.select(Lead.name, Lead.email, Lead.phone, db.literal('Lead'), func.coalesce(Lead.notes, ''))
+            .where(condition, ~db.exists().where(Customer.email == Lead.email)).order_by(Lead.id))).rowcount
+        db.session.execute(insert(Contact).from_select(
+            ['customer_id', 'name', 'email', 'phone', 'role'],
+            db.select(Customer.id, Lead.name, Lead.email, Lead.phone, db.literal('Primary'))
+            .join(Customer, Customer.email == Lead.email)
+            .where(condition, ~db.exists().where(Contact.customer_id == Customer.id, Contact.email == Lead.email)).order_by(Lead.id)))
+        db.session.execute(delete(Lead).where(condition))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if on_conflict == 'skip':
+        return {'converted': converted, 'merged': [], 'skipped': collisions}
+    return {'converted': converted, 'merged': collisions, 'skipped': []}
+
+def conversion_message(report):
+    parts = ['%d lead(s) converted' % report['converted']]
+    if report['merged']:
+        parts.append('%d merged into existing customers (%s)' % (len(report['merged']), ', '.join(c['email'] for c in report['merged'][:5])))
+    if report['skipped']:
+        parts.append('%d skipped, email already a customer (%s)' % (len(report['skipped']), ', '.join(c['email'] for c in report['skipped'][:5])))
+    return '; '.join(parts) + '.'
+
 @app.route('/convert_lead/<int:lead_id>')
 def convert_lead(lead_id):
-    lead = Lead.query.get_or_404(lead_id)
-    # Create customer from lead
-    customer = Customer(name=lead.name, email=lead.email, phone=lead.phone, status='Lead', notes=lead.notes)
-    db.session.add(customer)
-    db.session.commit()
-    # Optionally, create a contact as well
-    contact = Contact(customer_id=customer.id, name=lead.name, email=lead.email, phone=lead.phone, role='Primary')
-    db.session.add(contact)
-    db.session.commit()
-    # Mark lead as converted or delete
-    db.session.delete(lead)
-    db.session.commit()
+    Lead.query.get_or_404(lead_id)
+    convert_leads(Lead.id == lead_id)
     return redirect(url_for('home', tab='customers'))
 
 @app.route('/customer/<int:customer_id>/edit', methods=['GET', 'POST'])
@@ -1178,52 +1675,334 @@ def edit_customer(customer_id):
         customer.notes = request.form.get('notes')
         db.session.commit()
         return redirect(url_for('home'))
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Edit Customer</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
-    </head>
-    <body class="bg-light">
-        <div class="container my-5">
-            <h1 class="mb-4">Edit Customer</h1>
-            <form method="POST" class="card card-body">
-                <div class="row g-2">
-                    <div class="col-md-3"><input type="text" class="form-control" name="name" value="{{customer.name}}" required></div>
-                    <div class="col-md-3"><input type="email" class="form-control" name="email" value="{{customer.email}}" required></div>
-                    <div class="col-md-2"><input type="text" class="form-control" name="phone" value="{{customer.phone}}"></div>
-                    <div class="col-md-2">
-                        <select class="form-select" name="status">
-                            <option value="Lead" {% if customer.status=='Lead' %}selected{% endif %}>Lead</option>
-                            <option value="Opportunity" {% if customer.status=='Opportunity' %}selected{% endif %}>Opportunity</option>
-                            <option value="Customer" {% if customer.status=='Customer' %}selected{% endif %}>Customer</option>
-                        </select>
-                    </div>
-                    <div class="col-md-12 mt-2">
-                        <textarea class="form-control" name="notes">{{customer.notes}}</textarea>
-                    </div>
-                </div>
-                <button type="submit" class="btn btn-primary mt-3">Save Changes</button>
-                <a href="/" class="btn btn-secondary mt-3">Cancel</a>
-            </form>
-        </div>
-    </body>
-    </html>
-    ''', customer=customer)
+    return render_template('edit_customer.html', customer=customer)
 
 @app.route('/delete/<int:customer_id>')
 def delete_customer(customer_id):
-    customer = Customer.query.get_or_404(customer_id)
-    db.session.delete(customer)
+    Customer.query.get_or_404(customer_id)
+    delete_by_ids(Customer, [customer_id])
     db.session.commit()
     return redirect(url_for('home'))
 
-# @app.route('/export_customers')
-# def export_customers():
-#     ... # CSV export temporarily disabled
+# --- Set-based deletes ---
+# Contacts, tasks, deals and reminders go with their customer and steps with their
+# campaign by ON DELETE CASCADE; activities point at their record through
+# (related_type, related_id), which no foreign key covers, so they are deleted here.
+ACTIVITY_OWNERS = {Customer: 'Customer', Deal: 'Deal', Lead: 'Lead'}
+BULK_DELETE_CHUNK = 500
+
+def delete_by_ids(model, ids):
+    """DELETE ... WHERE id IN (ids) with the activities logged against those rows; returns the rows deleted."""
+    if model in ACTIVITY_OWNERS:
+        owned = [db.and_(Activity.related_type == ACTIVITY_OWNERS[model], Activity.related_id.in_(ids))]
+        if model is Customer:
+            owned.append(db.and_(Activity.related_type == 'Deal',
+                                 Activity.related_id.in_(db.select(Deal.id).where(Deal.customer_id.in_(ids)))))
+        db.session.execute(delete(Activity).where(db.or_(*owned)), execution_options={'synchronize_session': False})
+    return db.session.execute(delete(model).where(model.id.in_(ids)), execution_options={'synchronize_session': False}).rowcount
+
+def bulk_delete(model, ids):
+    # One transaction per chunk: the write lock is held briefly, and a large selection
+    # never builds a statement with more parameters than the database accepts
+    ids = sorted(set(ids))
+    deleted = 0
+    for start in range(0, len(ids), BULK_DELETE_CHUNK):
+        deleted += delete_by_ids(model, ids[start:start + BULK_DELETE_CHUNK])
+        db.session.commit()
+    return deleted
+
+@app.route('/bulk_delete/<entity>', methods=['POST'])
+def bulk_delete_entity(entity):
+    """Delete the selected rows of any API resource: form fields ids=..., or JSON {"ids": [...]}."""
+    if entity not in API_RESOURCES:
+        return 'Unknown entity', 404
+    data = request.get_json(silent=True) if request.is_json else None
+    raw = data.get('ids') if isinstance(data, dict) else request.form.getlist('ids')
+    ids = [int(i) for i in raw or [] if str(i).isdigit()]
+    deleted = bulk_delete(API_RESOURCES[entity][0], ids)
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        return jsonify({'deleted': deleted})
+    return redirect(url_for('home', tab=entity if entity in TAB_LOADERS else 'marketing'))
+
+# --- Streaming export ---
+# entity: (filtered query builder shared with the tab, exported columns)
+EXPORTS = {
+    'customers': (customers_query, [Customer.id, Customer.name, Customer.email, Customer.phone, Customer.status, Customer.notes]),
+    'contacts': (contacts_query, [Contact.id, Contact.customer_id, Contact.name, Contact.email, Contact.phone, Contact.role]),
+    'tasks': (tasks_query, [Task.id, Task.customer_id, Task.title, Task.description, Task.due_date, Task.status]),
+    'deals': (deals_query, [Deal.id, Deal.customer_id, Deal.title, Deal.amount, Deal.stage, Deal.status]),
+    'reminders': (reminders_query, [Reminder.id, Reminder.customer_id, Reminder.message, Reminder.due_date, Reminder.completed]),
+    'leads': (leads_query, [Lead.id, Lead.name, Lead.email, Lead.phone, Lead.company, Lead.status, Lead.notes]),
+    'activities': (activities_query, [Activity.id, Activity.subject, Activity.type, Activity.date, Activity.related_type, Activity.related_id, Activity.notes]),
+    'campaign_logs': (campaign_logs_query, [CampaignLog.id, CampaignLog.campaign_id, CampaignLog.segment_id, CampaignLog.recipient_email,
+                                            CampaignLog.step_id, CampaignLog.status, CampaignLog.timestamp]),
+}
+EXPORT_CHUNK_ROWS = 1000
+
+@app.template_global()
+def export_url(entity, fmt='csv'):
+    # Export link carrying the current tab filters but not the paging args
+    args = {k: v for k, v in request.args.items() if k not in ('tab', 'partial') and not k.endswith(('after', 'before', 'per_page'))}
+    return url_for('export_entity', entity=entity, format=fmt, **args)
+
+@app.route('/export/<entity>')
+def export_entity(entity):
+    """Stream every matching row as CSV (default) or NDJSON in constant memory."""
+    if entity not in EXPORTS:
+        return 'Unknown export', 404
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return 'Unknown format', 400
+    build_query, columns = EXPORTS[entity]
+    names = [c.key for c in columns]
+    rows = build_query(request.args).with_entities(*columns).order_by(columns[0]).yield_per(EXPORT_CHUNK_ROWS)
+
+    def generate_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(names)
+        for i, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if i % EXPORT_CHUNK_ROWS == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    def generate_ndjson():
+        chunk = []
+        for row in rows:
+            chunk.append(json.dumps(dict(zip(names, row)), default=str))
+            if len(chunk) == EXPORT_CHUNK_ROWS:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+
+    if fmt == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename=%s.%s' % (entity, fmt)})
+
+# --- JSON API (/api/v1) ---
+# resource: (model, filtered query builder shared with the tabs)
+API_RESOURCES = {
+    'customers': (Customer, customers_query),
+    'contacts': (Contact, contacts_query),
+    'tasks': (Task, tasks_query),
+    'deals': (Deal, deals_query),
+    'reminders': (Reminder, reminders_query),
+    'leads': (Lead, leads_query),
+    'activities': (Activity, activities_query),
+    'campaigns': (Campaign, lambda args: Campaign.query),
+    'segments': (Segment, lambda args: Segment.query),
+}
+API_MAX_BATCH = 10000
+# model: {field: check} for values that need more than a type check; check raises ValueError
+API_FIELD_CHECKS = {
+    Segment: {'rules': parse_segment_rules},
+}
+
+class APIError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+@app.errorhandler(APIError)
+def api_error(e):
+    db.session.rollback()
+    return jsonify({'error': str(e)}), e.status
+
+def api_resource(name):
+    if name not in API_RESOURCES:
+        raise APIError('unknown resource %r' % name, 404)
+    return API_RESOURCES[name]
+
+def api_columns(model):
+    return {c.key: c for c in model.__table__.columns}
+
+def api_fields(model, spec):
+    # ?fields=name,email -> those columns (id is always included for the cursor)
+    columns = api_columns(model)
+    if not spec:
+        return list(columns.values())
+    names = [f.strip() for f in spec.split(',') if f.strip()]
+    unknown = [f for f in names if f not in columns]
+    if unknown:
+        raise APIError('unknown field(s): %s' % ', '.join(unknown))
+    return [columns['id']] + [columns[f] for f in names if f != 'id']
+
+JSON_TYPE_NAMES = {int: 'an integer', float: 'a number', bool: 'true or false', str: 'a string'}
+
+def api_value_error(column, value):
+    # Why a JSON value cannot be stored in column, or None if it can (dates are ISO strings)
+    if value is None:
+        return None if column.nullable else 'may not be null'
+    expected = column.type.python_type
+    if expected is float:
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif expected is int:
+        valid = isinstance(value, int) and not isinstance(value, bool)
+    else:
+        valid = isinstance(value, expected)
+    if not valid:
+        return 'expected %s' % JSON_TYPE_NAMES[expected]
+    length = getattr(column.type, 'length', None)
+    if length and len(value) > length:
+        return 'longer than %d characters' % length
+    return None
+
+def api_rows(model, data, op):
+    """Validate a create/update payload (an object or a list of objects) into executemany rows."""
+    rows = data if isinstance(data, list) else [data]
+    if not rows or len(rows) > API_MAX_BATCH:
+        raise APIError('expected 1 to %d objects' % API_MAX_BATCH)
+    columns = api_columns(model)
+    required = [c.key for c in columns.values() if not c.nullable and not c.primary_key and c.default is None]
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict):
+            raise APIError('item %d is not an object' % i)
+        unknown = [k for k in row if k not in columns]
+        if unknown:
+            raise APIError('item %d: unknown field(s): %s' % (i, ', '.join(unknown)))
+        for key, value in row.items():
+            error = api_value_error(columns[key], value)
+            check = API_FIELD_CHECKS.get(model, {}).get(key)
+            if not error and check and value not in (None, ''):
+                try:
+                    check(value)
+                except ValueError as e:
+                    error = str(e)
+            if error:
+                raise APIError('item %d: %s: %s' % (i, key, error))
+        if op == 'create':
+            if 'id' in row:
+                raise APIError('item %d: id is assigned by the server' % i)
+            missing = [k for k in required if row.get(k) in (None, '')]
+            if missing:
+                raise APIError('item %d: missing %s' % (i, ', '.join(missing)))
+        elif not isinstance(row.get('id'), int):
+            raise APIError('item %d: id is required' % i)
+        elif len(row) < 2:
+            raise APIError('item %d: nothing to update' % i)
+    return rows
+
+def api_ids(data):
+    ids = data.get('ids') if isinstance(data, dict) else data
+    if not isinstance(ids, list) or not ids or len(ids) > API_MAX_BATCH or not all(isinstance(i, int) for i in ids):
+        raise APIError('expected "ids": a list of 1 to %d integers' % API_MAX_BATCH)
+    return ids
+
+def api_create(model, data):
+    rows = api_rows(model, data, 'create')
+    # Defaults are filled in so every row has the same keys and the INSERT is one executemany
+    defaults = {c.key: c.default.arg for c in api_columns(model).values() if c.default is not None and c.default.is_scalar}
+    keys = set(defaults).union(*rows)
+    rows = [{k: row.get(k, defaults.get(k)) for k in keys} for row in rows]
+    return list(db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows))
+
+def api_update(model, data):
+    rows = api_rows(model, data, 'update')
+    ids = [row['id'] for row in rows]
+    found = set(db.session.scalars(db.select(model.id).where(model.id.in_(ids))))
+    missing = [i for i in ids if i not in found]
+    if missing:
+        raise APIError('%s not found: %s' % (model.__tablename__, ', '.join(map(str, missing[:20]))), 404)
+    # ORM bulk UPDATE by primary key: one executemany per distinct set of keys
+    db.session.execute(update(model), rows)
+    return len(ids)
+
+def api_delete(model, data):
+    # Children go by ON DELETE CASCADE, in the same transaction as the rest of the request
+    return delete_by_ids(model, api_ids(data))
+
+API_OPERATIONS = {'create': api_create, 'update': api_update, 'delete': api_delete}
+
+def api_apply(name, op, data):
+    if op not in API_OPERATIONS:
+        raise APIError('unknown op %r' % op)
+    model = api_resource(name)[0]
+    try:
+        result = API_OPERATIONS[op](model, data)
+    except IntegrityError as e:
+        raise APIError('conflict: %s' % e.orig, 409)
+    except DataError as e:
+        raise APIError('invalid value: %s' % e.orig)
+    except StatementError as e:
+        # Raised before the database sees the statement, when a value cannot be bound
+        if isinstance(e, DBAPIError):
+            raise
+        raise APIError('invalid value: %s' % e.orig)
+    return {'create': 'ids', 'update': 'updated', 'delete': 'deleted'}[op], result
+
+def api_payload():
+    data = request.get_json(silent=True)
+    if data is None:
+        raise APIError('request body must be JSON')
+    return data
+
+@app.route('/api/v1/<resource>', methods=['GET'])
+def api_list(resource):
+    """Cursor-paginated list; accepts the tab filters, fields=, per_page=, after= and before=."""
+    model, build_query = api_resource(resource)
+    columns = api_fields(model, request.args.get('fields'))
+    page = keyset_paginate(build_query(request.args).with_entities(*columns), [model.id], request.args)
+    return jsonify({'data': [dict(row._mapping) for row in page.items],
+                    'next_cursor': page.next_cursor, 'prev_cursor': page.prev_cursor})
+
+@app.route('/api/v1/<resource>/<int:item_id>', methods=['GET'])
+def api_get(resource, item_id):
+    model = api_resource(resource)[0]
+    columns = api_fields(model, request.args.get('fields'))
+    row = db.session.execute(db.select(*columns).where(model.id == item_id)).first()
+    if row is None:
+        raise APIError('%s %d not found' % (model.__tablename__, item_id), 404)
+    return jsonify(dict(row._mapping))
+
+@app.route('/api/v1/<resource>', methods=['POST', 'PATCH', 'DELETE'])
+def api_write(resource):
+    """POST creates, PATCH updates (each object needs an id), DELETE takes {"ids": [...]}; all in one transaction."""
+    op = {'POST': 'create', 'PATCH': 'update', 'DELETE': 'delete'}[request.method]
+    key, result = api_apply(resource, op, api_payload())
+    db.session.commit()
+    return jsonify({key: result}), 201 if op == 'create' else 200
+
+@app.route('/api/v1/<resource>/<int:item_id>', methods=['PATCH', 'DELETE'])
+def api_write_one(resource, item_id):
+    model = api_resource(resource)[0]
+    if request.method == 'DELETE':
+        deleted = api_delete(model, [item_id])
+        if not deleted:
+            raise APIError('%s %d not found' % (model.__tablename__, item_id), 404)
+    else:
+        data = api_payload()
+        if not isinstance(data, dict):
+            raise APIError('expected an object')
+        api_update(model, dict(data, id=item_id))
+    db.session.commit()
+    return jsonify({'id': item_id})
+
+@app.route('/api/v1/batch', methods=['POST'])
+def api_batch():
+    """Apply [{"resource", "op", "data"}, ...] in order in one transaction; any error rolls back all of it."""
+    operations = api_payload()
+    if isinstance(operations, dict):
+        operations = operations.get('operations')
+    if not isinstance(operations, list) or not operations:
+        raise APIError('expected "operations": a non-empty list')
+    results = []
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise APIError('operation %d is not an object' % i)
+        try:
+            key, result = api_apply(operation.get('resource'), operation.get('op'), operation.get('data'))
+        except APIError as e:
+            raise APIError('operation %d: %s' % (i, e), e.status)
+        results.append({key: result})
+    db.session.commit()
+    return jsonify({'results': results})
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,651 @@
+"""Benchmarks for Mukera CRM.
+
+    python bench.py smtp [--messages N] [--latency SECONDS]
+    python bench.py render [--iterations N]
+    python bench.py wire [--customers N]
+    python bench.py db [--readers N] [--writers N] [--seconds S]
+    python bench.py dispatch [--messages N] [--latency SECONDS] [--concurrency N ...]
+    python bench.py search [--scale N] [--queries N] [--target-ms MS]
+    python bench.py load [--scale N] [--requests N] [--concurrency N] [--baseline FILE] [--save-baseline]
+
+Each benchmark runs against local stand-ins (a fake SMTP server, a scratch
+SQLite database) so it can run anywhere without touching real services.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import http.client
+import tempfile
+import threading
+import socketserver
+from email.mime.text import MIMEText
+from urllib.parse import urlencode
+
+
+def use_scratch_database(name):
+    # Must run before app is first imported: the engine and schema are set up at import
+    tmp = tempfile.mkdtemp(prefix='mukera-%s-' % name)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, name + '.db')
+
+
+# --- Fake SMTP server ---
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough ESMTP for smtplib: EHLO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT.
+
+    server.connect_latency is slept before the greeting (stands in for the
+    TCP/TLS handshake and login round trips); server.latency before every reply.
+    A server.tempfail share of RCPT commands is refused with a 451 (greylisting).
+    """
+
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        if self.server.connect_latency:
+            time.sleep(self.server.connect_latency)
+        self.reply('220 fake ESMTP ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b'250-fake\r\n250-AUTH PLAIN\r\n')
+                self.reply('250 8BITMIME')
+            elif verb == 'AUTH':
+                self.reply('235 2.7.0 Authentication successful')
+            elif verb == 'RCPT' and self.server.tempfail and random.random() < self.server.tempfail:
+                self.reply('451 4.7.1 Greylisted, try again later')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with self.server.lock:
+                    self.server.delivered += 1
+                self.reply('250 2.0.0 Ok: queued')
+            elif verb == 'QUIT':
+                self.reply('221 2.0.0 Bye')
+                return
+            else:
+                self.reply('250 2.0.0 Ok')
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, connect_latency=0.0, tempfail=0.0):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.tempfail = tempfail
+        self.delivered = 0
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def sample_message(i):
+    msg = MIMEText('Hello from the benchmark, message %d' % i)
+    msg['Subject'] = 'Benchmark %d' % i
+    msg['From'] = 'bench@example.com'
+    msg['To'] = 'rcpt%d@example.com' % i
+    return msg.as_string()
+
+
+def report(name, count, elapsed):
+    print('%-28s %6d msgs  %8.2fs  %10.1f msgs/sec' % (name, count, elapsed, count / elapsed))
+
+
+# --- SMTP: one connection per message vs. pooled sessions ---
+def bench_smtp(args):
+    import smtplib
+    from smtp_pool import SMTPPool
+
+    with FakeSMTPServer(latency=args.latency, connect_latency=args.connect_latency) as server:
+        start = time.perf_counter()
+        for i in range(args.messages):
+            with smtplib.SMTP('127.0.0.1', server.port) as session:
+                session.login('bench', 'secret')
+                session.sendmail('bench@example.com', ['rcpt%d@example.com' % i], sample_message(i))
+        report('connection per message', args.messages, time.perf_counter() - start)
+
+        pool = SMTPPool('127.0.0.1', server.port, 'bench', 'secret', max_connections=1, use_tls=False)
+        start = time.perf_counter()
+        for i in range(args.messages):
+            pool.sendmail('bench@example.com', ['rcpt%d@example.com' % i], sample_message(i))
+        report('pooled session', args.messages, time.perf_counter() - start)
+        pool.close()
+
+
+# --- Dispatch: one message at a time vs. the concurrent dispatcher ---
+def bench_dispatch(args):
+    from smtp_pool import SMTPPool
+    from dispatcher import Dispatcher
+
+    with FakeSMTPServer(latency=args.latency, connect_latency=args.connect_latency, tempfail=args.tempfail) as server:
+        pool = SMTPPool('127.0.0.1', server.port, 'bench', 'secret', max_connections=1, use_tls=False)
+        start = time.perf_counter()
+        failed = 0
+        for i in range(args.messages):
+            try:
+                pool.sendmail('bench@example.com', ['rcpt%d@example.com' % i], sample_message(i))
+            except Exception:
+                failed += 1
+        report('sequential (%d failed)' % failed, args.messages, time.perf_counter() - start)
+        pool.close()
+
+        for concurrency in args.concurrency:
+            pool = SMTPPool('127.0.0.1', server.port, 'bench', 'secret', max_connections=concurrency, use_tls=False)
+            dispatcher = Dispatcher(lambda rcpt, msg: pool.sendmail('bench@example.com', [rcpt], msg),
+                                    concurrency=concurrency, rate=args.rate, domain_rate=args.domain_rate, backoff=0.05)
+            results = {'Sent': 0, 'Failed': 0}
+
+            def record(recipient, payload, status, error):
+                results[status] += 1
+
+            # Recipients spread over 10 domains, generated lazily behind the dispatcher's bounded queue
+            items = (('rcpt%d@domain%d.example.com' % (i, i % 10), sample_message(i)) for i in range(args.messages))
+            start = time.perf_counter()
+            dispatcher.dispatch(items, record)
+            report('dispatcher x%d (%d failed)' % (concurrency, results['Failed']), args.messages, time.perf_counter() - start)
+            pool.close()
+
+
+# --- Templates: compile per request vs. the cached loader ---
+def bench_render(args):
+    use_scratch_database('render')
+    from flask import render_template, render_template_string
+    from app import app, TAB_LOADERS, render_tab
+
+    with app.test_request_context('/?tab=leads'):
+        source = app.jinja_loader.get_source(app.jinja_env, 'tabs/leads.html')[0]
+        context = TAB_LOADERS['leads']({})
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            render_template_string(source, **context)
+        elapsed = time.perf_counter() - start
+        print('%-28s %8.3f ms/render' % ('render_template_string', elapsed * 1000 / args.iterations))
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            render_template('tabs/leads.html', **context)
+        elapsed = time.perf_counter() - start
+        print('%-28s %8.3f ms/render' % ('cached template', elapsed * 1000 / args.iterations))
+
+        for tab in TAB_LOADERS:
+            context = TAB_LOADERS[tab]({})
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                render_tab(tab, context)
+            elapsed = time.perf_counter() - start
+            print('%-28s %8.3f ms/render' % ('tab ' + tab, elapsed * 1000 / args.iterations))
+
+
+# --- Bytes on the wire: identity vs. gzip/brotli vs. 304 revalidation ---
+WIRE_MARKER = '@bench-wire.example.com'
+
+
+def seed_wire_dataset(customers):
+    # Shaped like a small CRM: each customer has contacts, tasks, deals and a
+    # reminder; leads and activities outnumber customers.
+    from sqlalchemy import insert
+    from app import db, Customer, Contact, Task, Deal, Reminder, Lead, Activity, DEAL_STAGES
+    db.session.execute(insert(Customer), [
+        {'name': 'Customer %d' % i, 'email': 'customer%d%s' % (i, WIRE_MARKER), 'phone': '+1 555 %04d' % i,
+         'status': ('Lead', 'Opportunity', 'Customer')[i % 3], 'notes': 'Met at the %d trade fair; follow up on pricing.' % (2000 + i % 25)}
+        for i in range(customers)])
+    ids = [c.id for c in Customer.query.filter(Customer.email.like('%' + WIRE_MARKER))]
+    db.session.execute(insert(Contact), [{'customer_id': cid, 'name': 'Contact %d-%d' % (cid, j), 'email': 'c%d-%d%s' % (cid, j, WIRE_MARKER),
+                                          'phone': '+1 555 01%02d' % j, 'role': ('Buyer', 'CTO', 'Finance')[j]} for cid in ids for j in range(2)])
+    db.session.execute(insert(Task), [{'customer_id': cid, 'title': 'Call back about order %d' % (cid * 3 + j), 'description': 'Bench task',
+                                       'due_date': '2026-%02d-%02d' % (1 + j, 1 + cid % 28), 'status': ('Todo', 'In Progress', 'Done')[j]}
+                                      for cid in ids for j in range(3)])
+    db.session.execute(insert(Deal), [{'customer_id': cid, 'title': 'Deal %d-%d' % (cid, j), 'amount': 1000.0 * (1 + cid % 40),
+                                       'stage': DEAL_STAGES[(cid + j) % len(DEAL_STAGES)], 'status': 'Open'} for cid in ids for j in range(2)])
+    db.session.execute(insert(Reminder), [{'customer_id': cid, 'message': 'Renewal check-in for customer %d' % cid,
+                                           'due_date': '2026-06-%02d' % (1 + cid % 28), 'completed': cid % 2 == 0} for cid in ids])
+    db.session.execute(insert(Lead), [{'name': 'Lead %d' % i, 'email': 'lead%d%s' % (i, WIRE_MARKER), 'company': 'Company %d' % (i % 97),
+                                       'status': 'New', 'notes': ''} for i in range(customers * 2)])
+    db.session.execute(insert(Activity), [{'subject': 'Bench call %d' % i, 'type': 'Call', 'date': '2026-05-%02d' % (1 + i % 28),
+                                           'related_type': 'Customer', 'related_id': ids[i % len(ids)], 'notes': WIRE_MARKER}
+                                          for i in range(customers * 4)])
+    db.session.commit()
+
+
+def measure_wire(client, tab, encodings):
+    """({encoding: response bytes} for one tab, bytes of the 304 answering its ETag or None)."""
+    sizes = {}
+    for encoding in encodings:
+        response = client.get('/?tab=' + tab, headers={'Accept-Encoding': encoding})
+        sizes[encoding] = len(response.data)
+    etag = response.headers.get('ETag')
+    revalidated = client.get('/?tab=' + tab, headers={'If-None-Match': etag}) if etag else None
+    return sizes, len(revalidated.data) if revalidated is not None and revalidated.status_code == 304 else None
+
+
+def bench_wire(args):
+    use_scratch_database('wire')
+    from app import app, TAB_LOADERS, brotli
+
+    client = app.test_client()
+    with app.app_context():
+        seed_wire_dataset(args.customers)
+    encodings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+    print('%-12s' % 'tab' + ''.join('%12s' % e for e in encodings) + '%12s' % '304')
+    for tab in TAB_LOADERS:
+        sizes, not_modified = measure_wire(client, tab, encodings)
+        print('%-12s' % tab + ''.join('%12d' % sizes[e] for e in encodings) + '%12s' % ('-' if not_modified is None else not_modified))
+
+
+# --- Search: /search latency on a large full-text index ---
+def search_queries(n, rng):
+    """(kind, query) pairs like a typeahead sends: a 2-4 letter prefix, a full word, or two prefixes."""
+    import seed
+    words = seed.FIRST_NAMES + seed.LAST_NAMES + seed.COMPANY_WORDS
+    queries = []
+    for i in range(n):
+        word, other = rng.choice(words), rng.choice(words)
+        kind = ('prefix', 'word', 'two words')[i % 3]
+        queries.append((kind, {'prefix': word[:rng.randint(2, 4)], 'word': word,
+                               'two words': '%s %s' % (word[:3], other[:3])}[kind]))
+    return queries
+
+
+def bench_search(args):
+    use_scratch_database('search')
+    import app as crm
+    import seed
+
+    if not crm.FULL_TEXT_SEARCH:
+        sys.exit('search needs a database with full-text search (SQLite with FTS5)')
+    with crm.app.app_context():
+        start = time.perf_counter()
+        seed.seed(seed.volumes(args.scale), args.seed)
+        indexed = crm.db.session.scalar(crm.db.text('SELECT count(*) FROM search_index'))
+        print('indexed %d rows in %.1fs' % (indexed, time.perf_counter() - start))
+    client = crm.app.test_client()
+    queries = search_queries(args.queries, random.Random(args.seed))
+    for _, q in queries[:20]:
+        client.get('/search', query_string={'q': q})  # warm the page cache
+    latencies = {}
+    for kind, q in queries:
+        start = time.perf_counter()
+        response = client.get('/search', query_string={'q': q})
+        latencies.setdefault(kind, []).append(time.perf_counter() - start)
+        assert response.status_code == 200
+    latencies['all'] = [t for kind in list(latencies) for t in latencies[kind]]
+    print('%-12s %8s %9s %9s %9s' % ('query', 'count', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for kind, values in latencies.items():
+        print('%-12s %8d %9.2f %9.2f %9.2f' % (kind, len(values), percentile(values, 50) * 1000,
+                                               percentile(values, 95) * 1000, percentile(values, 99) * 1000))
+    p95 = percentile(latencies['all'], 95) * 1000
+    if p95 > args.target_ms:
+        print('p95 %.1f ms is over the %.0f ms target' % (p95, args.target_ms))
+        sys.exit(1)
+
+
+# --- Database: concurrent dashboard reads while a worker commits, default journal vs. tuned ---
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else 0.0
+
+
+def db_workload(engine, args):
+    from sqlalchemy import text
+
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE customer (id INTEGER PRIMARY KEY, name TEXT, email TEXT, status TEXT)'))
+        conn.execute(text('CREATE TABLE campaign_log (id INTEGER PRIMARY KEY, campaign_id INTEGER, recipient_email TEXT, status TEXT)'))
+        conn.execute(text('CREATE INDEX ix_customer_status ON customer (status)'))
+        conn.execute(text('INSERT INTO customer (name, email, status) VALUES (:n, :e, :s)'),
+                     [{'n': 'Customer %d' % i, 'e': 'c%d@example.com' % i, 's': ('Lead', 'Customer')[i % 2]} for i in range(20000)])
+    stop = time.monotonic() + args.seconds
+    read_latencies, writes, errors = [], [0], [0]
+    lock = threading.Lock()
+
+    def reader(n):
+        latencies = []
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text('SELECT status, count(*) FROM customer GROUP BY status')).all()
+                    conn.execute(text('SELECT * FROM customer WHERE id > :after ORDER BY id LIMIT 50'), {'after': n * 37 % 19000}).all()
+                    conn.execute(text('SELECT status, count(*) FROM campaign_log WHERE campaign_id = 1 GROUP BY status')).all()
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+        with lock:
+            read_latencies.extend(latencies)
+
+    def writer(n):
+        # Like worker.py's SendResultWriter: many small committed chunks
+        while time.monotonic() < stop:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text('INSERT INTO campaign_log (campaign_id, recipient_email, status) VALUES (1, :e, :s)'),
+                                 [{'e': 'r%d-%d@example.com' % (n, i), 's': 'Sent'} for i in range(args.chunk)])
+                    conn.execute(text("UPDATE customer SET status = 'Customer' WHERE id = :id"), {'id': 1 + n})
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                writes[0] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return read_latencies, writes[0], errors[0]
+
+
+def bench_db(args):
+    from sqlalchemy import create_engine
+    import db_config
+
+    print('%-16s %10s %12s %10s %10s %8s' % ('', 'reads/s', 'commits/s', 'p50 ms', 'p99 ms', 'errors'))
+    for label, tuned in (('default journal', False), ('db_config', True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            uri = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+            options = db_config.engine_options(uri) if tuned else {'pool_size': args.readers + args.writers}
+            engine = create_engine(uri, **options)
+            if tuned:
+                db_config.install(engine)
+            latencies, commits, errors = db_workload(engine, args)
+            engine.dispose()
+        print('%-16s %10.1f %12.1f %10.2f %10.2f %8d' % (
+            label, len(latencies) / args.seconds, commits / args.seconds,
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, errors))
+
+
+# --- Load: latency percentiles per route over HTTP, checked against a stored baseline ---
+def http_request(port, method, path, form=None, headers=None):
+    """(status, seconds) for one request on a fresh connection, like a browser without keep-alive."""
+    headers = dict(headers or {})
+    body = None
+    if form is not None:
+        body = urlencode(form)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        start = time.perf_counter()
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def drive(port, requests, concurrency):
+    """Send (method, path, form) requests from concurrent clients; returns (latencies, errors)."""
+    pending = list(reversed(requests))
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                method, path, form = pending.pop()
+            try:
+                status, elapsed = http_request(port, method, path, form)
+            except OSError:
+                status, elapsed = None, None
+            with lock:
+                if elapsed is not None:
+                    latencies.append(elapsed)
+                if status is None or status >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0]
+
+
+def load_scenarios(n, rng):
+    """[(name, requests)] in the order they run: reads and edits first, then the routes that remove rows."""
+    from flask import url_for
+    from app import app, db, TAB_LOADERS, Customer, Contact, Task, Deal, Reminder, Lead
+
+    # (name, model, edit endpoint, delete endpoint, id argument, edit form fields); customers are deleted last,
+    # since that also removes their contacts, tasks, deals and reminders
+    entities = [
+        ('contact', Contact, 'edit_contact', 'delete_contact', 'contact_id', ['name', 'email', 'phone', 'role']),
+        ('task', Task, 'edit_task', 'delete_task', 'task_id', ['title', 'description', 'due_date', 'status']),
+        ('deal', Deal, 'edit_deal', 'delete_deal', 'deal_id', ['title', 'amount', 'stage', 'status']),
+        ('reminder', Reminder, 'edit_reminder', 'delete_reminder', 'reminder_id', ['message', 'due_date', 'completed']),
+        ('lead', Lead, 'edit_lead', 'delete_lead', 'lead_id', ['name', 'email', 'phone', 'company', 'status', 'notes']),
+        ('customer', Customer, 'edit_customer', 'delete_customer', 'customer_id', ['name', 'email', 'phone', 'status', 'notes']),
+    ]
+    scenarios = [('tab ' + tab, [('GET', '/?tab=' + tab, None)] * n) for tab in TAB_LOADERS]
+    deletes = []
+    with app.test_request_context():
+        for name, model, edit, remove, id_arg, fields in entities:
+            ids = sorted(db.session.scalars(db.select(model.id)))
+            # Distinct rows per route (leads are also converted), so no request finds its row already gone
+            picked = rng.sample(ids, min(len(ids), n * (3 if model is Lead else 2)))
+            edited, removed, converted = picked[:n], picked[n:2 * n], picked[2 * n:]
+            forms = []
+            for row in model.query.filter(model.id.in_(edited)).order_by(model.id):
+                form = {}
+                for field in fields:
+                    value = getattr(row, field)
+                    form[field] = ('on' if value else '') if isinstance(value, bool) else ('' if value is None else value)
+                forms.append(('POST', url_for(edit, **{id_arg: row.id}), form))
+            scenarios.append(('edit_%s GET' % name, [('GET', url_for(edit, **{id_arg: i}), None) for i in edited]))
+            scenarios.append(('edit_%s POST' % name, forms))
+            deletes.append(('delete_%s' % name, [('GET', url_for(remove, **{id_arg: i}), None) for i in removed]))
+            if converted:
+                deletes.append(('convert_lead', [('GET', url_for('convert_lead', lead_id=i), None) for i in converted]))
+        db.session.rollback()
+    return scenarios + deletes
+
+
+def load_campaign_runs(args, port):
+    """Seconds per campaign run, from the POST that queues it to its last email logged; and emails sent."""
+    import app as crm
+    import worker
+    from smtp_pool import SMTPPool
+
+    with crm.app.app_context():
+        segment = crm.Segment(name='Load test: all leads', rules=json.dumps({'entity': 'Lead'}))
+        crm.db.session.add(segment)
+        campaigns = [crm.Campaign(name='Load test %d' % i, status='Active', steps=[crm.CampaignStep(step_type='Email', details='Load test|||Hello', order=0)])
+                     for i in range(args.campaign_runs)]
+        crm.db.session.add_all(campaigns)
+        crm.db.session.commit()
+        campaign_ids, segment_id = [c.id for c in campaigns], segment.id
+
+    durations, sent = [], 0
+    with FakeSMTPServer(latency=args.smtp_latency) as server:
+        pool = SMTPPool('127.0.0.1', server.port, 'bench', 'secret', max_connections=worker.SEND_CONCURRENCY, use_tls=False)
+        crm.mail_pool, real_pool = pool, crm.mail_pool
+        try:
+            for campaign_id in campaign_ids:
+                start = time.perf_counter()
+                status, _ = http_request(port, 'POST', '/', {'run_campaign': '1', 'campaign_id': campaign_id, 'segment_id': segment_id},
+                                         {'Accept': 'application/json'})
+                with crm.app.app_context():
+                    run = worker.claim_next_run()
+                    worker.process_run(run)
+                    while worker.dispatch_due_sends():
+                        pass
+                    run = crm.db.session.get(crm.CampaignRun, run.id)
+                    if status != 202 or run.status != 'Completed':
+                        raise RuntimeError('campaign run #%d ended %s (HTTP %s): %s' % (run.id, run.status, status, run.error))
+                    sent += run.sent
+                durations.append(time.perf_counter() - start)
+        finally:
+            crm.mail_pool = real_pool
+            pool.close()
+    return durations, sent
+
+
+def compare_baseline(results, baseline, stat, tolerance):
+    """({scenario: (ms, ratio) change of stat vs. the baseline}, regressions: slower by more than tolerance and 1 ms)."""
+    key = stat + '_ms'
+    changes = {}
+    for name, stats in results.items():
+        before = baseline.get('results', {}).get(name)
+        if before and before[key]:
+            changes[name] = (stats[key] - before[key], stats[key] / before[key] - 1)
+    regressions = [name for name, (delta_ms, ratio) in changes.items() if ratio > tolerance and delta_ms > 1.0]
+    return changes, regressions
+
+
+def bench_load(args):
+    use_scratch_database('load')
+    from werkzeug.serving import make_server
+    import app as crm
+    import seed
+    from cache import MemoryCache
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with crm.app.app_context():
+        start = time.perf_counter()
+        counts = seed.seed(seed.volumes(args.scale), args.seed)
+        print('seeded %d rows in %.1fs' % (sum(counts.values()), time.perf_counter() - start))
+    if args.no_cache:
+        crm.cache = MemoryCache(max_entries=0)  # every lookup misses: measures the uncached render path
+
+    server = make_server('127.0.0.1', 0, crm.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    results = {}
+    try:
+        print('%-24s %8s %7s %9s %9s %9s %9s' % ('scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+        scenarios = load_scenarios(args.requests, random.Random(args.seed))
+        # One untimed pass over the read-only routes compiles their templates and fills the caches
+        drive(server.port, [requests[0] for name, requests in scenarios
+                            if requests and (name.startswith('tab ') or name.endswith(' GET'))], 1)
+        for name, requests in scenarios:
+            start = time.perf_counter()
+            latencies, errors = drive(server.port, requests, args.concurrency)
+            elapsed = time.perf_counter() - start
+            results[name] = {'requests': len(requests), 'errors': errors, 'rps': len(requests) / elapsed,
+                             'p50_ms': percentile(latencies, 50) * 1000, 'p95_ms': percentile(latencies, 95) * 1000,
+                             'p99_ms': percentile(latencies, 99) * 1000}
+            print('%-24s %8d %7d %9.1f %9.2f %9.2f %9.2f' % (name, len(requests), errors, results[name]['rps'],
+                                                            results[name]['p50_ms'], results[name]['p95_ms'], results[name]['p99_ms']))
+        durations, sent = load_campaign_runs(args, server.port)
+        results['campaign run'] = {'requests': len(durations), 'errors': 0, 'rps': len(durations) / sum(durations),
+                                   'p50_ms': percentile(durations, 50) * 1000, 'p95_ms': percentile(durations, 95) * 1000,
+                                   'p99_ms': percentile(durations, 99) * 1000}
+        report('campaign runs (%d)' % len(durations), sent, sum(durations))
+    finally:
+        server.shutdown()
+
+    settings = {'scale': args.scale, 'requests': args.requests, 'concurrency': args.concurrency, 'seed': args.seed,
+                'no_cache': args.no_cache, 'smtp_latency': args.smtp_latency}
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=2, sort_keys=True)
+        print('baseline saved to %s' % args.baseline)
+        return
+    if not os.path.exists(args.baseline):
+        print('no baseline at %s (run with --save-baseline to store one)' % args.baseline)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('settings') != settings:
+        print('warning: baseline was recorded with %s' % baseline.get('settings'))
+    changes, regressions = compare_baseline(results, baseline, args.compare, args.tolerance)
+    print('\n%-24s %12s %10s' % ('%s vs. baseline' % args.compare, 'ms', 'change'))
+    for name, (delta_ms, ratio) in changes.items():
+        print('%-24s %+12.2f %+9.0f%%%s' % (name, delta_ms, ratio * 100, '  REGRESSION' if name in regressions else ''))
+    if regressions:
+        print('%d scenario(s) slower than the baseline by more than %d%%' % (len(regressions), args.tolerance * 100))
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    smtp = commands.add_parser('smtp', help='messages/sec with and without the SMTP connection pool')
+    smtp.add_argument('--messages', type=int, default=500)
+    smtp.add_argument('--latency', type=float, default=0.0, help='seconds added to every server reply')
+    smtp.add_argument('--connect-latency', type=float, default=0.005, help='seconds added to each new connection')
+    smtp.set_defaults(run=bench_smtp)
+
+    dispatch = commands.add_parser('dispatch', help='messages/sec sending one at a time vs. the concurrent dispatcher')
+    dispatch.add_argument('--messages', type=int, default=400)
+    dispatch.add_argument('--latency', type=float, default=0.005, help='seconds added to every server reply')
+    dispatch.add_argument('--connect-latency', type=float, default=0.005, help='seconds added to each new connection')
+    dispatch.add_argument('--tempfail', type=float, default=0.0, help='share of recipients greylisted with a 451')
+    dispatch.add_argument('--concurrency', type=int, nargs='+', default=[4, 16])
+    dispatch.add_argument('--rate', type=float, default=None, help='global limit, messages/sec')
+    dispatch.add_argument('--domain-rate', type=float, default=None, help='per-domain limit, messages/sec')
+    dispatch.set_defaults(run=bench_dispatch)
+
+    render = commands.add_parser('render', help='template render time, compiled per call vs. cached')
+    render.add_argument('--iterations', type=int, default=200)
+    render.set_defaults(run=bench_render)
+
+    wire = commands.add_parser('wire', help='response bytes per tab: identity, gzip, brotli and 304 revalidation')
+    wire.add_argument('--customers', type=int, default=500, help='customers to seed (with contacts, tasks, deals, leads, activities)')
+    wire.set_defaults(run=bench_wire)
+
+    search = commands.add_parser('search', help='/search latency percentiles on a seeded full-text index')
+    search.add_argument('--scale', type=int, default=112000,
+                        help='customers to seed; with their contacts, leads and activities, 9 indexed rows each (~1M)')
+    search.add_argument('--seed', type=int, default=0)
+    search.add_argument('--queries', type=int, default=600)
+    search.add_argument('--target-ms', type=float, default=20.0, help='p95 above this exits with status 1')
+    search.set_defaults(run=bench_search)
+
+    database = commands.add_parser('db', help='mixed read/write throughput on SQLite, default journal vs. WAL and pragmas')
+    database.add_argument('--readers', type=int, default=8)
+    database.add_argument('--writers', type=int, default=2)
+    database.add_argument('--chunk', type=int, default=50, help='rows inserted per write transaction')
+    database.add_argument('--seconds', type=float, default=5)
+    database.set_defaults(run=bench_db)
+
+    load = commands.add_parser('load', help='latency percentiles per route over HTTP on seeded data, vs. a stored baseline')
+    load.add_argument('--scale', type=int, default=500, help='customers to seed (see seed.RATIOS for the other tables)')
+    load.add_argument('--seed', type=int, default=0)
+    load.add_argument('--requests', type=int, default=50, help='requests per scenario')
+    load.add_argument('--concurrency', type=int, default=4, help='concurrent HTTP clients')
+    load.add_argument('--no-cache', action='store_true', help='disable the tab/query cache')
+    load.add_argument('--campaign-runs', type=int, default=3, help='campaign runs to time, each to every seeded lead')
+    load.add_argument('--smtp-latency', type=float, default=0.001, help='seconds the fake SMTP server adds to every reply')
+    load.add_argument('--baseline', default='bench_baseline.json')
+    load.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    load.add_argument('--compare', choices=['p50', 'p95', 'p99'], default='p50', help='percentile checked against the baseline')
+    load.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown (0.25 = 25%%) before a scenario is a regression')
+    load.set_defaults(run=bench_load)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
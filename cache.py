@@ -0,0 +1,106 @@
+"""Caches for rendered tab fragments and query results.
+
+MemoryCache is a per-process LRU with a TTL. RedisCache keeps entries in a
+store shared by every web process; it takes any client with redis-py's
+get/set/delete methods, so a local stand-in can be passed instead of a server.
+Both count hits, misses and evictions.
+
+Entries are never invalidated by deleting them: callers put the version of
+every table a value was read from into its key, so a write makes the old key
+unreachable and it ages out (TTL or LRU).
+"""
+import time
+import pickle
+import threading
+from collections import OrderedDict
+
+
+class MemoryCache:
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+
+    def get(self, key):
+        """Cached value, or None on a miss (so None itself is never cached)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'backend': 'memory', 'entries': len(self._entries), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+class RedisCache:
+    # Expiry and eviction happen in the server; evictions here counts values that
+    # were present but could not be unpickled (e.g. written by older code)
+    def __init__(self, client, ttl=300, prefix='mukera:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        if data is not None:
+            try:
+                value = pickle.loads(data)
+            except Exception:
+                self.client.delete(self.prefix + key)
+                self.evictions += 1
+            else:
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        pass  # keys expire on their own; a shared store is not flushed from one process
+
+    def stats(self):
+        return {'backend': 'redis', 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def make_cache(url=None, ttl=300, max_entries=1024):
+    """MemoryCache, or a RedisCache when url is a redis:// URL (needs the redis package)."""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_URL points at Redis but the redis package is not installed')
+        return RedisCache(redis.Redis.from_url(url), ttl=ttl)
+    return MemoryCache(max_entries=max_entries, ttl=ttl)
@@ -0,0 +1,75 @@
+"""Database engine configuration.
+
+The URI comes from DATABASE_URL or SQLALCHEMY_DATABASE_URI, so production can
+point at PostgreSQL; without either the app keeps using the SQLite file in
+instance/. SQLite connections are switched to WAL on connect: readers then
+work from a snapshot instead of waiting for a writer's commit, which is what
+lets dashboard requests proceed while worker.py commits a campaign run. They
+also get foreign_keys on, so deleting a customer cascades in the database.
+"""
+import os
+import sqlite3
+
+DEFAULT_DATABASE_URI = 'sqlite:///crm.db'
+
+# Applied to every new SQLite connection, in this order
+SQLITE_PRAGMAS = {
+    # SQLite leaves foreign keys unenforced unless asked, per connection; ON DELETE CASCADE needs them
+    'foreign_keys': 'ON',
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    # NORMAL only fsyncs at WAL checkpoints: a power cut can drop the last commits but never corrupts
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    # Wait this long (ms) for a competing writer instead of failing with "database is locked"
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    # Negative is KiB: a 64 MB page cache per connection
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -65536)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+}
+
+# Per process; gunicorn workers and worker.py each hold their own pool
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+
+def database_uri():
+    uri = os.environ.get('DATABASE_URL') or os.environ.get('SQLALCHEMY_DATABASE_URI') or DEFAULT_DATABASE_URI
+    if uri.startswith('postgres://'):
+        # Render and Heroku hand out postgres://, which SQLAlchemy no longer accepts
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(uri):
+    if uri.startswith('sqlite'):
+        if uri in ('sqlite://', 'sqlite:///:memory:'):
+            return {}  # one in-memory database per connection; pooling would split it
+        # sqlite3's own busy handler, matching busy_timeout
+        return {'pool_size': POOL_SIZE, 'max_overflow': MAX_OVERFLOW, 'pool_timeout': POOL_TIMEOUT,
+                'connect_args': {'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000.0}}
+    return {'pool_size': POOL_SIZE, 'max_overflow': MAX_OVERFLOW, 'pool_timeout': POOL_TIMEOUT,
+            'pool_recycle': POOL_RECYCLE, 'pool_pre_ping': True}
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+
+def configure(app):
+    """Set the URI and engine options on app.config; call before SQLAlchemy(app)."""
+    uri = database_uri()
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+
+
+def install(engine):
+    """Apply SQLITE_PRAGMAS to every connection the engine opens (no-op for other databases)."""
+    from sqlalchemy import event
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', set_sqlite_pragmas)
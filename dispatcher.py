@@ -0,0 +1,151 @@
+"""Concurrent email dispatch with rate limits, retries and backpressure.
+
+smtplib is blocking, so the dispatcher runs an asyncio event loop that hands
+each send to a thread pool of `concurrency` workers (with SMTPPool that is one
+open session per worker). The loop itself does the scheduling:
+
+- a bounded queue between the recipient stream and the senders, so a large
+  stream is consumed only as fast as it is sent;
+- token buckets for a global and a per-domain rate limit;
+- exponential backoff with jitter for transient failures (4xx replies and
+  dropped connections); 5xx replies and other errors fail at once.
+
+Results are reported through a callback on the loop's thread, so the caller
+can keep using objects (e.g. a database session) that are not thread-safe.
+"""
+import time
+import random
+import asyncio
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+
+from smtp_pool import DROPPED
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """Take one token; returns the seconds to wait until it is actually available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def reply_code(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return min(codes) if codes else None
+    return getattr(error, 'smtp_code', None)
+
+
+def is_transient(error):
+    # 4xx: try again later (greylisting, mailbox busy, rate limited); 5xx: permanent
+    if isinstance(error, DROPPED):
+        return True
+    code = reply_code(error)
+    return code is not None and 400 <= code < 500
+
+
+def recipient_domain(recipient):
+    return recipient.rpartition('@')[2].lower()
+
+
+class Dispatcher:
+    """Send (recipient, payload) items with send(recipient, payload) across concurrent workers.
+
+    rate and domain_rate are messages per second (None: unlimited); domain_rates
+    overrides the per-domain rate for specific domains.
+    """
+
+    def __init__(self, send, concurrency=4, rate=None, burst=None, domain_rate=None, domain_burst=None,
+                 domain_rates=None, max_attempts=4, backoff=1.0, max_backoff=60.0, queue_size=None):
+        self.send = send
+        self.concurrency = concurrency
+        self.global_bucket = TokenBucket(rate, burst) if rate else None
+        self.domain_rate = domain_rate
+        self.domain_burst = domain_burst
+        self.domain_rates = domain_rates or {}
+        self.domain_buckets = {}
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.queue_size = queue_size or concurrency * 4
+
+    def domain_bucket(self, domain):
+        if domain not in self.domain_buckets:
+            rate = self.domain_rates.get(domain, self.domain_rate)
+            self.domain_buckets[domain] = TokenBucket(rate, self.domain_burst) if rate else None
+        return self.domain_buckets[domain]
+
+    async def throttle(self, recipient):
+        buckets = [self.global_bucket, self.domain_bucket(recipient_domain(recipient))]
+        wait = max([bucket.reserve() for bucket in buckets if bucket is not None], default=0.0)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def retry_delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def deliver(self, loop, executor, recipient, payload):
+        """(status, error) after up to max_attempts tries."""
+        for attempt in range(1, self.max_attempts + 1):
+            await self.throttle(recipient)
+            try:
+                await loop.run_in_executor(executor, self.send, recipient, payload)
+                return 'Sent', None
+            except Exception as e:
+                if not is_transient(e) or attempt == self.max_attempts:
+                    return 'Failed', e
+                await asyncio.sleep(self.retry_delay(attempt))
+
+    async def run(self, items, on_result):
+        """Send every item; on_result(recipient, payload, status, error) is called as each finishes."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.queue_size)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                recipient, payload = item
+                status, error = await self.deliver(loop, executor, recipient, payload)
+                on_result(recipient, payload, status, error)
+
+        async def put(item):
+            # Blocks while the queue is full: the stream is read only as fast as it is sent. A worker
+            # whose on_result raised takes no more items, so wait on the workers too and re-raise
+            # its error rather than wait for room that may never come
+            putting = asyncio.ensure_future(queue.put(item))
+            try:
+                while not putting.done():
+                    await asyncio.wait([putting, *(task for task in workers if not task.done())],
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    for task in workers:
+                        if task.done() and task.exception() is not None:
+                            raise task.exception()
+            finally:
+                putting.cancel()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+            try:
+                for item in items:
+                    await put(item)
+                for _ in workers:
+                    await put(None)
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+
+    def dispatch(self, items, on_result):
+        asyncio.run(self.run(items, on_result))
@@ -0,0 +1,200 @@
+"""Request profiling: wall time, SQL, template rendering and SMTP per request.
+
+Every statement is timed through SQLAlchemy's before/after_cursor_execute hooks;
+inside a request the count and time are added to flask.g, and statements slower
+than SLOW_QUERY_MS are logged with their SQL. Render time comes from
+g.render_seconds (see timed_render in app.py), SMTP time from timed('smtp').
+
+Each response carries a Server-Timing header with the breakdown (visible in the
+browser's network panel), and the totals are kept as Prometheus counters and
+histograms per endpoint, served as text by render() (/metrics in app.py).
+Counters are per process: with several gunicorn workers each is scraped apart.
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') != '0'
+
+# Seconds; request latencies from a cached tab (~1 ms) up to a cold export
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+log = logging.getLogger('mukera.metrics')
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values -> total
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        for label_values, value in sorted(self.values.items()):
+            lines.append('%s%s %s' % (self.name, label_text(self.labels, label_values), number(value)))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        for label_values, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                le = bound if bound == '+Inf' else number(bound)
+                lines.append('%s_bucket%s %d' % (self.name, label_text(self.labels + ('le',), label_values + (le,)), count))
+            lines.append('%s_sum%s %s' % (self.name, label_text(self.labels, label_values), number(series[-1])))
+            lines.append('%s_count%s %d' % (self.name, label_text(self.labels, label_values), series[-2]))
+        return lines
+
+
+def label_text(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{%s}' % ','.join('%s="%s"' % (name, value) for name, value in zip(names, escaped))
+
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REQUESTS = Counter('mukera_http_requests_total', 'HTTP responses by endpoint, method and status.',
+                   ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('mukera_http_request_seconds', 'Wall time per request.', ('endpoint',))
+REQUEST_SQL_STATEMENTS = Histogram('mukera_http_request_sql_statements', 'SQL statements executed per request.',
+                                   ('endpoint',), buckets=COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram('mukera_http_request_sql_seconds', 'Time spent in SQL per request.', ('endpoint',))
+REQUEST_RENDER_SECONDS = Histogram('mukera_http_request_render_seconds', 'Template rendering time per request.',
+                                   ('endpoint',))
+SQL_STATEMENTS = Counter('mukera_sql_statements_total', 'SQL statements executed, in and out of requests.')
+SQL_SECONDS = Counter('mukera_sql_seconds_total', 'Time spent executing SQL statements.')
+SLOW_QUERIES = Counter('mukera_sql_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.')
+SMTP_SECONDS = Histogram('mukera_smtp_send_seconds', 'Time per SMTP send, including retries.')
+
+METRICS = [REQUESTS, REQUEST_SECONDS, REQUEST_SQL_STATEMENTS, REQUEST_SQL_SECONDS, REQUEST_RENDER_SECONDS,
+           SQL_STATEMENTS, SQL_SECONDS, SLOW_QUERIES, SMTP_SECONDS]
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def timed(phase):
+    """Time a block; inside a request it is added to g.<phase>_seconds (and Server-Timing)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if phase == 'smtp':
+            SMTP_SECONDS.observe(elapsed)
+        if has_request_context():
+            setattr(g, phase + '_seconds', g.get(phase + '_seconds', 0.0) + elapsed)
+
+
+# --- SQL ---
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    SQL_STATEMENTS.inc()
+    SQL_SECONDS.inc(elapsed)
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc()
+        where = request.path if has_request_context() else 'outside a request'
+        log.warning('slow query (%.1f ms, %s): %s', elapsed * 1000, where, ' '.join(statement.split()))
+
+
+def handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    starts = exception_context.connection.info.get('query_start') if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+# --- Requests ---
+def start_request():
+    g.request_start = time.perf_counter()
+
+
+def server_timing(phases):
+    return ', '.join('%s;dur=%.1f%s' % (name, seconds * 1000, ';desc="%s"' % desc if desc else '')
+                     for name, seconds, desc in phases)
+
+
+def finish_request(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unmatched'  # the route, not the path, so label values stay bounded
+    sql_statements = g.get('sql_statements', 0)
+    sql_seconds = g.get('sql_seconds', 0.0)
+    render_seconds = g.get('render_seconds', 0.0)
+    smtp_seconds = g.get('smtp_seconds', 0.0)
+
+    REQUESTS.inc(1, endpoint, request.method, response.status_code)
+    REQUEST_SECONDS.observe(elapsed, endpoint)
+    REQUEST_SQL_STATEMENTS.observe(sql_statements, endpoint)
+    REQUEST_SQL_SECONDS.observe(sql_seconds, endpoint)
+    REQUEST_RENDER_SECONDS.observe(render_seconds, endpoint)
+
+    if SERVER_TIMING:
+        phases = [('db', sql_seconds, '%d queries' % sql_statements), ('render', render_seconds, '')]
+        if smtp_seconds:
+            phases.append(('smtp', smtp_seconds, ''))
+        phases.append(('total', elapsed, ''))
+        response.headers['Server-Timing'] = server_timing(phases)
+    log.debug('%s %s: %.1f ms, %d queries (%.1f ms), render %.1f ms', request.method, request.path,
+              elapsed * 1000, sql_statements, sql_seconds * 1000, render_seconds * 1000)
+    return response
+
+
+def install(app, engine):
+    """Time every statement on engine and every request to app."""
+    from sqlalchemy import event
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+    app.before_request(start_request)
+    app.after_request(finish_request)
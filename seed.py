@@ -0,0 +1,164 @@
+"""Fill the database with synthetic CRM data for load tests and benchmarks.
+
+    python seed.py [--scale N] [--seed N] [--customers N] [--leads N] ...
+
+--scale is the number of customers; every other table gets a fixed ratio of
+that (see RATIOS) unless its count is given directly. The same --seed always
+produces the same rows. Dates are spread around today, so the due/overdue
+split of tasks and reminders looks the same whenever the data is generated.
+Rows are added to whatever DATABASE_URL points at (instance/crm.db by default);
+emails are numbered past the existing rows, so seeding twice adds more.
+"""
+import json
+import random
+import argparse
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, insert
+
+from app import (app, db, Customer, Contact, Task, Deal, Reminder, Lead, Activity, Campaign, CampaignStep, CampaignLog,
+                 Segment, DEAL_STAGES)
+
+# Rows per customer; campaign_logs is capped at one row per (campaign, step, lead)
+RATIOS = {
+    'customers': 1, 'contacts': 2, 'tasks': 3, 'deals': 2, 'reminders': 1, 'leads': 2, 'activities': 4,
+    'campaigns': 0.01, 'campaign_logs': 10,
+}
+CHUNK_ROWS = 1000
+LOG_TIME_FORMAT = '%Y-%m-%d %H:%M'  # as worker.LOG_TIME_FORMAT
+
+FIRST_NAMES = ['Amina', 'Bruno', 'Chen', 'Dara', 'Elif', 'Femi', 'Greta', 'Hiro', 'Ines', 'Jonas', 'Kemal', 'Lena',
+               'Mukami', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sami', 'Tariq', 'Uma', 'Viktor', 'Wanjiru', 'Yusuf']
+LAST_NAMES = ['Abebe', 'Berg', 'Costa', 'Dlamini', 'Evans', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Kamau', 'Lopez',
+              'Mensah', 'Novak', 'Okafor', 'Patel', 'Rossi', 'Silva', 'Tanaka', 'Weber', 'Zhou']
+COMPANY_WORDS = ['Acacia', 'Baobab', 'Cedar', 'Delta', 'Equator', 'Falcon', 'Granite', 'Harbor', 'Kilima', 'Lakeside',
+                 'Meridian', 'Nile', 'Orbit', 'Pioneer', 'Savanna', 'Summit']
+COMPANY_KINDS = ['Logistics', 'Foods', 'Energy', 'Textiles', 'Labs', 'Motors', 'Pharma', 'Traders', 'Builders']
+
+
+def volumes(scale, **counts):
+    """Row count per table: RATIOS times scale, overridden by any count given (None: use the ratio)."""
+    result = {table: max(1, int(round(ratio * scale))) for table, ratio in RATIOS.items()}
+    result.update({table: count for table, count in counts.items() if count is not None})
+    return result
+
+
+def person(rng):
+    return '%s %s' % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+
+
+def company(rng):
+    return '%s %s' % (rng.choice(COMPANY_WORDS), rng.choice(COMPANY_KINDS))
+
+
+def phone(rng):
+    return '+254 7%02d %03d %03d' % (rng.randrange(100), rng.randrange(1000), rng.randrange(1000))
+
+
+def day(rng, before, after):
+    return (date.today() + timedelta(days=rng.randint(-before, after))).isoformat()
+
+
+def activity(rng, related):
+    kind = rng.choice(['Call', 'Meeting', 'Email', 'Task'])
+    related_type = rng.choice(sorted(related))
+    return {'subject': '%s with %s' % (kind, person(rng)), 'type': kind, 'date': day(rng, 90, 14),
+            'related_type': related_type, 'related_id': rng.choice(related[related_type]), 'notes': ''}
+
+
+def insert_rows(model, rows):
+    # Chunked so a large seed neither builds one huge statement nor holds every row dict at once
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_ROWS:
+            db.session.execute(insert(model), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(model), chunk)
+
+
+def new_ids(model, after):
+    return db.session.scalars(db.select(model.id).where(model.id > after).order_by(model.id)).all()
+
+
+def seed(counts, seed=0):
+    """Insert counts[table] synthetic rows per table; returns the number of rows added per table."""
+    rng = random.Random(seed)
+    first = {model: db.session.scalar(db.select(func.max(model.id))) or 0
+             for model in (Customer, Lead, Campaign, CampaignStep, Segment)}
+
+    n = first[Customer]
+    insert_rows(Customer, ({'name': person(rng), 'email': 'customer%d@seed.example.com' % (n + i), 'phone': phone(rng),
+                            'status': rng.choice(['Lead', 'Opportunity', 'Customer', 'Customer']),
+                            'notes': 'Works at %s.' % company(rng)} for i in range(1, counts['customers'] + 1)))
+    customer_ids = new_ids(Customer, first[Customer])
+
+    insert_rows(Contact, ({'customer_id': rng.choice(customer_ids), 'name': person(rng), 'email': 'contact%d@seed.example.com' % i,
+                           'phone': phone(rng), 'role': rng.choice(['Buyer', 'Finance', 'CTO', 'Operations', 'Primary'])}
+                          for i in range(counts['contacts'])))
+    insert_rows(Task, ({'customer_id': rng.choice(customer_ids), 'title': rng.choice(['Call', 'Email', 'Visit', 'Send quote to']) + ' ' + company(rng),
+                        'description': 'Follow up on the last conversation.', 'due_date': day(rng, 30, 60),
+                        'status': rng.choice(['Todo', 'Todo', 'In Progress', 'Done'])} for _ in range(counts['tasks'])))
+    insert_rows(Deal, ({'customer_id': rng.choice(customer_ids), 'title': '%s order' % company(rng),
+                        'amount': round(rng.lognormvariate(8, 1.2), 2), 'stage': rng.choice(DEAL_STAGES),
+                        'status': rng.choice(['Open', 'Open', 'Open', 'Closed'])} for _ in range(counts['deals'])))
+    insert_rows(Reminder, ({'customer_id': rng.choice(customer_ids), 'message': rng.choice(['Renewal check-in', 'Invoice overdue', 'Quarterly review']),
+                            'due_date': day(rng, 14, 30), 'completed': rng.random() < 0.4} for _ in range(counts['reminders'])))
+
+    n = first[Lead]
+    insert_rows(Lead, ({'name': person(rng), 'email': 'lead%d@seed.example.com' % (n + i), 'phone': phone(rng), 'company': company(rng),
+                        'status': rng.choice(['New', 'New', 'Assigned', 'Lost']), 'notes': ''}
+                       for i in range(1, counts['leads'] + 1)))
+    lead_ids = new_ids(Lead, first[Lead])
+
+    related = {'Customer': customer_ids, 'Lead': lead_ids}
+    insert_rows(Activity, (activity(rng, related) for _ in range(counts['activities'])))
+
+    # Two segments, and campaigns of Email, Wait 2 days, Email; the logged sends went to the first segment
+    db.session.execute(insert(Segment), [
+        {'name': 'New leads', 'filter_type': 'Lead', 'filter_value': 'New'},
+        {'name': 'Customers with an open deal', 'rules': json.dumps({'entity': 'Customer', 'all': [
+            {'field': 'status', 'op': 'in', 'value': ['Customer', 'Opportunity']}, {'field': 'has_open_deal'}]})}])
+    segment_ids = new_ids(Segment, first[Segment])
+    insert_rows(Campaign, ({'name': 'Campaign %d' % (first[Campaign] + i), 'description': 'Seeded campaign', 'status': rng.choice(['Draft', 'Active', 'Completed']),
+                            'start_date': day(rng, 60, 0), 'end_date': day(rng, 0, 60)} for i in range(1, counts['campaigns'] + 1)))
+    campaign_ids = new_ids(Campaign, first[Campaign])
+    insert_rows(CampaignStep, ({'campaign_id': cid, 'step_type': step_type, 'details': details, 'order': order}
+                               for cid in campaign_ids
+                               for order, (step_type, details) in enumerate([('Email', 'Welcome|||Hello from us.'), ('Wait', '2'),
+                                                                            ('Email', 'Following up|||Any questions?')])))
+    email_steps = {}
+    for step in CampaignStep.query.filter(CampaignStep.id > first[CampaignStep], CampaignStep.step_type == 'Email'):
+        email_steps.setdefault(step.campaign_id, []).append(step.id)
+
+    # Distinct (campaign, step, lead) per row, as the unique send index requires
+    sends = [(cid, sid) for cid in campaign_ids for sid in email_steps[cid]]
+    logs = min(counts['campaign_logs'], len(sends) * len(lead_ids))
+    now = datetime.now()
+    insert_rows(CampaignLog, ({'campaign_id': sends[i % len(sends)][0], 'segment_id': segment_ids[0], 'step_id': sends[i % len(sends)][1],
+                               'recipient_email': 'lead%d@seed.example.com' % (first[Lead] + 1 + (i // len(sends)) % len(lead_ids)),
+                               'status': 'Sent' if rng.random() < 0.95 else 'Failed',
+                               'timestamp': (now - timedelta(minutes=rng.randrange(60 * 24 * 30))).strftime(LOG_TIME_FORMAT)}
+                              for i in range(logs)))
+    db.session.commit()
+    return dict(counts, campaign_logs=logs, segments=len(segment_ids), campaign_steps=3 * len(campaign_ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1000, help='customers to generate; other tables follow RATIOS')
+    parser.add_argument('--seed', type=int, default=0, help='random seed; the same seed gives the same data')
+    for table in RATIOS:
+        parser.add_argument('--' + table.replace('_', '-'), type=int, default=None, dest=table,
+                            help='rows of %s (default: %s x scale)' % (table, RATIOS[table]))
+    args = parser.parse_args()
+    counts = volumes(args.scale, **{table: getattr(args, table) for table in RATIOS})
+    with app.app_context():
+        added = seed(counts, args.seed)
+    for table, count in added.items():
+        print('%-16s %8d' % (table, count))
+
+
+if __name__ == '__main__':
+    main()
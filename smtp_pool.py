@@ -0,0 +1,108 @@
+"""Pool of authenticated SMTP sessions for outbound mail.
+
+Opening a session costs a TCP connect, EHLO, STARTTLS and AUTH; a pooled
+session pays that once and is then reused for many sendmail() calls.
+"""
+import time
+import smtplib
+import threading
+from contextlib import contextmanager
+
+# Errors that mean the session itself is gone, as opposed to a rejected message
+DROPPED = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class SMTPPool:
+    def __init__(self, host, port, username=None, password=None, max_connections=4, use_tls=True,
+                 timeout=30, max_idle=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        # Sessions idle longer than this are checked with NOOP before reuse
+        self.max_idle = max_idle
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle = []  # [(session, last_used)]
+
+    def _connect(self):
+        session = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                session.starttls()
+            if self.username:
+                session.login(self.username, self.password)
+        except Exception:
+            self._close(session)
+            raise
+        return session
+
+    @staticmethod
+    def _close(session):
+        try:
+            session.quit()
+        except Exception:
+            session.close()
+
+    def _alive(self, session, last_used):
+        if time.monotonic() - last_used < self.max_idle:
+            return True
+        try:
+            return session.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self, fresh):
+        while not fresh:
+            with self._lock:
+                if not self._idle:
+                    break
+                session, last_used = self._idle.pop()
+            if self._alive(session, last_used):
+                return session
+            self._close(session)
+        return self._connect()
+
+    def _checkin(self, session):
+        with self._lock:
+            self._idle.append((session, time.monotonic()))
+
+    @contextmanager
+    def connection(self, fresh=False):
+        """Borrow a session; at most max_connections are open at once."""
+        self._slots.acquire()
+        try:
+            session = self._checkout(fresh)
+            try:
+                yield session
+            except DROPPED:
+                session.close()
+                raise
+            except smtplib.SMTPException:
+                # A refused message leaves the session usable
+                self._checkin(session)
+                raise
+            except BaseException:
+                self._close(session)
+                raise
+            else:
+                self._checkin(session)
+        finally:
+            self._slots.release()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        try:
+            with self.connection() as session:
+                return session.sendmail(from_addr, to_addrs, msg)
+        except DROPPED:
+            # The server dropped a pooled session (idle timeout, restart); retry once on a new one
+            with self.connection(fresh=True) as session:
+                return session.sendmail(from_addr, to_addrs, msg)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session, _ in idle:
+            self._close(session)
@@ -0,0 +1,52 @@
+"""Smoke test of the HTTP load harness (bench.py load) at a tiny scale.
+
+The harness runs in its own process: it points DATABASE_URL at a scratch
+database before importing the app, which this test process has already done.
+"""
+import os
+import sys
+import json
+import subprocess
+
+import bench
+
+BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'bench.py')
+SMOKE_ARGS = ['--scale', '5', '--requests', '2', '--concurrency', '2', '--campaign-runs', '1']
+
+
+def run_load(tmp_path, *extra):
+    return subprocess.run([sys.executable, BENCH, 'load', *SMOKE_ARGS, '--baseline', str(tmp_path / 'baseline.json'), *extra],
+                          cwd=tmp_path, capture_output=True, text=True, timeout=300)
+
+
+def test_load_covers_every_route_without_errors(tmp_path):
+    result = run_load(tmp_path, '--save-baseline')
+    assert result.returncode == 0, result.stdout + result.stderr
+    results = json.loads((tmp_path / 'baseline.json').read_text())['results']
+    expected = ['tab ' + tab for tab in ('marketing', 'pipeline', 'leads', 'customers', 'contacts', 'tasks', 'deals',
+                                         'reminders', 'activities')]
+    for name in ('contact', 'task', 'deal', 'reminder', 'lead', 'customer'):
+        expected += ['edit_%s GET' % name, 'edit_%s POST' % name, 'delete_%s' % name]
+    assert set(results) == set(expected) | {'convert_lead', 'campaign run'}
+    assert {name: stats['errors'] for name, stats in results.items() if stats['errors']} == {}
+    assert not os.path.exists(tmp_path / 'instance')  # the scratch database is in a tempdir
+
+
+def test_load_exits_1_on_regression(tmp_path):
+    assert run_load(tmp_path, '--save-baseline').returncode == 0
+    baseline_path = tmp_path / 'baseline.json'
+    baseline = json.loads(baseline_path.read_text())
+    for stats in baseline['results'].values():
+        stats['p50_ms'] = 0.001  # every scenario is now far slower than its baseline
+    baseline_path.write_text(json.dumps(baseline))
+    result = run_load(tmp_path)
+    assert result.returncode == 1, result.stdout + result.stderr
+    assert 'REGRESSION' in result.stdout
+
+
+def test_compare_baseline_needs_both_ratio_and_milliseconds():
+    baseline = {'results': {'slow': {'p50_ms': 10.0}, 'noise': {'p50_ms': 0.1}, 'fast': {'p50_ms': 10.0}}}
+    results = {'slow': {'p50_ms': 20.0}, 'noise': {'p50_ms': 0.3}, 'fast': {'p50_ms': 9.0}, 'new': {'p50_ms': 5.0}}
+    changes, regressions = bench.compare_baseline(results, baseline, 'p50', 0.25)
+    assert set(changes) == {'slow', 'noise', 'fast'}
+    assert regressions == ['slow']  # noise tripled, but by 0.2 ms
@@ -0,0 +1,31 @@
+"""Smoke test of the search benchmark (bench.py search) at a tiny scale."""
+import os
+import sys
+import subprocess
+
+import pytest
+
+import app as crm
+
+pytestmark = pytest.mark.skipif(not crm.FULL_TEXT_SEARCH, reason='SQLite without FTS5')
+
+BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'bench.py')
+
+
+def run_search(tmp_path, *extra):
+    return subprocess.run([sys.executable, BENCH, 'search', '--scale', '20', '--queries', '30', *extra],
+                          cwd=tmp_path, capture_output=True, text=True, timeout=300)
+
+
+def test_search_reports_percentiles(tmp_path):
+    result = run_search(tmp_path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'indexed 180 rows' in result.stdout
+    assert [line.split()[0] for line in result.stdout.splitlines()[2:]] == ['prefix', 'word', 'two', 'all']
+    assert not os.path.exists(tmp_path / 'instance')
+
+
+def test_search_exits_1_over_target(tmp_path):
+    result = run_search(tmp_path, '--target-ms', '0')
+    assert result.returncode == 1
+    assert 'over the 0 ms target' in result.stdout
@@ -0,0 +1,20 @@
+"""Tab render timings with pytest-benchmark (skipped when it is not installed).
+
+    pytest tests/bench --benchmark-only [--benchmark-autosave] [--benchmark-compare]
+
+Each benchmark renders one tab from the seeded test database, uncached.
+"""
+import pytest
+
+import app as crm
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.mark.parametrize('tab', sorted(crm.TAB_LOADERS))
+def test_render_tab(benchmark, client, tab):
+    def render():
+        crm.cache.clear()
+        return client.get('/?tab=%s' % tab)
+
+    assert benchmark(render).status_code == 200
@@ -0,0 +1,52 @@
+"""Shared fixtures: the app on an in-memory SQLite database seeded with synthetic rows.
+
+DATABASE_URL must be set before app.py is imported, since the engine and the
+schema are created at import time.
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as crm  # noqa: E402
+import seed  # noqa: E402
+
+SEED_SCALE = 20  # customers; enough that every tab shows more than a few rows
+
+
+@pytest.fixture(scope='session')
+def seeded():
+    with crm.app.app_context():
+        return seed.seed(seed.volumes(SEED_SCALE))
+
+
+@pytest.fixture
+def client(seeded):
+    crm.app.config['TESTING'] = True
+    crm.cache.clear()  # each test renders from the database, not a tab cached by an earlier test
+    return crm.app.test_client()
+
+
+@pytest.fixture
+def sql_statements():
+    """Context manager recording the SQL statements executed inside it."""
+    @contextmanager
+    def record():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with crm.app.app_context():
+            engine = crm.db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return record
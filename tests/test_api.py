@@ -0,0 +1,57 @@
+"""JSON API writes: bad values are a JSON 400 naming the field, never a 500."""
+import json
+
+import pytest
+
+import app as crm
+
+
+def customer_id():
+    with crm.app.app_context():
+        return crm.Customer.query.order_by(crm.Customer.id).first().id
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'message': 'Call back', 'completed': 'yes'}, 'completed: expected true or false'),
+    ({'message': 'Call back', 'customer_id': 'one'}, 'customer_id: expected an integer'),
+    ({'message': None}, 'message: may not be null'),
+    ({'message': 'Call back', 'due_date': '2026-01-01' * 3}, 'due_date: longer than 20 characters'),
+    ({'message': 'Call back', 'unknown': 1}, 'unknown field(s): unknown'),
+])
+def test_invalid_reminder_values_are_a_400(client, body, error):
+    response = client.post('/api/v1/reminders', json=dict({'customer_id': customer_id()}, **body))
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
+
+
+def test_invalid_update_value_is_a_400(client):
+    response = client.patch('/api/v1/deals', json=[{'id': 1, 'amount': 'lots'}])
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'item 0: amount: expected a number'
+
+
+def test_valid_values_are_stored(client):
+    response = client.post('/api/v1/reminders', json={'customer_id': customer_id(), 'message': 'Renewal', 'completed': True})
+    assert response.status_code == 201
+    reminder_id = response.get_json()['ids'][0]
+    assert client.patch('/api/v1/reminders/%d' % reminder_id, json={'completed': False}).status_code == 200
+    assert client.get('/api/v1/reminders/%d' % reminder_id).get_json()['completed'] is False
+
+
+@pytest.mark.parametrize('rules, error', [
+    ('not json', 'rules are not valid JSON'),
+    (json.dumps({'entity': 'Planet'}), 'rules need "entity"'),
+    (json.dumps({'entity': 'Lead', 'all': [{'field': 'shoe_size'}]}), "unknown field 'shoe_size'"),
+])
+def test_invalid_segment_rules_are_a_400(client, rules, error):
+    response = client.post('/api/v1/segments', json={'name': 'Bad', 'rules': rules})
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
+    batch = client.post('/api/v1/batch', json=[{'resource': 'segments', 'op': 'update', 'data': [{'id': 1, 'rules': rules}]}])
+    assert batch.status_code == 400
+
+
+def test_valid_segment_rules_are_stored(client):
+    rules = json.dumps({'entity': 'Lead', 'all': [{'field': 'status', 'op': 'eq', 'value': 'New'}]})
+    response = client.post('/api/v1/segments', json={'name': 'New leads (API)', 'rules': rules})
+    assert response.status_code == 201
@@ -0,0 +1,155 @@
+"""Tab and query caches: both backends' counters, and cached tabs following inserts, updates and deletes."""
+import pickle
+
+import pytest
+from sqlalchemy import insert, update
+
+import app as crm
+import cache as cache_module
+from cache import MemoryCache, RedisCache
+
+
+class FakeRedis:
+    """Local stand-in for a redis-py client: get/set(ex=)/delete on a dict, with expiry driven by the test."""
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.expiry[key] = ex
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        self.expiry.pop(key, None)
+
+    def expire_all(self):
+        # What the server does once the TTL passes
+        self.data.clear()
+
+
+def test_redis_cache_hits_and_misses():
+    client = FakeRedis()
+    cache = RedisCache(client, ttl=60)
+    assert cache.get('a') is None
+    cache.set('a', {'rows': [1, 2]})
+    assert cache.get('a') == {'rows': [1, 2]}
+    assert client.expiry == {'mukera:a': 60}  # prefixed, and the server expires it
+    client.expire_all()
+    assert cache.get('a') is None
+    assert cache.stats() == {'backend': 'redis', 'hits': 1, 'misses': 2, 'evictions': 0}
+
+
+def test_redis_cache_evicts_unreadable_values():
+    client = FakeRedis()
+    cache = RedisCache(client)
+    client.set('mukera:a', b'not a pickle')
+    assert cache.get('a') is None
+    assert 'mukera:a' not in client.data
+    assert cache.stats() == {'backend': 'redis', 'hits': 0, 'misses': 1, 'evictions': 1}
+
+
+def test_redis_cache_shared_between_processes():
+    client = FakeRedis()
+    RedisCache(client).set('tab', '<table>')
+    other = RedisCache(client)
+    assert other.get('tab') == '<table>'
+    assert pickle.loads(client.data['mukera:tab']) == '<table>'
+    assert other.stats()['hits'] == 1
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # b is now the least recently used
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats() == {'backend': 'memory', 'entries': 2, 'hits': 3, 'misses': 1, 'evictions': 1}
+
+
+def test_memory_cache_expires_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now[0])
+    cache = MemoryCache(ttl=10)
+    cache.set('a', 1)
+    now[0] += 9
+    assert cache.get('a') == 1
+    now[0] += 2
+    assert cache.get('a') is None
+    assert cache.stats() == {'backend': 'memory', 'entries': 0, 'hits': 1, 'misses': 1, 'evictions': 1}
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def tab_cache(request, monkeypatch, client):
+    """The app's cache swapped for a fresh MemoryCache or a RedisCache on a FakeRedis."""
+    cache = MemoryCache() if request.param == 'memory' else RedisCache(FakeRedis())
+    monkeypatch.setattr(crm, 'cache', cache)
+    return cache
+
+
+@pytest.fixture
+def cleanup(seeded):
+    yield
+    with crm.app.app_context():
+        crm.db.session.execute(crm.delete(crm.Customer).where(crm.Customer.email.like('%@cache.example.com')))
+        crm.db.session.commit()
+
+
+def customers_tab(client):
+    return client.get('/?tab=customers&partial=1&search=Cachewell').get_data(as_text=True)
+
+
+def test_cached_tab_is_reused(client, tab_cache):
+    first = customers_tab(client)
+    hits = tab_cache.hits
+    assert customers_tab(client) == first
+    assert tab_cache.hits > hits
+    assert client.get('/cache/stats').get_json() == tab_cache.stats()
+
+
+def test_cached_tab_follows_insert_update_delete(client, tab_cache, cleanup):
+    assert 'Cachewell Original' not in customers_tab(client)
+    with crm.app.app_context():
+        customer = crm.Customer(name='Cachewell Original', email='orig@cache.example.com')
+        crm.db.session.add(customer)
+        crm.db.session.commit()
+        customer_id = customer.id
+    assert 'Cachewell Original' in customers_tab(client)
+    assert 'Cachewell Original' in customers_tab(client)  # served from the cache
+
+    with crm.app.app_context():
+        crm.db.session.get(crm.Customer, customer_id).name = 'Cachewell Renamed'
+        crm.db.session.commit()
+    html = customers_tab(client)
+    assert 'Cachewell Renamed' in html and 'Cachewell Original' not in html
+
+    with crm.app.app_context():
+        crm.db.session.delete(crm.db.session.get(crm.Customer, customer_id))
+        crm.db.session.commit()
+    assert 'Cachewell Renamed' not in customers_tab(client)
+
+
+def test_cached_tab_follows_bulk_statements(client, tab_cache, cleanup):
+    customers_tab(client)
+    with crm.app.app_context():
+        crm.db.session.execute(insert(crm.Customer), [{'name': 'Cachewell Bulk', 'email': 'bulk@cache.example.com'}])
+        crm.db.session.commit()
+    assert 'Cachewell Bulk' in customers_tab(client)
+
+    with crm.app.app_context():
+        crm.db.session.execute(update(crm.Customer).where(crm.Customer.email == 'bulk@cache.example.com')
+                               .values(name='Cachewell Updated'))
+        crm.db.session.commit()
+    html = customers_tab(client)
+    assert 'Cachewell Updated' in html and 'Cachewell Bulk' not in html
+
+    with crm.app.app_context():
+        crm.db.session.execute(crm.delete(crm.Customer).where(crm.Customer.email == 'bulk@cache.example.com'))
+        crm.db.session.commit()
+    assert 'Cachewell Updated' not in customers_tab(client)
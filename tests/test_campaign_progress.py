@@ -0,0 +1,56 @@
+"""ETA of campaign runs, including Scheduled runs with sends still outstanding."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as crm
+
+
+def at(seconds_from_now):
+    return (datetime.now() + timedelta(seconds=seconds_from_now)).strftime(crm.RUN_TIME_FORMAT)
+
+
+@pytest.fixture
+def scheduled_run(seeded):
+    """A run started 100 s ago that has sent 10 emails, with sends_due(n_due, n_later) adding the rest."""
+    with crm.app.app_context():
+        run = crm.CampaignRun(campaign_id=1, segment_id=1, status='Scheduled', total=0, processed=10, sent=10,
+                              started_at=at(-100), created_at=at(-100))
+        crm.db.session.add(run)
+        crm.db.session.commit()
+        run_id = run.id
+
+    def sends_due(n_due, n_later, later=3600):
+        with crm.app.app_context():
+            crm.db.session.add_all([crm.ScheduledSend(run_id=run_id, step_id=1, recipient_email='r%d@example.com' % i,
+                                                      due_at=at(-10 if i < n_due else later)) for i in range(n_due + n_later)])
+            run = crm.db.session.get(crm.CampaignRun, run_id)
+            run.total = 10 + n_due + n_later
+            crm.db.session.commit()
+            return crm.campaign_run_progress(run)
+
+    yield sends_due
+    with crm.app.app_context():
+        crm.db.session.execute(crm.delete(crm.ScheduledSend).where(crm.ScheduledSend.run_id == run_id))
+        crm.db.session.execute(crm.delete(crm.CampaignRun).where(crm.CampaignRun.id == run_id))
+        crm.db.session.commit()
+
+
+def test_scheduled_eta_from_the_send_rate(scheduled_run):
+    progress = scheduled_run(20, 0)
+    # 10 sends in 100 s: the 20 due ones take about 200 s
+    assert progress['eta_seconds'] == pytest.approx(200, abs=5)
+    assert progress['next_due_at'] is not None
+
+
+def test_scheduled_eta_waits_for_the_last_send(scheduled_run):
+    progress = scheduled_run(5, 5, later=3600)
+    assert progress['eta_seconds'] == pytest.approx(3600, abs=5)
+
+
+def test_running_eta(seeded):
+    with crm.app.app_context():
+        run = crm.CampaignRun(status='Running', total=40, processed=10, started_at=at(-100))
+        assert crm.campaign_run_progress(run)['eta_seconds'] == pytest.approx(300, abs=5)
+        queued = crm.CampaignRun(status='Queued', total=0, processed=0)
+        assert crm.campaign_run_progress(queued)['eta_seconds'] is None
@@ -0,0 +1,40 @@
+"""Campaign report stats: totals and breakdowns from one grouped query."""
+import pytest
+
+import app as crm
+
+CAMPAIGN_ID = 999001  # no such campaign in the seed data
+
+
+@pytest.fixture
+def logs(seeded):
+    # Three recipients over two steps and two hours; r1 is counted once although it has three rows
+    rows = [('r1', 1, 'Sent', '2026-01-01 09:05'), ('r1', 2, 'Sent', '2026-01-01 10:05'), ('r2', 1, 'Failed', '2026-01-01 09:10'),
+            ('r3', 1, 'Sent', '2026-01-01 09:15'), ('r1', 3, 'Completed', '2026-01-01 10:20')]
+    with crm.app.app_context():
+        crm.db.session.add_all([crm.CampaignLog(campaign_id=CAMPAIGN_ID, segment_id=1, recipient_email='%s@example.com' % r,
+                                                step_id=step, status=status, timestamp=ts) for r, step, status, ts in rows])
+        crm.db.session.commit()
+    yield
+    with crm.app.app_context():
+        crm.db.session.execute(crm.delete(crm.CampaignLog).where(crm.CampaignLog.campaign_id == CAMPAIGN_ID))
+        crm.db.session.commit()
+
+
+def test_report_stats_in_one_query(logs, sql_statements):
+    crm.cache.clear()
+    with crm.app.app_context(), sql_statements() as statements:
+        stats = crm.campaign_report_stats(CAMPAIGN_ID)
+    assert len([s for s in statements if 'FROM campaign_log' in s]) == 1  # besides the cache's table versions
+    assert {k: stats[k] for k in ('targeted', 'total', 'sent', 'failed', 'completed')} == \
+        {'targeted': 3, 'total': 5, 'sent': 3, 'failed': 1, 'completed': 1}
+    assert [(s['step_id'], s['total']) for s in stats['by_step']] == [(1, 3), (2, 1), (3, 1)]
+    assert [(h['hour'], h.get('sent', 0), h['total']) for h in stats['by_hour']] == \
+        [('2026-01-01 09', 2, 3), ('2026-01-01 10', 1, 2)]
+
+
+def test_report_stats_without_logs(seeded):
+    crm.cache.clear()
+    with crm.app.app_context():
+        stats = crm.campaign_report_stats(CAMPAIGN_ID)
+    assert (stats['targeted'], stats['total'], stats['by_step']) == (0, 0, [])
@@ -0,0 +1,49 @@
+"""Dispatcher.run: every item is reported once, and a failing on_result stops the run instead of hanging it."""
+import asyncio
+
+import pytest
+
+from dispatcher import Dispatcher
+
+TIMEOUT = 5  # seconds; a hung run fails the test instead of the suite
+
+
+def run(dispatcher, items, on_result):
+    asyncio.run(asyncio.wait_for(dispatcher.run(items, on_result), TIMEOUT))
+
+
+def test_every_item_is_reported():
+    results = []
+    run(Dispatcher(lambda recipient, payload: None, concurrency=3, queue_size=2),
+        (('user%d@example.com' % i, i) for i in range(50)), lambda *result: results.append(result))
+    assert sorted(payload for _, payload, _, _ in results) == list(range(50))
+    assert {status for _, _, status, _ in results} == {'Sent'}
+
+
+@pytest.mark.parametrize('failing', ['every', 'first'])
+def test_on_result_error_stops_the_run(failing):
+    consumed = []
+
+    def items():
+        for i in range(1000):
+            consumed.append(i)
+            yield 'user%d@example.com' % i, i
+
+    def on_result(recipient, payload, status, error):
+        if failing == 'every' or payload == 0:
+            raise RuntimeError('cannot record %s' % recipient)
+
+    with pytest.raises(RuntimeError, match='cannot record'):
+        run(Dispatcher(lambda recipient, payload: None, concurrency=2, queue_size=2), items(), on_result)
+    assert len(consumed) < 1000  # the stream stopped being read
+
+
+def test_on_result_error_while_finishing():
+    # The last items fail after the producer has put them all and is putting the stop markers
+    def on_result(recipient, payload, status, error):
+        if payload >= 3:
+            raise RuntimeError('cannot record %s' % recipient)
+
+    with pytest.raises(RuntimeError, match='cannot record'):
+        run(Dispatcher(lambda recipient, payload: None, concurrency=2, queue_size=1),
+            [('user%d@example.com' % i, i) for i in range(5)], on_result)
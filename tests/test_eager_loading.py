@@ -0,0 +1,51 @@
+"""Rows that render {{x.customer.name}} load their customer with the rows, not one SELECT each.
+
+The customer backrefs are lazy='raise_on_sql', so a missing eager load is a 500
+today; should that be relaxed, a lazy load shows up as its own statement
+selecting one customer by id, and any such statement fails the guard too.
+"""
+import re
+
+import pytest
+
+import app as crm
+
+LAZY_CUSTOMER_LOAD = re.compile(r'FROM customer\s+WHERE customer\.id = \?')
+# Pages whose rows show their customer's name, with the statements one request may run
+CUSTOMER_NAME_PAGES = {
+    '/?tab=contacts': 4,
+    '/?tab=tasks': 3,
+    '/?tab=deals': 3,
+    '/?tab=reminders': 3,
+    '/?tab=pipeline': 10,
+    '/pipeline/New': 1,
+    '/pipeline/Won': 1,
+}
+
+
+def lazy_loads(statements):
+    return [s for s in statements if LAZY_CUSTOMER_LOAD.search(s)]
+
+
+@pytest.mark.parametrize('url', sorted(CUSTOMER_NAME_PAGES))
+def test_customer_names_are_eager_loaded(client, sql_statements, url):
+    with sql_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert not lazy_loads(statements)
+    assert len(statements) <= CUSTOMER_NAME_PAGES[url], '\n'.join(statements)
+
+
+def test_pages_show_customer_names(client):
+    # The guard above only means something if the rows (and their customers) are on the page
+    with crm.app.app_context():
+        task = crm.Task.query.order_by(crm.Task.id).first()
+        name = crm.db.session.get(crm.Customer, task.customer_id).name
+    assert name in client.get('/?tab=tasks').get_data(as_text=True)
+
+
+@pytest.mark.parametrize('url', ['/edit_task/1', '/edit_deal/1', '/edit_reminder/1', '/edit_contact/1'])
+def test_edit_page_is_one_statement(client, sql_statements, url):
+    with sql_statements() as statements:
+        assert client.get(url).status_code == 200
+    assert len(statements) == 1, '\n'.join(statements)
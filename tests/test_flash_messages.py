@@ -0,0 +1,40 @@
+"""Dashboard POSTs redirect, so their messages are flashed and shown by the GET that follows."""
+import json
+
+import app as crm
+
+
+def test_post_message_survives_the_redirect(client):
+    response = client.post('/?tab=leads', data={'add_lead': '1', 'lead_name': '', 'lead_email': ''}, follow_redirects=True)
+    assert 'Name and Email required for lead.' in response.get_data(as_text=True)
+    # Shown once
+    assert 'Name and Email required for lead.' not in client.get('/?tab=leads').get_data(as_text=True)
+
+
+def test_lead_conversion_report_is_shown(client):
+    with crm.app.app_context():
+        lead_id = crm.Lead.query.order_by(crm.Lead.id.desc()).first().id
+    response = client.post('/?tab=leads', data={'convert_leads': '1', 'ids': str(lead_id)}, follow_redirects=True)
+    assert '1 lead(s) converted' in response.get_data(as_text=True)
+
+
+def test_invalid_segment_rules_are_shown_as_an_error(client):
+    response = client.post('/?tab=marketing', data={'add_segment': '1', 'segment_name': 'Broken', 'segment_rules': '{"entity": "Planet"}'},
+                           follow_redirects=True)
+    html = response.get_data(as_text=True)
+    assert 'alert-danger' in html and 'Invalid segment rules' in html
+
+
+def test_page_with_a_message_has_no_etag(client):
+    etag = client.get('/?tab=leads').headers['ETag']
+    client.post('/?tab=leads', data={'add_lead': '1', 'lead_name': '', 'lead_email': ''})
+    response = client.get('/?tab=leads', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and 'ETag' not in response.headers
+    assert 'Name and Email required for lead.' in response.get_data(as_text=True)
+
+
+def test_json_conversion_still_returns_the_report(client):
+    with crm.app.app_context():
+        lead_id = crm.Lead.query.order_by(crm.Lead.id.desc()).first().id
+    response = client.post('/?tab=leads', data={'convert_leads': '1', 'ids': str(lead_id)}, headers={'Accept': 'application/json'})
+    assert set(json.loads(response.data)) >= {'converted'}
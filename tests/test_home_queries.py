@@ -0,0 +1,62 @@
+"""Each dashboard tab runs a fixed, small number of SQL statements.
+
+home() loads only the requested tab's data, so the count per tab must not grow
+with the other tabs' tables or with the number of rows on the page.
+"""
+import pytest
+
+import app as crm
+
+# Statements for an uncached render of each tab, table_version reads included
+TAB_STATEMENT_BUDGETS = {
+    'marketing': 4,
+    'pipeline': 10,  # summary plus one page of cards per stage
+    'leads': 4,
+    'customers': 4,
+    'contacts': 4,
+    'tasks': 3,
+    'deals': 3,
+    'reminders': 3,
+    'activities': 3,
+}
+# Tables every request may read besides the tab's own: the version stamps behind the cache keys
+SHARED_TABLES = {'table_version'}
+
+
+def test_every_tab_has_a_budget():
+    assert set(TAB_STATEMENT_BUDGETS) == set(crm.TAB_LOADERS)
+
+
+@pytest.mark.parametrize('tab', sorted(TAB_STATEMENT_BUDGETS))
+def test_tab_statement_count(client, sql_statements, tab):
+    with sql_statements() as statements:
+        response = client.get('/?tab=%s' % tab)
+    assert response.status_code == 200
+    assert len(statements) <= TAB_STATEMENT_BUDGETS[tab], '\n'.join(statements)
+
+
+@pytest.mark.parametrize('tab', sorted(TAB_STATEMENT_BUDGETS))
+def test_tab_reads_only_its_tables(client, sql_statements, tab):
+    with sql_statements() as statements:
+        client.get('/?tab=%s' % tab)
+    allowed = set(crm.TAB_TABLES[tab] or ()) | SHARED_TABLES
+    read = {table.name for table in crm.db.metadata.sorted_tables
+            if any(' %s ' % table.name in ' %s ' % s.replace('\n', ' ') for s in statements)}
+    assert read <= allowed
+
+
+@pytest.mark.parametrize('tab', ['customers', 'contacts', 'tasks', 'deals', 'reminders', 'leads', 'activities'])
+def test_statement_count_does_not_grow_with_page_size(client, sql_statements, tab):
+    with sql_statements() as small:
+        client.get('/?tab=%s&per_page=2' % tab)
+    crm.cache.clear()
+    with sql_statements() as large:
+        client.get('/?tab=%s&per_page=40' % tab)
+    assert len(large) == len(small)
+
+
+def test_cached_tab_only_reads_versions(client, sql_statements):
+    client.get('/?tab=deals')
+    with sql_statements() as statements:
+        assert client.get('/?tab=deals').status_code == 200
+    assert all('table_version' in s for s in statements)
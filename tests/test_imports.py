@@ -0,0 +1,56 @@
+"""CSV imports upsert on email; blank cells keep the existing value."""
+import pytest
+
+import app as crm
+import worker
+
+CSV = '''name,email,status,phone
+Ada,ada@import.example.com,customer,1
+Ada Two,ada@import.example.com,,
+Bo,bo@import.example.com,,
+Cy,not-an-email,,
+,nameless@import.example.com,,
+'''
+
+
+def run_import(tmp_path, text, entity='customers'):
+    path = tmp_path / 'import.csv'
+    path.write_text(text)
+    with crm.app.app_context():
+        job = crm.ImportJob(entity=entity, path=str(path), filename='import.csv', status='Running',
+                            total_bytes=len(text))
+        crm.db.session.add(job)
+        crm.db.session.commit()
+        worker.process_import(job)
+        return {key: getattr(job, key) for key in ('status', 'inserted', 'updated', 'errors', 'error')}
+
+
+def customer(email):
+    with crm.app.app_context():
+        row = crm.Customer.query.filter_by(email=email).one()
+        return row.name, row.status, row.phone
+
+
+@pytest.fixture
+def clean_customers(seeded):
+    yield
+    with crm.app.app_context():
+        crm.db.session.execute(crm.delete(crm.Customer).where(crm.Customer.email.like('%@import.example.com')))
+        crm.db.session.commit()
+
+
+@pytest.mark.parametrize('batch_size', [1, 1000])
+def test_duplicate_email_merges_like_row_by_row(tmp_path, monkeypatch, clean_customers, batch_size):
+    # Whether both rows land in one batch or in two, the second only overwrites its non-blank cells
+    monkeypatch.setattr(worker, 'IMPORT_BATCH_SIZE', batch_size)
+    report = run_import(tmp_path, CSV)
+    assert report == {'status': 'Completed', 'inserted': 2, 'updated': 1, 'errors': 2, 'error': ''}
+    assert customer('ada@import.example.com') == ('Ada Two', 'Customer', '1')
+    assert customer('bo@import.example.com') == ('Bo', 'Lead', None)
+
+
+def test_reimport_updates_and_keeps_blank_cells(tmp_path, clean_customers):
+    run_import(tmp_path, 'name,email,status,phone\nAda,ada@import.example.com,Opportunity,5\n')
+    report = run_import(tmp_path, 'name,email,status,phone\nAda B,ada@import.example.com,,\n')
+    assert (report['inserted'], report['updated']) == (0, 1)
+    assert customer('ada@import.example.com') == ('Ada B', 'Opportunity', '5')
@@ -0,0 +1,73 @@
+"""Keyset pagination: every row exactly once in both directions, with index range scans."""
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import app as crm
+
+
+@pytest.fixture
+def undated_activities(seeded):
+    # Some activities without a date, so pages cross from the NULLs to the dated rows
+    with crm.app.app_context():
+        crm.db.session.execute(crm.db.text('UPDATE activity SET date = NULL WHERE id % 7 = 0'))
+        crm.db.session.commit()
+    yield
+    with crm.app.app_context():
+        crm.db.session.execute(crm.db.text("UPDATE activity SET date = '2026-01-01' WHERE date IS NULL"))
+        crm.db.session.commit()
+
+
+def walk(query, keys, per_page, direction, cursor=None):
+    ids, pages = [], 0
+    while True:
+        args = MultiDict({'per_page': per_page, **({direction: cursor} if cursor else {})})
+        page = crm.keyset_paginate(query, keys, args)
+        pages += 1
+        ids = ids + [item.id for item in page.items] if direction == 'after' else [item.id for item in page.items] + ids
+        cursor = page.next_cursor if direction == 'after' else page.prev_cursor
+        if not cursor:
+            return ids, page, pages
+
+
+@pytest.mark.parametrize('per_page', [1, 7, 30])
+def test_activities_with_null_dates_page_through_every_row(undated_activities, per_page):
+    with crm.app.app_context():
+        keys = [crm.Activity.date, crm.Activity.id]
+        expected = [a.id for a in crm.Activity.query.order_by(crm.Activity.date.asc().nulls_first(), crm.Activity.id)]
+        forward, last_page, pages = walk(crm.Activity.query, keys, per_page, 'after')
+        assert forward == expected
+        assert pages == -(-len(expected) // per_page)
+        backward, _, _ = walk(crm.Activity.query, keys, per_page, 'before', last_page.prev_cursor)
+        assert backward + [a.id for a in last_page.items] == expected
+
+
+@pytest.mark.parametrize('tab_query, filters, keys, cursor', [
+    (crm.activities_query, {}, ['date', 'id'], ['2026-01-01', 5]),
+    (crm.activities_query, {}, ['date', 'id'], [None, 5]),
+    (crm.deals_query, {'deal_stage': 'Won'}, ['id'], [5]),
+    (crm.tasks_query, {'task_status': 'Todo'}, ['id'], [5]),
+    (crm.tasks_query, {'task_status': 'Todo', 'task_due': '2026-10-20'}, ['id'], [5]),
+    (crm.reminders_query, {'reminder_due': '2026-10-20'}, ['id'], [5]),
+])
+@pytest.mark.parametrize('direction', ['after', 'before'])
+def test_pages_are_index_ranges_without_a_sort(seeded, tab_query, filters, keys, cursor, direction):
+    statements = []
+
+    def record(conn, cursor_, statement, parameters, context, executemany):
+        if not statement.startswith('EXPLAIN'):
+            statements.append((statement, parameters))
+
+    with crm.app.app_context():
+        query = tab_query(filters)
+        model = query.column_descriptions[0]['entity']
+        # A page size above the row count, so a seek crossing the NULLs runs each of its ranges
+        args = MultiDict({'per_page': crm.MAX_PAGE_SIZE, direction: crm.encode_cursor(cursor)})
+        crm.db.event.listen(crm.db.engine, 'before_cursor_execute', record)
+        try:
+            crm.keyset_paginate(query, [getattr(model, key) for key in keys], args)
+        finally:
+            crm.db.event.remove(crm.db.engine, 'before_cursor_execute', record)
+        connection = crm.db.session.connection()
+        for statement, parameters in statements:
+            plan = ' | '.join(row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters))
+            assert 'TEMP B-TREE' not in plan and 'SCAN' not in plan, plan
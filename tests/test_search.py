@@ -0,0 +1,90 @@
+"""Full-text search: prefix matching, ranking, and the triggers keeping search_index in sync."""
+import pytest
+
+import app as crm
+
+pytestmark = pytest.mark.skipif(not crm.FULL_TEXT_SEARCH, reason='SQLite without FTS5')
+
+
+def search(client, q, **args):
+    return client.get('/search', query_string=dict(args, q=q, limit=100)).get_json()['results']
+
+
+def ids(results, type_='customer'):
+    return [r['id'] for r in results if r['type'] == type_]
+
+
+@pytest.fixture
+def add(seeded):
+    """add(model, **values) inserts a row through the ORM (so the triggers fire) and removes it afterwards."""
+    added = []
+
+    def add_row(model, **values):
+        with crm.app.app_context():
+            row = model(**values)
+            crm.db.session.add(row)
+            crm.db.session.commit()
+            added.append((model, row.id))
+            return row.id
+
+    yield add_row
+    with crm.app.app_context():
+        for model, id_ in reversed(added):
+            crm.db.session.execute(crm.delete(model).where(model.id == id_))
+        crm.db.session.commit()
+
+
+def test_prefixes_of_every_word_match(client, add):
+    customer_id = add(crm.Customer, name='Xanthe Quimby', email='xq@search.example.com')
+    assert customer_id in ids(search(client, 'xan'))
+    assert customer_id in ids(search(client, 'qui xa'))
+    assert customer_id not in ids(search(client, 'xan zzz'))
+
+
+def test_name_matches_rank_above_notes(client, add):
+    in_notes = add(crm.Customer, name='Plain Name', email='plain@search.example.com', notes='Mentioned vorlandia once')
+    in_name = add(crm.Customer, name='Vorlandia Traders', email='vt@search.example.com')
+    assert ids(search(client, 'vorland'))[:2] == [in_name, in_notes]
+
+
+def test_broad_queries_rank_the_newest_matches(client, add, monkeypatch):
+    in_name = add(crm.Customer, name='Brumbleton Hall', email='bh@search.example.com')
+    newer = [add(crm.Customer, name='Plain %d' % i, email='p%d@search.example.com' % i, notes='brumbleton') for i in range(3)]
+    results = ids(search(client, 'brumbleton'))
+    assert results[0] == in_name and sorted(results[1:]) == newer
+    monkeypatch.setattr(crm, 'SEARCH_RANK_CANDIDATES', 2)
+    assert sorted(ids(search(client, 'brumbleton'))) == newer[1:]
+    assert ids(search(client, 'brumbleton hall')) == [in_name]  # narrower: ranked in full again
+
+
+def test_type_filter(client, add):
+    lead_id = add(crm.Lead, name='Yevgenia Lead', email='yl@search.example.com')
+    customer_id = add(crm.Customer, name='Yevgenia Customer', email='yc@search.example.com')
+    results = search(client, 'yevgenia', type='lead')
+    assert ids(results, 'lead') == [lead_id] and customer_id not in ids(results)
+
+
+def test_triggers_follow_insert_update_delete(client, add):
+    customer_id = add(crm.Customer, name='Wilhelmina Oldname', email='wo@search.example.com')
+    contact_id = add(crm.Contact, customer_id=customer_id, name='Wilhelmina Contact')
+    assert customer_id in ids(search(client, 'oldname'))
+    assert contact_id in ids(search(client, 'wilhelmina'), 'contact')
+
+    with crm.app.app_context():
+        crm.db.session.get(crm.Customer, customer_id).name = 'Wilhelmina Newname'
+        crm.db.session.commit()
+    assert customer_id not in ids(search(client, 'oldname'))
+    assert customer_id in ids(search(client, 'newname'))
+
+    with crm.app.app_context():
+        crm.db.session.execute(crm.delete(crm.Customer).where(crm.Customer.id == customer_id))
+        crm.db.session.commit()
+    assert search(client, 'wilhelmina') == []  # the contact went with its customer (ON DELETE CASCADE)
+
+
+def test_customers_tab_searches_name_and_email_only(client, add):
+    add(crm.Customer, name='Notes Only', email='notes-only@search.example.com', notes='quelliform')
+    add(crm.Customer, name='Quelliform Ltd', email='ql@search.example.com')
+    html = client.get('/?tab=customers&search=quelliform').get_data(as_text=True)
+    assert 'Quelliform Ltd' in html and 'notes-only@search.example.com' not in html
+    assert 'ql@search.example.com' in client.get('/?tab=customers&search=ql%40search').get_data(as_text=True)
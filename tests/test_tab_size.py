@@ -0,0 +1,47 @@
+"""Tab pages stay the same size however many customers exist: forms pick customers by typeahead."""
+import pytest
+from sqlalchemy import insert
+
+import app as crm
+
+EXTRA_CUSTOMERS = 2000
+
+
+@pytest.fixture
+def many_customers(seeded):
+    with crm.app.app_context():
+        crm.db.session.execute(insert(crm.Customer), [{'name': 'Bulk Customer %d' % i, 'email': 'bulk%d@size.example.com' % i}
+                                                      for i in range(EXTRA_CUSTOMERS)])
+        crm.db.session.commit()
+    yield
+    with crm.app.app_context():
+        crm.db.session.execute(crm.delete(crm.Customer).where(crm.Customer.email.like('%@size.example.com')))
+        crm.db.session.commit()
+
+
+def tab_sizes(client):
+    crm.cache.clear()
+    return {tab: len(client.get('/?tab=%s' % tab, headers={'Accept-Encoding': 'identity'}).data)
+            for tab in ('contacts', 'tasks', 'deals', 'reminders')}
+
+
+def test_tab_size_does_not_grow_with_customers(client, request):
+    before = tab_sizes(client)
+    request.getfixturevalue('many_customers')
+    after = tab_sizes(client)
+    assert after == before
+
+
+def test_contact_filter_shows_the_chosen_customer(client):
+    with crm.app.app_context():
+        customer = crm.Customer.query.order_by(crm.Customer.id).first()
+    html = client.get('/?tab=contacts&contact_customer=%d' % customer.id).get_data(as_text=True)
+    assert 'name="contact_customer" value="%d"' % customer.id in html
+    assert customer.name in html
+
+
+def test_customer_typeahead_source(client):
+    with crm.app.app_context():
+        customer = crm.Customer.query.order_by(crm.Customer.id).first()
+    results = client.get('/search', query_string={'type': 'customer', 'q': customer.name, 'limit': 100}).get_json()['results']
+    assert customer.id in [r['id'] for r in results if r['type'] == 'customer']
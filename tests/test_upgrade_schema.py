@@ -0,0 +1,30 @@
+"""upgrade_schema runs at import in every process; concurrent starts must not race."""
+import os
+import sys
+import sqlite3
+import subprocess
+
+import app as crm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSES = 6
+
+
+def test_concurrent_imports_apply_each_migration_once(tmp_path):
+    path = tmp_path / 'crm.db'
+    env = dict(os.environ, DATABASE_URL='sqlite:///%s' % path)
+    starts = [subprocess.Popen([sys.executable, '-c', 'import app'], cwd=ROOT, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) for _ in range(PROCESSES)]
+    for process in starts:
+        _, stderr = process.communicate(timeout=120)
+        assert process.returncode == 0, stderr
+    with sqlite3.connect(path) as conn:
+        versions = [v for (v,) in conn.execute('SELECT version FROM schema_version ORDER BY version')]
+    assert versions == sorted(version for version, _ in crm.MIGRATIONS)
+
+
+def test_upgrade_is_idempotent(seeded):
+    with crm.app.app_context():
+        crm.upgrade_schema()
+        applied = crm.db.session.scalar(crm.db.text('SELECT count(*) FROM schema_version'))
+    assert applied == len(crm.MIGRATIONS)
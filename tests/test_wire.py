@@ -0,0 +1,36 @@
+"""Dashboard responses are compressed when the client accepts it and revalidate to an empty 304."""
+import gzip
+
+import pytest
+
+import app as crm
+import bench
+
+
+@pytest.mark.parametrize('tab', ['customers', 'tasks', 'pipeline'])
+def test_gzip_is_smaller_and_304_is_empty(client, tab):
+    sizes, not_modified = bench.measure_wire(client, tab, ['identity', 'gzip'])
+    assert sizes['identity'] > crm.COMPRESS_MIN_BYTES
+    assert sizes['gzip'] < sizes['identity']
+    assert not_modified == 0
+
+
+def test_gzip_body_is_the_identity_body(client):
+    identity = client.get('/?tab=customers', headers={'Accept-Encoding': 'identity'})
+    compressed = client.get('/?tab=customers', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in identity.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(compressed.data) == identity.data
+
+
+def test_write_changes_the_etag(client):
+    etag = client.get('/?tab=tasks').headers['ETag']
+    assert client.get('/?tab=tasks', headers={'If-None-Match': etag}).status_code == 304
+    with crm.app.app_context():
+        task = crm.Task.query.order_by(crm.Task.id.desc()).first()
+        task.title += ' (edited)'
+        crm.db.session.commit()
+    response = client.get('/?tab=tasks', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
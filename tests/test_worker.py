@@ -0,0 +1,32 @@
+"""The worker loop shares its time between campaign sends and CSV imports."""
+import worker
+
+
+def test_imports_are_not_starved_by_due_sends(monkeypatch):
+    done = []
+    imports = ['job']
+    monkeypatch.setattr(worker, 'claim_next_run', lambda: None)
+    monkeypatch.setattr(worker, 'dispatch_due_sends', lambda: done.append('send') or True)  # always more sends due
+    monkeypatch.setattr(worker, 'claim_next_import', lambda: imports.pop() if imports else None)
+    monkeypatch.setattr(worker, 'process_import', lambda job: done.append('import'))
+
+    send_batches = 0
+    for _ in range(3 * worker.SEND_BATCHES_PER_IMPORT):
+        send_batches = worker.work_once(send_batches)
+    assert done.index('import') == worker.SEND_BATCHES_PER_IMPORT
+    assert done.count('import') == 1
+
+
+def test_runs_and_sends_go_first(monkeypatch):
+    done = []
+    runs = ['run']
+    monkeypatch.setattr(worker, 'claim_next_run', lambda: runs.pop() if runs else None)
+    monkeypatch.setattr(worker, 'process_run', lambda run: done.append('run'))
+    monkeypatch.setattr(worker, 'dispatch_due_sends', lambda: False)
+    monkeypatch.setattr(worker, 'claim_next_import', lambda: 'job' if 'import' not in done else None)
+    monkeypatch.setattr(worker, 'process_import', lambda job: done.append('import'))
+
+    assert worker.work_once(0) == 1
+    assert worker.work_once(1) == 0
+    assert worker.work_once(0) is None
+    assert done == ['run', 'import']
@@ -0,0 +1,546 @@
+"""Background worker for queued campaign runs and CSV imports.
+
+The dashboard only records a CampaignRun or ImportJob row; this process picks
+queued jobs up from the same database and does the work. A campaign run is
+expanded into one scheduled send per recipient and Email step, due after the
+Wait steps before it; the sends are then dispatched in batches as they fall
+due, so a restart resumes from the scheduled_send table. Run it next to the
+web process, on a machine that shares the database and the instance/ folder
+(uploaded CSV files are kept there until imported):
+
+    python worker.py
+"""
+import os
+import re
+import csv
+import time
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, update, delete, literal
+
+from app import (app, db, Campaign, CampaignStep, CampaignLog, CampaignRun, ScheduledSend, Segment, Lead, Customer, Contact,
+                 ImportJob, ImportRowError, RUN_TIME_FORMAT, SMTP_POOL_SIZE, send_mail, segment_members_query)
+from dispatcher import Dispatcher
+
+POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', 2))
+# A Running run whose heartbeat is older than this is assumed orphaned by a dead worker
+STALE_AFTER = timedelta(minutes=int(os.environ.get('WORKER_STALE_MINUTES', 5)))
+
+# CSV imports are validated and upserted this many rows per statement/transaction
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+# Every bad row is counted, but only the first ones are kept for the report
+IMPORT_MAX_STORED_ERRORS = 1000
+
+# Due sends are claimed this many at a time; their results are committed at least
+# every LOG_FLUSH_INTERVAL seconds, so a crash re-sends at most one unflushed chunk
+SEND_BATCH_SIZE = int(os.environ.get('SCHEDULER_BATCH_SIZE', 500))
+LOG_FLUSH_INTERVAL = float(os.environ.get('CAMPAIGN_LOG_FLUSH_SECONDS', 5))
+LOG_TIME_FORMAT = '%Y-%m-%d %H:%M'
+# Runs and due sends go first, but a queued import still starts after this many of them in a row
+SEND_BATCHES_PER_IMPORT = int(os.environ.get('WORKER_SEND_BATCHES_PER_IMPORT', 10))
+
+# Concurrent sends (one pooled SMTP session each) and rate limits in messages/sec (0: unlimited)
+SEND_CONCURRENCY = int(os.environ.get('SMTP_CONCURRENCY', SMTP_POOL_SIZE))
+SEND_RATE = float(os.environ.get('SMTP_RATE', 0))
+SEND_DOMAIN_RATE = float(os.environ.get('SMTP_DOMAIN_RATE', 0))
+SEND_MAX_ATTEMPTS = int(os.environ.get('SMTP_MAX_ATTEMPTS', 4))
+
+log = logging.getLogger('worker')
+
+
+def now():
+    return datetime.now().strftime(RUN_TIME_FORMAT)
+
+
+def dialect_insert(model):
+    # INSERT that supports ON CONFLICT, for SQLite and PostgreSQL
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects import postgresql as dialect
+    else:
+        from sqlalchemy.dialects import sqlite as dialect
+    return dialect.insert(model)
+
+
+def requeue_stale(model):
+    cutoff = (datetime.now() - STALE_AFTER).strftime(RUN_TIME_FORMAT)
+    requeued = db.session.execute(
+        update(model)
+        .where(model.status == 'Running', model.heartbeat_at < cutoff)
+        .values(status='Queued')
+    ).rowcount
+    db.session.commit()
+    if requeued:
+        log.warning('requeued %d stale %s job(s)', requeued, model.__tablename__)
+
+
+def claim_next(model, **reset):
+    # The conditional UPDATE makes the claim atomic when several workers poll the same queue
+    job = model.query.filter_by(status='Queued').order_by(model.id).first()
+    if job is None:
+        return None
+    claimed = db.session.execute(
+        update(model)
+        .where(model.id == job.id, model.status == 'Queued')
+        .values(status='Running', started_at=now(), heartbeat_at=now(), **reset)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return None
+    db.session.refresh(job)
+    return job
+
+
+def requeue_stale_sends():
+    # Sends claimed by a worker that died before logging them
+    cutoff = (datetime.now() - STALE_AFTER).strftime(RUN_TIME_FORMAT)
+    requeued = db.session.execute(
+        update(ScheduledSend)
+        .where(ScheduledSend.status == 'Sending', ScheduledSend.claimed_at < cutoff)
+        .values(status='Pending')
+    ).rowcount
+    db.session.commit()
+    if requeued:
+        log.warning('requeued %d stale scheduled send(s)', requeued)
+
+
+def requeue_stale_runs():
+    requeue_stale(CampaignRun)
+    requeue_stale(ImportJob)
+    requeue_stale_sends()
+
+
+def claim_next_run():
+    return claim_next(CampaignRun, processed=0, sent=0, failed=0)
+
+
+def claim_next_import():
+    # Imports keep their counters: a requeued job resumes after rows_processed
+    return claim_next(ImportJob)
+
+
+class SendResultWriter:
+    """Buffers send outcomes and commits them in chunks.
+
+    Each flush sets the outcome on the sends' reserved CampaignLog rows with one
+    executemany UPDATE, deletes the scheduled_send rows they came from and adds
+    to the runs' counters, all in one transaction, so progress never runs ahead
+    of the log. Runs with no scheduled sends left are marked Completed.
+    """
+
+    def __init__(self, claimed_ids, flush_interval=LOG_FLUSH_INTERVAL):
+        self.unsent = set(claimed_ids)
+        self.flush_interval = flush_interval
+        self.results = []
+        self.last_flush = time.monotonic()
+
+    def add(self, send, run, status, log_id=None):
+        # status None: skipped, the send was already made (or is being made) elsewhere
+        self.results.append((send, run, status, log_id))
+        self.unsent.discard(send.id)
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        timestamp = datetime.now().strftime(LOG_TIME_FORMAT)
+        logs = [{'id': log_id, 'status': status, 'timestamp': timestamp}
+                for _, _, status, log_id in self.results if log_id is not None]
+        if logs:
+            db.session.execute(update(CampaignLog), logs)
+        if self.results:
+            db.session.execute(delete(ScheduledSend).where(ScheduledSend.id.in_([send.id for send, _, _, _ in self.results])))
+        counts = {}
+        for _, run, status, _ in self.results:
+            if run is not None:
+                processed, sent, failed = counts.get(run.id, (0, 0, 0))
+                counts[run.id] = (processed + 1, sent + (status == 'Sent'), failed + (status == 'Failed'))
+        for run_id, (processed, sent, failed) in counts.items():
+            db.session.execute(
+                update(CampaignRun).where(CampaignRun.id == run_id)
+                .values(processed=CampaignRun.processed + processed, sent=CampaignRun.sent + sent,
+                        failed=CampaignRun.failed + failed, heartbeat_at=now())
+                .execution_options(synchronize_session=False))
+        if counts:
+            remaining = set(db.session.scalars(db.select(ScheduledSend.run_id).where(ScheduledSend.run_id.in_(list(counts))).distinct()))
+            finished = [run_id for run_id in counts if run_id not in remaining]
+            if finished:
+                db.session.execute(
+                    update(CampaignRun).where(CampaignRun.id.in_(finished), CampaignRun.status == 'Scheduled')
+                    .values(status='Completed', finished_at=now())
+                    .execution_options(synchronize_session=False))
+        if self.unsent:
+            # Still ours: keep requeue_stale_sends from handing them to another worker
+            db.session.execute(update(ScheduledSend).where(ScheduledSend.id.in_(list(self.unsent))).values(claimed_at=now())
+                               .execution_options(synchronize_session=False))
+        db.session.commit()
+        self.results = []
+        self.last_flush = time.monotonic()
+
+
+def campaign_timeline(campaign_id):
+    """[(Email step, days after the run starts)], each Email step delayed by the Wait steps before it."""
+    steps = CampaignStep.query.filter_by(campaign_id=campaign_id).order_by(CampaignStep.order, CampaignStep.id).all()
+    offset, timeline = 0.0, []
+    for step in steps:
+        if step.step_type == 'Wait':
+            days = re.match(r'\s*(\d+(?:\.\d+)?)', step.details or '')
+            if days is None:
+                raise ValueError('Wait step #%d needs a number of days, got %r' % (step.id, step.details))
+            offset += float(days.group(1))
+        elif step.step_type == 'Email':
+            timeline.append((step, offset))
+    return timeline
+
+
+def schedule_run(run):
+    """Expand a run into scheduled_send rows, one INSERT ... SELECT per Email step.
+
+    Recipients already Sent this step for the same campaign and segment are left
+    out by an anti-join on the campaign_log unique index, so re-running a campaign
+    after a failure only schedules the remaining work. The rows, the run's total
+    and its Scheduled status are committed together: a worker dying half way
+    leaves nothing behind, and the requeued run starts over.
+    """
+    segment = Segment.query.get(run.segment_id)
+    if segment is None or Campaign.query.get(run.campaign_id) is None:
+        raise ValueError('campaign or segment no longer exists')
+    members = segment_members_query(segment)[0].subquery()
+    start = datetime.strptime(run.started_at, RUN_TIME_FORMAT)
+    for step, days in campaign_timeline(run.campaign_id):
+        due_at = (start + timedelta(days=days)).strftime(RUN_TIME_FORMAT)
+        already_sent = db.select(CampaignLog.id).where(
+            CampaignLog.campaign_id == run.campaign_id, CampaignLog.segment_id == run.segment_id,
+            CampaignLog.recipient_email == members.c.email, CampaignLog.step_id == step.id, CampaignLog.status == 'Sent')
+        db.session.execute(insert(ScheduledSend).from_select(
+            ['run_id', 'step_id', 'recipient_email', 'due_at', 'status'],
+            db.select(literal(run.id), literal(step.id), members.c.email, literal(due_at), literal('Pending'))
+            .where(~already_sent.exists())))
+    run.total = db.session.scalar(db.select(func.count()).where(ScheduledSend.run_id == run.id))
+    if run.total:
+        run.status = 'Scheduled'
+    else:
+        run.status = 'Completed'
+        run.finished_at = now()
+    db.session.commit()
+
+
+def process_run(run):
+    log.info('scheduling campaign run #%d', run.id)
+    try:
+        schedule_run(run)
+    except Exception as e:
+        log.exception('campaign run #%d failed', run.id)
+        db.session.rollback()
+        run.status = 'Failed'
+        run.error = str(e)
+        run.finished_at = now()
+        db.session.commit()
+
+
+def claim_due_sends(limit=SEND_BATCH_SIZE):
+    # Earliest due first, straight off the (status, due_at) index; the conditional
+    # UPDATE ... RETURNING keeps two workers from claiming the same rows
+    due = (db.select(ScheduledSend.id)
+           .where(ScheduledSend.status == 'Pending', ScheduledSend.due_at <= now())
+           .order_by(ScheduledSend.due_at)
+           .limit(limit))
+    claimed = db.session.execute(
+        update(ScheduledSend)
+        .where(ScheduledSend.id.in_(due.scalar_subquery()), ScheduledSend.status == 'Pending')
+        .values(status='Sending', claimed_at=now())
+        .returning(ScheduledSend.id, ScheduledSend.run_id, ScheduledSend.step_id, ScheduledSend.recipient_email)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return claimed
+
+
+def reserve_sends(sends, runs):
+    """Claim the CampaignLog row of each send before sending it; returns {send id: log id}.
+
+    One INSERT ... ON CONFLICT over the unique (campaign, segment, recipient, step)
+    index: a new send gets a Sending row, a Failed one is taken over for a retry,
+    and a Sent one (or a Sending one another worker is still on) is not returned,
+    so the same email is never sent twice. A Sending row older than the stale
+    timeout belonged to a worker that died mid-chunk and is taken over.
+    """
+    rows = {}
+    for send in sends:
+        run = runs.get(send.run_id)
+        if run is not None:
+            rows[(run.campaign_id, run.segment_id, send.recipient_email, send.step_id)] = send.id
+    if not rows:
+        return {}
+    timestamp = datetime.now().strftime(LOG_TIME_FORMAT)
+    stale = (datetime.now() - STALE_AFTER).strftime(LOG_TIME_FORMAT)
+    stmt = dialect_insert(CampaignLog).values([
+        {'campaign_id': c, 'segment_id': s, 'recipient_email': e, 'step_id': step, 'status': 'Sending', 'timestamp': timestamp}
+        for c, s, e, step in rows])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['campaign_id', 'segment_id', 'recipient_email', 'step_id'],
+        set_={'status': 'Sending', 'timestamp': stmt.excluded.timestamp},
+        where=db.or_(CampaignLog.status == 'Failed', db.and_(CampaignLog.status == 'Sending', CampaignLog.timestamp < stale)))
+    reserved = db.session.execute(stmt.returning(CampaignLog.id, CampaignLog.campaign_id, CampaignLog.segment_id,
+                                                 CampaignLog.recipient_email, CampaignLog.step_id))
+    log_ids = {rows[(r.campaign_id, r.segment_id, r.recipient_email, r.step_id)]: r.id for r in reserved}
+    db.session.commit()
+    return log_ids
+
+
+def deliver(recipient, payload):
+    # Runs on a dispatcher thread: only the plain subject/body are used here, no ORM objects
+    subject, body = payload[2]
+    send_mail(recipient, subject, body)
+
+
+dispatcher = Dispatcher(deliver, concurrency=SEND_CONCURRENCY, rate=SEND_RATE or None,
+                        domain_rate=SEND_DOMAIN_RATE or None, max_attempts=SEND_MAX_ATTEMPTS)
+
+
+def dispatch_due_sends():
+    """Send one batch of due emails concurrently; returns how many were claimed."""
+    claimed = claim_due_sends()
+    if not claimed:
+        return 0
+    runs = {run.id: run for run in CampaignRun.query.filter(CampaignRun.id.in_({send.run_id for send in claimed}))}
+    steps = {step.id: step for step in CampaignStep.query.filter(CampaignStep.id.in_({send.step_id for send in claimed}))}
+    log_ids = reserve_sends(claimed, runs)
+    writer = SendResultWriter([send.id for send in claimed])
+    items = []
+    for send in claimed:
+        run, step = runs.get(send.run_id), steps.get(send.step_id)
+        if run is not None and send.id not in log_ids:
+            writer.add(send, run, None)
+            continue
+        # details = subject|||body
+        if run is None or step is None or '|||' not in (step.details or ''):
+            log.error('send to %s failed: campaign run or step is missing or has no subject|||body', send.recipient_email)
+            writer.add(send, run, 'Failed', log_ids.get(send.id))
+            continue
+        items.append((send.recipient_email, (send, run, step.details.split('|||', 1))))
+
+    def record(recipient, payload, status, error):
+        # Called on this thread, so the writer can use the session
+        if error is not None:
+            log.warning('send to %s failed: %r', recipient, error)
+        writer.add(payload[0], payload[1], status, log_ids.get(payload[0].id))
+
+    dispatcher.dispatch(items, record)
+    writer.flush()
+    return len(claimed)
+
+
+def seconds_until_next_send():
+    # MIN over the (status, due_at) index: one seek, however many sends are pending
+    next_due = db.session.scalar(db.select(func.min(ScheduledSend.due_at)).where(ScheduledSend.status == 'Pending'))
+    db.session.commit()
+    if next_due is None:
+        return None
+    return max(0.0, (datetime.strptime(next_due, RUN_TIME_FORMAT) - datetime.now()).total_seconds())
+
+
+# --- CSV import ---
+# entity: (model, {column: max length or None}, required columns)
+IMPORT_FIELDS = {
+    'customers': (Customer, {'name': 100, 'email': 120, 'phone': 20, 'status': 20, 'notes': None}, ('name', 'email')),
+    'leads': (Lead, {'name': 100, 'email': 120, 'phone': 20, 'company': 100, 'status': 20, 'notes': None}, ('name', 'email')),
+    'contacts': (Contact, {'customer_id': None, 'customer_email': 120, 'name': 100, 'email': 120, 'phone': 20, 'role': 50}, ('name',)),
+}
+IMPORT_STATUSES = {
+    'customers': ('Lead', 'Opportunity', 'Customer'),
+    'leads': ('New', 'Assigned', 'Converted', 'Lost'),
+}
+
+
+class ImportRejected(ValueError):
+    pass
+
+
+def validate_import_row(entity, raw):
+    model, fields, required = IMPORT_FIELDS[entity]
+    row = {}
+    for column, max_length in fields.items():
+        value = (raw.get(column) or '').strip()
+        if max_length and len(value) > max_length:
+            raise ImportRejected('%s is longer than %d characters' % (column, max_length))
+        if value:
+            row[column] = value
+    missing = [column for column in required if column not in row]
+    if missing:
+        raise ImportRejected('missing %s' % ', '.join(missing))
+    for column in ('email', 'customer_email'):
+        if column in row and '@' not in row[column]:
+            raise ImportRejected('invalid %s %r' % (column, row[column]))
+    if 'status' in row:
+        statuses = {s.lower(): s for s in IMPORT_STATUSES[entity]}
+        if row['status'].lower() not in statuses:
+            raise ImportRejected('unknown status %r' % row['status'])
+        row['status'] = statuses[row['status'].lower()]
+    if entity == 'contacts':
+        if 'customer_id' in row:
+            if not row['customer_id'].isdigit():
+                raise ImportRejected('invalid customer_id %r' % row['customer_id'])
+            row['customer_id'] = int(row['customer_id'])
+        elif 'customer_email' not in row:
+            raise ImportRejected('missing customer_id or customer_email')
+    return row
+
+
+def upsert_on_email(model, rows):
+    # Single INSERT ... ON CONFLICT (email) DO UPDATE for the whole batch; blank
+    # CSV cells (None) keep the existing value instead of clearing it
+    columns = sorted({column for row in rows for column in row})
+    rows = [{column: row.get(column) for column in columns} for row in rows]
+    stmt = dialect_insert(model).values(rows)
+    stmt = stmt.on_conflict_do_update(index_elements=['email'],
+                                      set_={c: func.coalesce(stmt.excluded[c], getattr(model, c)) for c in columns if c != 'email'})
+    db.session.execute(stmt)
+
+
+def write_import_batch(job, batch, errors):
+    """Write one batch of (line, row) pairs; rows that cannot be written are added to errors."""
+    model = IMPORT_FIELDS[job.entity][0]
+    if job.entity == 'contacts':
+        # Resolve and check the parent customers of the whole batch with two IN queries
+        emails = {row['customer_email'] for _, row in batch if 'customer_id' not in row}
+        by_email = dict(db.session.query(Customer.email, Customer.id).filter(Customer.email.in_(emails))) if emails else {}
+        ids = {row['customer_id'] for _, row in batch if 'customer_id' in row}
+        known_ids = {i for (i,) in db.session.query(Customer.id).filter(Customer.id.in_(ids))} if ids else set()
+        rows = []
+        for line, row in batch:
+            customer_email = row.pop('customer_email', None)
+            customer_id = row.pop('customer_id', None)
+            if customer_id is None:
+                customer_id = by_email.get(customer_email)
+            elif customer_id not in known_ids:
+                customer_id = None
+            if customer_id is None:
+                errors.append((line, 'unknown customer'))
+                continue
+            row['customer_id'] = customer_id
+            rows.append(row)
+        if rows:
+            db.session.execute(insert(Contact), rows)
+        job.inserted += len(rows)
+        return
+    # Rows sharing an email are merged in file order, each non-blank cell overwriting the
+    # last, which is what upserting them one by one would leave (blank cells keep the value)
+    rows = {}
+    for _, row in batch:
+        rows.setdefault(row['email'], {}).update(row)
+    existing = {e for (e,) in db.session.query(model.email).filter(model.email.in_(list(rows)))}
+    for email, row in rows.items():
+        if email not in existing:
+            row.setdefault('status', IMPORT_STATUSES[job.entity][0])
+            row.setdefault('notes', '')
+    upsert_on_email(model, list(rows.values()))
+    # A repeated email counts as an update of the row its first occurrence wrote
+    inserted = len(rows) - len(existing)
+    job.inserted += inserted
+    job.updated += len(batch) - inserted
+
+
+def counted_lines(f, job):
+    # Decoded lines for csv.reader; keeps processed_bytes current for the progress bar
+    for raw in f:
+        job.processed_bytes += len(raw)
+        yield raw.decode('utf-8-sig', errors='replace')
+
+
+def execute_import(job):
+    resume_after = job.rows_processed or 0
+    job.processed_bytes = 0
+    with open(job.path, 'rb') as f:
+        reader = csv.reader(counted_lines(f, job))
+        header = [h.strip().lower() for h in next(reader, [])]
+        if 'name' not in header:
+            raise ValueError('CSV header must include a name column')
+        seen = 0
+        batch, errors = [], []
+
+        def flush():
+            if batch:
+                write_import_batch(job, batch, errors)
+            stored = ImportRowError.query.filter_by(job_id=job.id).count() if errors else 0
+            keep = errors[:max(IMPORT_MAX_STORED_ERRORS - stored, 0)]
+            if keep:
+                db.session.execute(insert(ImportRowError), [{'job_id': job.id, 'line': line, 'message': message[:255]}
+                                                            for line, message in keep])
+            job.errors += len(errors)
+            job.rows_processed = seen
+            job.heartbeat_at = now()
+            db.session.commit()  # the batch and its progress land together
+            batch.clear()
+            errors.clear()
+
+        for values in reader:
+            seen += 1
+            if seen <= resume_after or not any(v.strip() for v in values):
+                continue
+            try:
+                batch.append((reader.line_num, validate_import_row(job.entity, dict(zip(header, values)))))
+            except ImportRejected as e:
+                errors.append((reader.line_num, str(e)))
+            if len(batch) + len(errors) >= IMPORT_BATCH_SIZE:
+                flush()
+        flush()
+    os.remove(job.path)
+
+
+def process_import(job):
+    log.info('running import #%d (%s)', job.id, job.entity)
+    try:
+        execute_import(job)
+        job.status = 'Completed'
+    except Exception as e:
+        log.exception('import #%d failed', job.id)
+        db.session.rollback()
+        job.status = 'Failed'
+        job.error = str(e)
+    job.finished_at = now()
+    db.session.commit()
+
+
+def work_once(send_batches):
+    """Do one unit of work: import, run or batch of due sends. Returns the runs and send
+    batches done in a row so far, or None if every queue was empty.
+
+    With sends always due, imports would never get a turn: after SEND_BATCHES_PER_IMPORT
+    in a row a queued import goes first.
+    """
+    if send_batches >= SEND_BATCHES_PER_IMPORT:
+        job = claim_next_import()
+        if job is not None:
+            process_import(job)
+            return 0
+    run = claim_next_run()
+    if run is not None:
+        process_run(run)
+        return send_batches + 1
+    if dispatch_due_sends():
+        return send_batches + 1
+    job = claim_next_import()
+    if job is not None:
+        process_import(job)
+        return 0
+    return None
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    with app.app_context():
+        requeue_stale_runs()
+        send_batches = 0
+        while True:
+            send_batches = work_once(send_batches)
+            if send_batches is not None:
+                continue
+            send_batches = 0
+            requeue_stale_runs()
+            # Wake for the next due send if it comes before the next poll for new jobs
+            wait = seconds_until_next_send()
+            time.sleep(POLL_INTERVAL if wait is None else min(wait, POLL_INTERVAL))
+
+
+if __name__ == '__main__':
+    main()